@@ -0,0 +1,114 @@
+"""
+    This script compares the running time of the aggregation paths of the Aggregator (aggregating each time chunk
+    separately and the block count cube, when it is built and when it is saved) on synthetic mapped data, and verifies
+    that they all produce the same results.
+"""
+import argparse
+import datetime
+import logging
+import pathlib
+import tempfile
+import time
+import numpy as np
+from consensus_decentralization.aggregate import Aggregator, divide_timeframe
+from consensus_decentralization.helper import get_mapped_columns_dir_name, get_mapped_data_filename, \
+    get_clustering_flag
+from consensus_decentralization.mapped_columns import write_mapped_columns
+
+
+def generate_mapped_columns(num_blocks, num_entities, start_date, num_days, seed=0):
+    """
+    Generates the columns of synthetic mapped data, with blocks sorted by date and creators drawn from a Zipf-like
+    distribution (so that a few entities produce most blocks)
+    :param num_blocks: int, the number of blocks
+    :param num_entities: int, the number of distinct entities
+    :param start_date: datetime.date object, the date of the first block
+    :param num_days: int, the number of days that the blocks span
+    :param seed: int, the seed of the random number generator
+    :returns: a dictionary with the columns (in the format of MappedColumnsBuilder.get_columns)
+    """
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, num_entities + 1)
+    return {
+        'number': np.arange(num_blocks, dtype=np.int64),
+        'day': np.sort(rng.integers(start_date.toordinal(), start_date.toordinal() + num_days, num_blocks)
+                       ).astype(np.int32),
+        'creator': rng.choice(num_entities, size=num_blocks, p=weights / weights.sum()).astype(np.int32),
+        'mapping_method': np.zeros(num_blocks, dtype=np.int8),
+        'creators': [f'entity_{i}' for i in range(num_entities)],
+        'mapping_methods': ['known_identifiers']
+    }
+
+
+def time_aggregation(name, aggregate_time_chunks, time_chunks):
+    """
+    Runs an aggregation path and logs its running time
+    :param name: string, the name of the aggregation path
+    :param aggregate_time_chunks: function that takes a list of time chunks and returns the blocks per entity of each
+    :param time_chunks: list of tuples of (start_date, end_date) where each date is a datetime.date object
+    :returns: the result of the aggregation (a list with a dictionary for each time chunk)
+    """
+    start_time = time.perf_counter()
+    blocks_per_entity_per_chunk = aggregate_time_chunks(time_chunks)
+    logging.info(f'{name}: {time.perf_counter() - start_time:.2f} s')
+    return blocks_per_entity_per_chunk
+
+
+def run_benchmark(num_blocks, num_entities, num_days, estimation_window, frequency, skip_per_chunk):
+    """
+    Aggregates synthetic mapped data with each aggregation path and checks that the results are the same
+    :param num_blocks: int, the number of blocks
+    :param num_entities: int, the number of distinct entities
+    :param num_days: int, the number of days that the blocks span
+    :param estimation_window: int, the number of days of each time chunk
+    :param frequency: int, the number of days between the starts of consecutive time chunks
+    :param skip_per_chunk: boolean, indicating whether the path that aggregates each chunk separately is skipped
+    :raises AssertionError: if some aggregation path produces different results
+    """
+    start_date = datetime.date(2018, 1, 1)
+    time_chunks = divide_timeframe(timeframe=(start_date, start_date + datetime.timedelta(days=num_days - 1)),
+                                   estimation_window=estimation_window, frequency=frequency)
+    logging.info(f'Aggregating {num_blocks} blocks of {num_entities} entities over {len(time_chunks)} time chunks '
+                 f'({estimation_window}-day windows sampled every {frequency} days)')
+
+    with tempfile.TemporaryDirectory() as io_dir:
+        io_dir = pathlib.Path(io_dir)
+        clustering_flag = get_clustering_flag()
+        mapped_data_file = io_dir / get_mapped_data_filename(clustering_flag)
+        mapped_data_file.touch()  # the columns are only associated with the (placeholder) mapped data file
+        write_mapped_columns(io_dir / get_mapped_columns_dir_name(clustering_flag),
+                             generate_mapped_columns(num_blocks, num_entities, start_date, num_days), mapped_data_file)
+        aggregator = Aggregator(project='benchmark', io_dir=io_dir)
+
+        results = {}
+        if not skip_per_chunk:
+            results['per chunk'] = time_aggregation(
+                'Per chunk', lambda chunks: [aggregator.aggregate(*chunk) for chunk in chunks], time_chunks)
+        results['cube'] = time_aggregation('Cube (including building it)', aggregator.aggregate_time_chunks,
+                                           time_chunks)
+        results['saved cube'] = time_aggregation(
+            'Cube (saved)', Aggregator(project='benchmark', io_dir=io_dir).aggregate_time_chunks, time_chunks)
+
+    reference_name, reference = next(iter(results.items()))
+    for name, result in results.items():
+        if result != reference:
+            raise AssertionError(f'The {name} aggregation differs from the {reference_name} aggregation')
+    logging.info('All aggregation paths produced the same results')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s] %(message)s', datefmt='%Y/%m/%d %I:%M:%S %p', level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=10000000, help='The number of synthetic blocks.')
+    parser.add_argument('--entities', type=int, default=1000, help='The number of distinct entities.')
+    parser.add_argument('--days', type=int, default=1500, help='The number of days that the blocks span.')
+    parser.add_argument('--estimation_window', type=int, default=30, help='The number of days of each time chunk.')
+    parser.add_argument('--frequency', type=int, default=30, help='The number of days between time chunks.')
+    parser.add_argument('--skip_per_chunk', action='store_true',
+                        help='Skip the (slowest) path that aggregates each time chunk separately.')
+    args = parser.parse_args()
+
+    run_benchmark(num_blocks=args.blocks, num_entities=args.entities, num_days=args.days,
+                  estimation_window=args.estimation_window, frequency=args.frequency,
+                  skip_per_chunk=args.skip_per_chunk)
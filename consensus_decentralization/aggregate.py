@@ -1,7 +1,13 @@
 import logging
 from collections import defaultdict
 import datetime
+import numpy as np
 import consensus_decentralization.helper as hlp
+import consensus_decentralization.stage_cache as cache
+from consensus_decentralization.mapped_columns import MappedColumnsBuilder
+from consensus_decentralization.block_count_cube import BlockCountCube
+
+END_SEARCH_BATCH_SIZE = 65536
 
 
 class Aggregator:
@@ -10,24 +16,50 @@ class Aggregator:
     and aggregates the results for a given timeframe (e.g. month) by counting the number of blocks produced by
     each entity. The result is a dictionary of entities that produced blocks in the given timeframe and the number of
     blocks they produced
+
+    :ivar block_days: array with the day ordinal (see datetime.date.toordinal) of each mapped block
+    :ivar block_creators: array with the index of the creator (entity) of each mapped block in the creators list
+    :ivar creators: list with the distinct creators of the mapped blocks
+    :ivar mapped_data_file: the file that the mapped data were read from, or None if they were given directly
     """
 
     def __init__(self, project, io_dir, mapped_data=None):
         """
         :param project: str. Name of the project
         :param io_dir: Path. Path to the project's output directory
+        :param mapped_data: iterable of dictionaries (mapped block data) or None. If None, the (columnar) mapped data
+            are read from the project's output directory
         """
         self.project = project
-        self.data_to_aggregate = hlp.read_mapped_project_data(io_dir) if mapped_data is None else mapped_data
-        self.data_start_date = hlp.get_timeframe_beginning(hlp.get_date_from_block(self.data_to_aggregate[0]))
-        self.data_end_date = hlp.get_timeframe_beginning(hlp.get_date_from_block(self.data_to_aggregate[-1]))
-        self.aggregated_data_dir = io_dir / hlp.get_aggregated_data_dir_name(hlp.get_clustering_flag())
+        clustering_flag = hlp.get_clustering_flag()
+        self.aggregated_data_dir = io_dir / hlp.get_aggregated_data_dir_name(clustering_flag)
         self.aggregated_data_dir.mkdir(parents=True, exist_ok=True)
+        self.block_count_cube_dir = io_dir / hlp.get_block_count_cube_dir_name(clustering_flag)
 
-        self.monthly_data_breaking_points = [(self.data_start_date.strftime('%Y-%m'), 0)]
-        for idx, block in enumerate(self.data_to_aggregate):
-            block_month = hlp.get_date_from_block(block, level='month')
-            if block_month != self.monthly_data_breaking_points[-1][0]:
+        if mapped_data is None:
+            self.mapped_data_file = io_dir / hlp.get_mapped_data_filename(clustering_flag)
+            columns = hlp.read_mapped_project_columns(io_dir)
+        else:
+            self.mapped_data_file = None
+            columns_builder = MappedColumnsBuilder()
+            for block in mapped_data:
+                columns_builder.add(block)
+            columns = columns_builder.get_columns()
+        self.block_days = columns['day']
+        self.block_creators = columns['creator']
+        self.creators = columns['creators']
+
+        self.monthly_data_breaking_points = []
+        if len(self.block_days) == 0:  # e.g. no blocks were produced within the timeframe that was mapped
+            self.data_start_date = self.data_end_date = None
+            return
+        self.data_start_date = datetime.date.fromordinal(int(self.block_days[0]))
+        self.data_end_date = datetime.date.fromordinal(int(self.block_days[-1]))
+        # the month can only change at the blocks where the day changes
+        day_change_indices = np.flatnonzero(self.block_days[1:] != self.block_days[:-1]) + 1
+        for idx in [0] + day_change_indices.tolist():
+            block_month = datetime.date.fromordinal(int(self.block_days[idx])).strftime('%Y-%m')
+            if not self.monthly_data_breaking_points or block_month != self.monthly_data_breaking_points[-1][0]:
                 self.monthly_data_breaking_points.append((block_month, idx))
 
     def aggregate(self, timeframe_start, timeframe_end):
@@ -39,21 +71,69 @@ class Aggregator:
         timeframe_start and timeframe_end (inclusive)
         """
         blocks_per_entity = defaultdict(int)
-        if self.data_start_date <= timeframe_end and self.data_end_date >= timeframe_start:
+        if self.data_start_date is not None and self.data_start_date <= timeframe_end and \
+                self.data_end_date >= timeframe_start:
             start_index = 0
             for month, month_block_index in self.monthly_data_breaking_points:
                 if timeframe_start >= hlp.get_timeframe_beginning(month):
                     start_index = max(month_block_index - 1, 0)
                     break
-            for block in self.data_to_aggregate[start_index:]:
-                block_timestamp = hlp.get_timeframe_beginning(hlp.get_date_from_block(block))
-                if timeframe_start <= block_timestamp <= timeframe_end:
-                    blocks_per_entity[block['creator']] += 1
-                elif timeframe_end < block_timestamp:
-                    break
+            end_index = self.get_end_index(start_index, timeframe_end)
+            block_days = self.block_days[start_index:end_index]
+            in_timeframe = (block_days >= timeframe_start.toordinal()) & (block_days <= timeframe_end.toordinal())
+            creator_ids, first_indices, counts = np.unique(self.block_creators[start_index:end_index][in_timeframe],
+                                                           return_index=True, return_counts=True)
+            # the entities are listed in the order in which they first produced a block within the timeframe
+            for i in np.argsort(first_indices, kind='stable'):
+                blocks_per_entity[self.creators[creator_ids[i]]] = int(counts[i])
 
         return blocks_per_entity
 
+    def aggregate_time_chunks(self, time_chunks):
+        """
+        Aggregates the mapped data for a sequence of time chunks (e.g. sliding windows). If the blocks are sorted by
+        date, the block counts of the chunks are computed from the project's block count cube (see
+        get_block_count_cube), otherwise each chunk is aggregated separately (see aggregate).
+        :param time_chunks: list of tuples of (start_date, end_date) where each date is a datetime.date object
+        :returns: a list with a dictionary for each time chunk, with the entities and the number of blocks they have
+        produced in the period between the chunk's start and end dates (inclusive)
+        """
+        block_count_cube = self.get_block_count_cube()
+        if block_count_cube.blocks_sorted:
+            return block_count_cube.aggregate_time_chunks(time_chunks)
+        return [self.aggregate(chunk_start, chunk_end) for chunk_start, chunk_end in time_chunks]
+
+    def get_block_count_cube(self):
+        """
+        Loads the block count cube of the project (see block_count_cube module), or builds and saves it if it does not
+        exist or the mapped data have changed since it was built. If the mapped data were given directly, the cube is
+        built (but not saved).
+        :returns: a BlockCountCube object
+        """
+        if self.mapped_data_file is None:
+            return BlockCountCube.from_columns(self.block_days, self.block_creators, self.creators)
+        block_count_cube = BlockCountCube.load(self.block_count_cube_dir, self.mapped_data_file)
+        if block_count_cube is None:
+            block_count_cube = BlockCountCube.from_columns(self.block_days, self.block_creators, self.creators)
+            block_count_cube.save(self.block_count_cube_dir, self.mapped_data_file)
+        return block_count_cube
+
+    def get_end_index(self, start_index, timeframe_end):
+        """
+        Finds the first block (after some index) that was produced after the end of a timeframe, searching the blocks in
+        batches, so that only the blocks up to that point are read
+        :param start_index: int. The index of the block to start searching from
+        :param timeframe_end: datetime.date object
+        :returns: int, the index of the first block after start_index that was produced after timeframe_end, or the
+        number of blocks if there is no such block
+        """
+        end_ordinal = timeframe_end.toordinal()
+        for batch_start in range(start_index, len(self.block_days), END_SEARCH_BATCH_SIZE):
+            later_blocks = np.flatnonzero(self.block_days[batch_start:batch_start + END_SEARCH_BATCH_SIZE] > end_ordinal)
+            if len(later_blocks) > 0:
+                return batch_start + int(later_blocks[0])
+        return len(self.block_days)
+
 
 def divide_timeframe(timeframe, estimation_window, frequency):
     """
@@ -91,9 +171,12 @@ def divide_timeframe(timeframe, estimation_window, frequency):
 
 def aggregate(project, output_dir, timeframe, estimation_window, frequency, force_aggregate, mapped_data=None):
     """
-    Aggregates the results of the mapping process for the given project and timeframe. The results are saved in a csv
-    file in the project's output directory. Note that the output file is created (just with the headers) even if there
-    is no data to aggregate.
+    Aggregates the results of the mapping process for the given project and timeframe. The results are saved in a sparse
+    csv file (optionally compressed and optionally also in a dense csv file, depending on the config file) in the
+    project's output directory. Note that the output file is created (just with the headers) even if there is no data
+    to aggregate. Existing aggregated data are reused only if they were produced from the same inputs (mapped data,
+    parameters and code of the stage, see stage_cache); whether (and why) the aggregation ran is recorded in the stage
+    manifest of the project.
     :param project: the name of the project
     :param output_dir: the path to the general output directory
     :param timeframe: a tuple of (start_date, end_date) where each date is a datetime.date object
@@ -105,8 +188,10 @@ def aggregate(project, output_dir, timeframe, estimation_window, frequency, forc
         spanning the entire timeframe (i.e. it needs to be combined with None estimation_window).
     :param force_aggregate: bool. If True, then the aggregation will be performed, regardless of whether aggregated
         data for the project and specified window / frequency already exist
+    :param mapped_data: iterable of dictionaries (mapped block data) or None. If given, the aggregation is always
+        performed (on these data), otherwise the mapped data of the project are read from its output directory
     :returns: a list of strings that correspond to the time chunks of the aggregation or None if no aggregation took
-    place (the corresponding output file already existed and force_aggregate was set to False)
+    place (the corresponding output file already existed and was produced from the same inputs)
     """
     if estimation_window is not None:
         if timeframe[0] + datetime.timedelta(days=estimation_window - 1) > timeframe[1]:
@@ -116,24 +201,56 @@ def aggregate(project, output_dir, timeframe, estimation_window, frequency, forc
     aggregator = Aggregator(project, project_io_dir, mapped_data=mapped_data)
 
     filename = hlp.get_blocks_per_entity_filename(timeframe=timeframe, estimation_window=estimation_window, frequency=frequency)
-    output_file = aggregator.aggregated_data_dir / filename
+    dense_export = hlp.get_dense_export_flag()
+    compression = hlp.get_aggregation_compression()
+    is_aggregated = len(hlp.get_sparse_blocks_per_entity_filepaths(aggregator.aggregated_data_dir, filename)) > 0 and \
+        (not dense_export or (aggregator.aggregated_data_dir / filename).is_file())
+
+    clustering_flag = hlp.get_clustering_flag()
+    stage_id = f'aggregate:{aggregator.aggregated_data_dir.name}/{filename}'
+    stage_inputs = {
+        'mapped_data': hlp.get_mapped_data_fingerprint(project_io_dir, clustering_flag),
+        'clustering': clustering_flag,
+        'timeframe': [str(timeframe[0]), str(timeframe[1])],
+        'estimation_window': estimation_window,
+        'frequency': frequency,
+        'compression': compression,
+        'dense_export': dense_export,
+        'code': cache.get_code_fingerprint('aggregate')
+    }
+    if force_aggregate:
+        force_reason = 'forced by the force_map flag'
+    elif mapped_data is not None:
+        force_reason = 'mapped data given directly'
+    else:
+        force_reason = None
+    reason = cache.get_run_reason(project_io_dir, stage_id, stage_inputs, output_exists=is_aggregated,
+                                  force_reason=force_reason)
 
-    if not output_file.is_file() or force_aggregate:
-        logging.info(f'Aggregating {project} data..')
+    if reason is not None:
+        logging.info(f'Aggregating {project} data ({reason})..')
         timeframe_chunks = divide_timeframe(timeframe=timeframe, estimation_window=estimation_window, frequency=frequency)
         representative_dates = hlp.get_representative_dates(time_chunks=timeframe_chunks)
         blocks_per_entity = defaultdict(dict)
-        for i, chunk in enumerate(timeframe_chunks):
-            chunk_start, chunk_end = chunk
-            chunk_blocks_per_entity = aggregator.aggregate(chunk_start, chunk_end)
+        for i, chunk_blocks_per_entity in enumerate(aggregator.aggregate_time_chunks(timeframe_chunks)):
             for entity, blocks in chunk_blocks_per_entity.items():
                 blocks_per_entity[entity][representative_dates[i]] = blocks
 
-        hlp.write_blocks_per_entity_to_file(
+        hlp.write_sparse_blocks_per_entity_to_file(
             output_dir=aggregator.aggregated_data_dir,
             blocks_per_entity=blocks_per_entity,
             dates=representative_dates,
-            filename=filename
+            filename=filename,
+            compression=compression
         )
+        if dense_export:
+            hlp.write_blocks_per_entity_to_file(
+                output_dir=aggregator.aggregated_data_dir,
+                blocks_per_entity=blocks_per_entity,
+                dates=representative_dates,
+                filename=filename
+            )
+        cache.record_stage(project_io_dir, stage_id, stage_inputs, reason)
         return timeframe_chunks
+    cache.record_stage(project_io_dir, stage_id, stage_inputs, reason=None)
     return None
@@ -1,17 +1,62 @@
 import csv
 import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import consensus_decentralization.helper as hlp
-from consensus_decentralization.metrics.gini import compute_gini  # noqa: F401
-from consensus_decentralization.metrics.nakamoto_coefficient import compute_nakamoto_coefficient  # noqa: F401
-from consensus_decentralization.metrics.entropy import compute_entropy, compute_entropy_percentage  # noqa: F401
-from consensus_decentralization.metrics.herfindahl_hirschman_index import compute_hhi  # noqa: F401
-from consensus_decentralization.metrics.theil_index import compute_theil_index  # noqa: F401
-from consensus_decentralization.metrics.concentration_ratio import compute_concentration_ratio  # noqa: F401
-from consensus_decentralization.metrics.tau_index import compute_tau_index  # noqa: F401
-from consensus_decentralization.metrics.total_entities import compute_total_entities  # noqa: F401
+from consensus_decentralization.metric_registry import compute_metrics
 
+RANGES_PER_WORKER = 4  # number of date ranges that each worker process handles (on average) when analyzing in parallel
 
-def analyze(projects, aggregated_data_filename, input_dir, output_dir, population_windows):
+
+def get_date_ranges(blocks_per_entity, num_ranges):
+    """
+    Splits the dates of some aggregated data into (at most) num_ranges contiguous ranges of similar cost, i.e. with a
+    similar number of dates and (non-zero) cells
+    :param blocks_per_entity: a BlocksPerEntity object
+    :param num_ranges: int, the number of ranges
+    :returns: a list of tuples (first_date, last_date), where last_date is the index of the date after the last date of
+    the range, in the order of the dates
+    """
+    num_dates = len(blocks_per_entity.dates)
+    cumulative_cost = blocks_per_entity.date_offsets + np.arange(num_dates + 1)
+    split_points = np.searchsorted(cumulative_cost, np.linspace(0, cumulative_cost[-1], num_ranges + 1)[1:-1])
+    boundaries = np.unique(np.concatenate(([0], split_points, [num_dates]))).tolist()
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def compute_metrics_in_parallel(aggregated_data_files, population_windows, metric_params, workers):
+    """
+    Computes the given metrics for the aggregated data of multiple projects using multiple processes. The dates of each
+    project are split into ranges (see get_date_ranges) and each (project, date range) work unit is handled by a pool
+    of worker processes. The results of the ranges are then merged in the order of the dates, so that they are the
+    same as when computing them sequentially.
+    :param aggregated_data_files: list of pathlib.PosixPath objects, the files with the aggregated data of the projects
+    :param population_windows: the number of windows to look backwards and forwards to determine the population of
+        active block producers for a given time period
+    :param metric_params: list of tuples (metric_name, metric, param), where param is the parameter of the metric (or
+        None)
+    :param workers: int, the number of worker processes
+    :returns: a generator of tuples (dates, results), one for each project (in the given order), where results is a
+    dictionary with the metric names (keys) and a list with the value of the metric for each date (values)
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        project_futures = []
+        for filepath in aggregated_data_files:
+            blocks_per_entity = hlp.get_blocks_per_entity_array_from_file(filepath, population_windows)
+            date_ranges = get_date_ranges(blocks_per_entity, workers * RANGES_PER_WORKER)
+            project_futures.append((blocks_per_entity.dates, [
+                executor.submit(compute_metrics, blocks_per_entity.get_date_range(first_date, last_date),
+                                metric_params) for first_date, last_date in date_ranges]))
+
+        for dates, futures in project_futures:
+            results = {metric_name: [] for metric_name, _, _ in metric_params}
+            for future in futures:
+                for metric_name, range_results in future.result().items():
+                    results[metric_name].extend(range_results)
+            yield dates, results
+
+
+def analyze(projects, aggregated_data_filename, input_dir, output_dir, population_windows, workers=1):
     """
     Calculates all available metrics for the given ledgers and timeframes. Outputs one file for each metric.
     :param projects: list of strings that correspond to the ledgers whose data should be analyzed
@@ -20,6 +65,8 @@ def analyze(projects, aggregated_data_filename, input_dir, output_dir, populatio
     :param output_dir: the directory to save the results in
     :param population_windows: the number of windows to look backwards and forwards to determine the population of
     active block producers for a given time period
+    :param workers: int, the number of worker processes to use for computing the metrics (1 means no parallelism, see
+        compute_metrics_in_parallel)
     :returns: a list with the names of all the metrics that were used
 
     Using multiple projects and timeframes is necessary here to produce collective csv files.
@@ -45,40 +92,26 @@ def analyze(projects, aggregated_data_filename, input_dir, output_dir, populatio
         # The special entry ['timeframe', '<comma-separated names of projects>'] is for the csv header
         csv_contents[metric] = [['timeframe'] + projects]
 
-    for column_index, project in enumerate(projects):
+    aggregated_data_files = [input_dir / project / hlp.get_aggregated_data_dir_name(clustering_flag) /
+                             aggregated_data_filename for project in projects]
+    if workers > 1:
+        project_results = compute_metrics_in_parallel(aggregated_data_files, population_windows, metric_params, workers)
+    else:
+        project_results = ((blocks_per_entity.dates, compute_metrics(blocks_per_entity, metric_params))
+                           for blocks_per_entity in (hlp.get_blocks_per_entity_array_from_file(
+                               filepath, population_windows) for filepath in aggregated_data_files))
+
+    for column_index, (project, (dates, results)) in enumerate(zip(projects, project_results)):
         logging.info(f'Calculating {project} metrics')
         aggregate_output[project] = {}
-        aggregated_data_dir = input_dir / project / hlp.get_aggregated_data_dir_name(clustering_flag)
-        dates, blocks_per_entity = hlp.get_blocks_per_entity_from_file(aggregated_data_dir /
-                                                                       aggregated_data_filename, population_windows)
         for date in dates:
             aggregate_output[project][date] = {}
 
-        dates_with_blocks = set()
-        for block_values in blocks_per_entity.values():
-            for date, nblocks in block_values.items():
-                if nblocks > 0:
-                    dates_with_blocks.add(date)
-
         for row_index, date in enumerate(dates):
-            date_blocks_per_entity = {}
-            if column_index == 0:
-                for metric_name, _, _ in metric_params:
+            for metric_name, _, _ in metric_params:
+                if column_index == 0:
                     csv_contents[metric_name].append([date])
-            if date in dates_with_blocks:
-                for entity, block_values in blocks_per_entity.items():
-                    try:
-                        date_blocks_per_entity[entity] = block_values[date]
-                    except KeyError:
-                        pass
-            sorted_date_blocks = sorted(date_blocks_per_entity.values(), reverse=True)
-
-            for metric_name, metric, param in metric_params:
-                func = eval(f'compute_{metric}')
-                if param:
-                    result = func(sorted_date_blocks, param)
-                else:
-                    result = func(sorted_date_blocks)
+                result = results[metric_name][row_index]
                 csv_contents[metric_name][row_index + 1].append(result)
                 aggregate_output[project][date][metric_name] = result
 
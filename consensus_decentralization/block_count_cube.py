@@ -0,0 +1,137 @@
+"""
+Module with the (sparse) entity x day cube of block counts, which is used to aggregate the mapped data of a project over
+any time chunks without going through the blocks
+"""
+import json
+import os
+import shutil
+from collections import defaultdict
+import numpy as np
+from consensus_decentralization.mapped_columns import get_file_signature
+
+CUBE_ARRAYS = ['keys', 'cumulative_counts', 'first_block_indices', 'entity_offsets']
+DICTIONARY_FILENAME = 'dictionary.json'
+DAY_BITS = 32
+
+
+class BlockCountCube:
+    """
+    Class that holds the number of blocks that each entity produced on each day (only for the days on which the entity
+    produced at least one block), as prefix sums, so that the number of blocks of an entity within any time chunk is
+    the difference of two prefix sums.
+
+    :ivar keys: sorted array with one key for each (entity, day) pair with at least one block, in the form
+        (entity index << DAY_BITS) + day ordinal
+    :ivar cumulative_counts: array with the total number of blocks of all the (entity, day) pairs before each key
+        (the first element is 0 and the last one is the total number of blocks)
+    :ivar first_block_indices: array with the index (in the mapped data) of the first block of each (entity, day) pair
+    :ivar entity_offsets: array with the position of the first key of each entity (and the number of keys at the end)
+    :ivar creators: list with the distinct creators of the mapped blocks (the entities)
+    :ivar blocks_sorted: boolean, indicating whether the mapped blocks were sorted by date
+    """
+
+    def __init__(self, keys, cumulative_counts, first_block_indices, entity_offsets, creators, blocks_sorted):
+        self.keys = keys
+        self.cumulative_counts = cumulative_counts
+        self.first_block_indices = first_block_indices
+        self.entity_offsets = entity_offsets
+        self.creators = creators
+        self.blocks_sorted = blocks_sorted
+
+    @classmethod
+    def from_columns(cls, block_days, block_creators, creators):
+        """
+        Builds the cube from the columns of some mapped data (see mapped_columns module)
+        :param block_days: array with the day ordinal of each block
+        :param block_creators: array with the index of the creator of each block
+        :param creators: list with the distinct creators of the blocks
+        :returns: a BlockCountCube object
+        """
+        block_keys = (np.asarray(block_creators, dtype=np.int64) << DAY_BITS) + np.asarray(block_days, dtype=np.int64)
+        order = np.argsort(block_keys, kind='stable')  # stable, so the first block of each key comes first
+        sorted_keys = block_keys[order]
+        # the first block starts a key (unless there are no blocks), as does each block whose key differs from the previous
+        key_starts = np.flatnonzero(np.concatenate(([len(sorted_keys) > 0], sorted_keys[1:] != sorted_keys[:-1])))
+        keys = sorted_keys[key_starts]
+        cumulative_counts = np.append(key_starts, len(sorted_keys)).astype(np.int64)
+        entity_offsets = np.searchsorted(keys, np.arange(len(creators) + 1, dtype=np.int64) << DAY_BITS)
+        return cls(
+            keys=keys,
+            cumulative_counts=cumulative_counts,
+            first_block_indices=order[key_starts].astype(np.int64),
+            entity_offsets=entity_offsets.astype(np.int64),
+            creators=list(creators),
+            blocks_sorted=bool(np.all(block_days[1:] >= block_days[:-1]))
+        )
+
+    def save(self, cube_dir, mapped_data_file):
+        """
+        Saves the cube into a directory (one .npy file per array and a json file with the creators). The cube is first
+        written into a temporary directory, which then replaces any existing one.
+        :param cube_dir: pathlib.Path object of the directory where the cube will be saved
+        :param mapped_data_file: pathlib.Path object of the mapped data file that the cube corresponds to
+        """
+        tmp_dir = cube_dir.with_name(cube_dir.name + '.tmp')
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+        for array_name in CUBE_ARRAYS:
+            np.save(tmp_dir / f'{array_name}.npy', getattr(self, array_name))
+        with open(tmp_dir / DICTIONARY_FILENAME, 'w') as f:
+            json.dump({
+                'creators': self.creators,
+                'blocks_sorted': self.blocks_sorted,
+                'mapped_data_signature': get_file_signature(mapped_data_file)
+            }, f)
+        if cube_dir.exists():
+            shutil.rmtree(cube_dir)
+        os.replace(tmp_dir, cube_dir)
+
+    @classmethod
+    def load(cls, cube_dir, mapped_data_file):
+        """
+        Loads a saved cube (memory-mapping its arrays)
+        :param cube_dir: pathlib.Path object of the directory where the cube is saved
+        :param mapped_data_file: pathlib.Path object of the mapped data file that the cube should correspond to
+        :returns: a BlockCountCube object or None if there is no cube or it does not correspond to the current mapped
+        data file
+        """
+        try:
+            with open(cube_dir / DICTIONARY_FILENAME) as f:
+                dictionary = json.load(f)
+            if dictionary['mapped_data_signature'] != get_file_signature(mapped_data_file):
+                return None
+        except FileNotFoundError:
+            return None
+        arrays = {array_name: np.load(cube_dir / f'{array_name}.npy', mmap_mode='r') for array_name in CUBE_ARRAYS}
+        return cls(**arrays, creators=dictionary['creators'], blocks_sorted=dictionary['blocks_sorted'])
+
+    def aggregate_time_chunks(self, time_chunks):
+        """
+        Computes the number of blocks that each entity produced within each time chunk, by differencing prefix sums
+        :param time_chunks: list of tuples of (start_date, end_date) where each date is a datetime.date object
+        :returns: a list with a dictionary for each time chunk, with the entities and the number of blocks they have
+        produced in the period between the chunk's start and end dates (inclusive). The entities of each chunk are
+        listed in the order in which they first produced a block within the chunk.
+        """
+        entity_first_keys = self.keys[self.entity_offsets[:-1]]
+        entity_last_keys = self.keys[self.entity_offsets[1:] - 1]
+        entity_bases = np.arange(len(self.creators), dtype=np.int64) << DAY_BITS
+        entity_first_days, entity_last_days = entity_first_keys - entity_bases, entity_last_keys - entity_bases
+
+        blocks_per_entity_per_chunk = []
+        for chunk_start, chunk_end in time_chunks:
+            start_day, end_day = chunk_start.toordinal(), chunk_end.toordinal()
+            candidates = np.flatnonzero((entity_first_days <= end_day) & (entity_last_days >= start_day))
+            start_positions = np.searchsorted(self.keys, entity_bases[candidates] + start_day, side='left')
+            end_positions = np.searchsorted(self.keys, entity_bases[candidates] + end_day, side='right')
+            active = end_positions > start_positions
+            candidates, start_positions, end_positions = \
+                candidates[active], start_positions[active], end_positions[active]
+            counts = self.cumulative_counts[end_positions] - self.cumulative_counts[start_positions]
+            order = np.argsort(self.first_block_indices[start_positions], kind='stable')
+            blocks_per_entity_per_chunk.append(defaultdict(int, {
+                self.creators[creator]: count for creator, count in zip(candidates[order].tolist(),
+                                                                        counts[order].tolist())
+            }))
+        return blocks_per_entity_per_chunk
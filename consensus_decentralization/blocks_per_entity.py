@@ -0,0 +1,144 @@
+"""
+Module with the array-backed representation of aggregated data (the number of blocks that each entity produced in each
+time chunk), which is used when analyzing and plotting the data
+"""
+import numpy as np
+
+
+class BlocksPerEntity:
+    """
+    Class that holds the number of blocks that each entity produced in each time chunk (date), in a sparse format:
+    only the (date, entity) cells with a positive number of blocks are stored, sorted by date and then by entity. An
+    entity is part of the population of a date if it produced blocks in some date that is at most population_windows
+    dates before or after it (or in any date if population_windows is 'all'). The entities that are part of the
+    population of a date without producing blocks in it are not stored, only their number.
+
+    :ivar dates: list of strings, each representing a time chunk
+    :ivar entities: list of strings, the names of the entities
+    :ivar date_offsets: array with the position of the first cell of each date (and the number of cells at the end)
+    :ivar entity_indices: array with the index of the entity (in the entities list) of each cell
+    :ivar counts: array with the (positive) number of blocks of each cell
+    :ivar population_sizes: array with the number of entities that are part of the population of each date
+    :ivar population_windows: int or 'all', the population windows that were used to determine the populations
+    """
+
+    def __init__(self, dates, entities, date_offsets, entity_indices, counts, population_sizes, population_windows):
+        self.dates = dates
+        self.entities = entities
+        self.date_offsets = date_offsets
+        self.entity_indices = entity_indices
+        self.counts = counts
+        self.population_sizes = population_sizes
+        self.population_windows = population_windows
+
+    @classmethod
+    def from_cells(cls, dates, entities, entity_indices, date_indices, counts, population_windows):
+        """
+        Builds the sparse representation from the (distinct) cells with a positive number of blocks. The population
+        of each date is computed as a dilation of the mask of non-zero cells along the date axis (i.e. a rolling
+        maximum with a window of 2 * population_windows + 1 dates), using only array operations: the windows around
+        the non-zero cells of each entity are merged into intervals of dates and the population of a date is the
+        number of intervals that contain it.
+        :param dates: list of strings, each representing a time chunk
+        :param entities: list of strings, the names of the entities
+        :param entity_indices: array-like with the entity index of each cell with a positive number of blocks
+        :param date_indices: array-like with the date index of each cell with a positive number of blocks
+        :param counts: array-like with the number of blocks of each cell
+        :param population_windows: int representing the number of windows to look back and forward when determining if
+            an entity is active during a certain time frame, or 'all' to consider all entities active in all time frames
+        :returns: a BlocksPerEntity object
+        """
+        num_dates = len(dates)
+        entity_indices = np.asarray(entity_indices, dtype=np.int64)
+        date_indices = np.asarray(date_indices, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.int64)
+        nonzero = counts > 0
+        order = np.lexsort((date_indices[nonzero], entity_indices[nonzero]))  # by entity and then by date
+        entity_indices, date_indices, counts = \
+            entity_indices[nonzero][order], date_indices[nonzero][order], counts[nonzero][order]
+
+        window = num_dates if population_windows == 'all' else population_windows
+        window_starts = np.maximum(date_indices - window, 0)
+        window_ends = np.minimum(date_indices + window, num_dates - 1)
+        # a new interval starts whenever the entity changes or the window is not adjacent to the previous one
+        new_interval = np.ones(len(counts), dtype=bool)
+        new_interval[1:] = (entity_indices[1:] != entity_indices[:-1]) | (window_starts[1:] > window_ends[:-1] + 1)
+        first_cells = np.flatnonzero(new_interval)
+        last_cells = np.append(first_cells[1:] - 1, len(counts) - 1) if len(counts) else first_cells
+        population_changes = np.bincount(window_starts[first_cells], minlength=num_dates + 1) - np.bincount(
+            window_ends[last_cells] + 1, minlength=num_dates + 1)
+        population_sizes = np.cumsum(population_changes)[:num_dates]
+
+        # the cells are sorted by entity, so a stable sort by date sorts them by date and then by entity
+        date_type = np.int16 if num_dates <= np.iinfo(np.int16).max else np.int64
+        order = np.argsort(date_indices.astype(date_type), kind='stable')
+        date_offsets = np.concatenate(([0], np.cumsum(np.bincount(date_indices, minlength=num_dates))))
+        return cls(dates=dates, entities=entities, date_offsets=date_offsets, entity_indices=entity_indices[order],
+                   counts=counts[order], population_sizes=population_sizes, population_windows=population_windows)
+
+    def get_date_counts(self, date_index):
+        """
+        :param date_index: int, the index of a date
+        :returns: array with the (positive) number of blocks of each entity that produced blocks in the date
+        """
+        return self.counts[self.date_offsets[date_index]:self.date_offsets[date_index + 1]]
+
+    def get_date_distribution(self, date_index):
+        """
+        :param date_index: int, the index of a date
+        :returns: a tuple of length 2 where the first item is a list with the (positive) number of blocks of each entity
+        that produced blocks in the date, sorted in descending order, and the second item is the number of entities
+        that are part of the population of the date without producing any blocks in it
+        """
+        date_counts = self.get_date_counts(date_index)
+        return sorted(date_counts.tolist(), reverse=True), int(self.population_sizes[date_index]) - len(date_counts)
+
+    def get_date_range(self, first_date, last_date):
+        """
+        :param first_date: int, the index of the first date of the range
+        :param last_date: int, the index of the date after the last date of the range
+        :returns: a BlocksPerEntity object with the dates in [first_date, last_date) only (the populations of these
+        dates are kept as they are, i.e. they still take into account the dates outside the range)
+        """
+        offsets = self.date_offsets[first_date:last_date + 1]
+        return BlocksPerEntity(dates=self.dates[first_date:last_date], entities=self.entities,
+                               date_offsets=offsets - offsets[0],
+                               entity_indices=self.entity_indices[offsets[0]:offsets[-1]],
+                               counts=self.counts[offsets[0]:offsets[-1]],
+                               population_sizes=self.population_sizes[first_date:last_date],
+                               population_windows=self.population_windows)
+
+    def to_dense(self):
+        """
+        :returns: a 2-dimensional array (entities x dates) with the number of blocks of each entity in each date
+        """
+        dense = np.zeros((len(self.entities), len(self.dates)), dtype=np.int64)
+        cell_dates = np.repeat(np.arange(len(self.dates)), np.diff(self.date_offsets))
+        dense[self.entity_indices, cell_dates] = self.counts
+        return dense
+
+    def to_dict(self):
+        """
+        :returns: a dictionary with entities (keys) and a dictionary with the number of blocks they produced during
+        each date in which they are part of the population (values)
+        """
+        num_dates = len(self.dates)
+        cell_dates = np.repeat(np.arange(num_dates), np.diff(self.date_offsets))
+        blocks_per_date_index = {}
+        for entity_index, date_index, count in zip(self.entity_indices.tolist(), cell_dates.tolist(),
+                                                   self.counts.tolist()):
+            blocks_per_date_index.setdefault(entity_index, {})[date_index] = count
+
+        blocks_per_entity = {}
+        for entity_index, entity in enumerate(self.entities):
+            if entity_index not in blocks_per_date_index:
+                continue
+            entity_blocks = blocks_per_date_index[entity_index]
+            if self.population_windows == 'all':
+                active_indices = range(num_dates)
+            else:
+                active_indices = sorted({idx for date_index in entity_blocks.keys() for idx in range(
+                    max(0, date_index - self.population_windows),
+                    min(num_dates, date_index + self.population_windows + 1))})
+            blocks_per_entity[entity] = {self.dates[idx]: entity_blocks.get(idx, 0) for idx in active_indices}
+        return blocks_per_entity
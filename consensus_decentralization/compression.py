@@ -0,0 +1,122 @@
+"""
+Module with functions for reading and writing (optionally) compressed raw data files
+"""
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.zst': 'zstd'
+}
+COMPRESSION_MAGIC_BYTES = {
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bz2',
+    b'\xfd7zXZ\x00': 'xz',
+    b'\x28\xb5\x2f\xfd': 'zstd'
+}
+
+
+class BoundedReader(io.RawIOBase):
+    """
+    A readable stream that only exposes a limited number of bytes of another stream (starting from its current
+    position), so that a compressed file can be decompressed up to some byte offset
+
+    :ivar raw: the underlying (binary) stream
+    :ivar remaining: the number of bytes that can still be read from the underlying stream
+    """
+
+    def __init__(self, raw, size):
+        self.raw = raw
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        num_bytes = self.raw.readinto(memoryview(buffer)[:self.remaining])
+        self.remaining -= num_bytes
+        return num_bytes
+
+
+def get_compression(filepath):
+    """
+    Determines the compression format of a file, based on its extension or, if the extension is not a known one, on
+    its first bytes (magic number)
+    :param filepath: pathlib.Path object that corresponds to the file
+    :returns: string with the compression format ('gzip', 'bz2', 'xz' or 'zstd') or None if the file is not compressed
+    (or does not exist and has no compression extension)
+    """
+    if filepath.suffix in COMPRESSION_EXTENSIONS.keys():
+        return COMPRESSION_EXTENSIONS[filepath.suffix]
+    try:
+        with open(filepath, 'rb') as f:
+            header = f.read(max(len(magic_bytes) for magic_bytes in COMPRESSION_MAGIC_BYTES.keys()))
+    except FileNotFoundError:
+        return None
+    for magic_bytes, compression in COMPRESSION_MAGIC_BYTES.items():
+        if header.startswith(magic_bytes):
+            return compression
+    return None
+
+
+def get_zstandard():
+    """
+    Imports the (optional) zstandard package, which is required for reading and writing zstd-compressed files
+    :returns: the zstandard module
+    :raises ModuleNotFoundError: if the package is not installed
+    """
+    try:
+        import zstandard
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError('Reading or writing zstd-compressed raw data requires the zstandard package. Please '
+                                  'install it (e.g. with "python -m pip install zstandard") or use a different '
+                                  'compression format (gzip, bz2 or xz).')
+    return zstandard
+
+
+@contextlib.contextmanager
+def open_file(filepath, mode='rb', start=0, end=None):
+    """
+    Opens a (possibly compressed) file in binary mode, transparently (de)compressing its contents in a streaming way.
+    A compressed file may consist of multiple compressed streams (e.g. gzip members or zstd frames), each appended to
+    the file at a different time, so reading can start at the byte offset of any of them.
+    :param filepath: pathlib.Path object that corresponds to the file
+    :param mode: 'rb' to read the file or 'wb' / 'ab' to (over)write / append to the file. When writing, the
+        compression format is determined by the extension of the file
+    :param start: the byte offset of the (compressed) file to start reading from
+    :param end: the byte offset of the (compressed) file to stop reading at, or None to read until the end of the file.
+        Note that for uncompressed files the reading is not restricted to this offset
+    :returns: a binary file object with the (decompressed) contents of the file
+    :raises ModuleNotFoundError: if the file is zstd-compressed and the zstandard package is not installed
+    """
+    compression = get_compression(filepath) if mode == 'rb' else COMPRESSION_EXTENSIONS.get(filepath.suffix)
+    with open(filepath, mode) as raw:
+        if compression is None:
+            if mode == 'rb':
+                raw.seek(start)
+            yield raw
+            return
+        if mode == 'rb':
+            raw.seek(start)
+            if end is not None:
+                raw = io.BufferedReader(BoundedReader(raw, end - start))
+        if compression == 'gzip':
+            f = gzip.GzipFile(fileobj=raw, mode=mode)
+        elif compression == 'bz2':
+            f = bz2.BZ2File(raw, mode=mode)
+        elif compression == 'xz':
+            f = lzma.LZMAFile(raw, mode=mode)
+        elif mode == 'rb':
+            f = io.BufferedReader(get_zstandard().ZstdDecompressor().stream_reader(raw, read_across_frames=True,
+                                                                                   closefd=False))
+        else:
+            f = get_zstandard().ZstdCompressor().stream_writer(raw, closefd=False)
+        with f:
+            yield f
@@ -1,17 +1,26 @@
 """
 Module with helper functions
 """
+import array
 import csv
+import hashlib
+import os
 import pathlib
 import json
+import shutil
 import datetime
 import calendar
 import argparse
+import bisect
+import io
 from functools import lru_cache
-from collections import defaultdict
 
 from yaml import safe_load
 
+from consensus_decentralization.blocks_per_entity import BlocksPerEntity
+from consensus_decentralization.mapped_columns import MappedColumnsBuilder, write_mapped_columns, read_mapped_columns
+from consensus_decentralization.compression import COMPRESSION_EXTENSIONS, open_file
+
 ROOT_DIR = pathlib.Path(__file__).resolve().parent.parent
 INTERIM_DIR = ROOT_DIR / 'processed_data'
 MAPPING_INFO_DIR = ROOT_DIR / 'mapping_information'
@@ -117,11 +126,24 @@ def get_pool_legal_links(timeframe):
     start = get_timeframe_beginning(timeframe)
     end = get_timeframe_end(timeframe)
 
-    legal_links = {}
-
     with open(MAPPING_INFO_DIR / 'legal_links.json') as f:
         legal_data = json.load(f)
 
+    return resolve_legal_links(legal_data, start, end)
+
+
+def resolve_legal_links(legal_data, start, end):
+    """
+    Determines the links between pools that are active at some point within a time period and resolves chains of
+    links, so that each pool is linked to its highest-level entity
+    :param legal_data: dictionary with the contents of the legal links file
+    :param start: date object that corresponds to the beginning of the period
+    :param end: date object that corresponds to the end of the period
+    :returns: a dictionary that reveals the ownership of pools
+    :raises AssertionError: if there is a circular dependency between the links
+    """
+    legal_links = {}
+
     for cluster_name, pools in legal_data.items():
         for pool_info in pools:
             link_start, link_end = get_time_period(pool_info['from'], pool_info['to'])
@@ -150,6 +172,61 @@ def get_pool_legal_links(timeframe):
     return legal_links
 
 
+@lru_cache(maxsize=1)
+def get_legal_links_timeline():
+    """
+    Compiles the legal links file into a timeline, i.e. a sorted list of the days on which some link starts or stops
+    being active (change points). Between two consecutive change points the same links are active, so the links of all
+    the days of such a period (epoch) are the same and need to be resolved only once (which happens the first time
+    that they are needed, see get_legal_links_on_day). The file is only read once and the timeline is shared by all
+    callers (e.g. the mappings of all ledgers).
+    :returns: a dictionary with the contents of the legal links file ('legal_data'), the sorted change points as
+    strings in YYYY-MM-DD format ('change_points') and a list with the resolved links of each epoch, or None for
+    epochs that have not been resolved yet ('legal_links')
+    """
+    with open(MAPPING_INFO_DIR / 'legal_links.json') as f:
+        legal_data = json.load(f)
+
+    change_points = {datetime.date.min}
+    for pools in legal_data.values():
+        for pool_info in pools:
+            link_start, link_end = get_time_period(pool_info['from'], pool_info['to'])
+            change_points.add(link_start)
+            if link_end < datetime.date.max:
+                change_points.add(link_end + datetime.timedelta(days=1))
+    change_points = sorted(change_points)
+
+    return {
+        'legal_data': legal_data,
+        'change_points': [change_point.isoformat() for change_point in change_points],
+        'legal_links': [None] * len(change_points)
+    }
+
+
+def get_legal_links_epoch(day):
+    """
+    Determines the epoch of the legal links timeline (see get_legal_links_timeline) that a day falls into
+    :param day: string in YYYY-MM-DD format
+    :returns: int, the index of the epoch
+    """
+    return bisect.bisect_right(get_legal_links_timeline()['change_points'], day) - 1
+
+
+def get_legal_links_on_day(day):
+    """
+    Retrieves the links between pools that are active on some day, equivalent to get_pool_legal_links(timeframe=day)
+    but using the (compiled) legal links timeline, so that the lookup takes logarithmic time
+    :param day: string in YYYY-MM-DD format
+    :returns: a dictionary that reveals the ownership of pools
+    """
+    timeline = get_legal_links_timeline()
+    epoch = get_legal_links_epoch(day)
+    if timeline['legal_links'][epoch] is None:
+        epoch_start = datetime.date.fromisoformat(timeline['change_points'][epoch])
+        timeline['legal_links'][epoch] = resolve_legal_links(timeline['legal_data'], epoch_start, epoch_start)
+    return timeline['legal_links'][epoch]
+
+
 def get_known_addresses(project_name):
     """
     Retrieves the addresses associated with pools of a certain project over a given timeframe
@@ -190,37 +267,119 @@ def write_blocks_per_entity_to_file(output_dir, blocks_per_entity, dates, filena
             csv_writer.writerow(entity_row)
 
 
-def get_blocks_per_entity_from_file(filepath, population_windows):
+def get_sparse_blocks_per_entity_filename(filename, compression=None):
+    """
+    Determines the filename of the sparse version of an aggregated data file
+    :param filename: str, the filename of the (dense) csv file that contains the aggregated data (see
+        get_blocks_per_entity_filename)
+    :param compression: the compression format of the file ('gzip', 'bz2', 'xz' or 'zstd') or None
+    :returns: str that corresponds to the filename of the sparse file
+    """
+    extensions = {compression: extension for extension, compression in COMPRESSION_EXTENSIONS.items()}
+    return pathlib.Path(filename).stem + '.sparse.csv' + (extensions[compression] if compression else '')
+
+
+def get_sparse_blocks_per_entity_filepaths(output_dir, filename):
+    """
+    Finds the existing sparse versions (uncompressed or compressed) of an aggregated data file
+    :param output_dir: pathlib.PosixPath object of the directory of the aggregated data
+    :param filename: str, the filename of the (dense) csv file that contains the aggregated data
+    :returns: list of pathlib.PosixPath objects
+    """
+    filepaths = [output_dir / get_sparse_blocks_per_entity_filename(filename, compression)
+                 for compression in [None] + list(COMPRESSION_EXTENSIONS.values())]
+    return [filepath for filepath in filepaths if filepath.is_file()]
+
+
+def write_sparse_blocks_per_entity_to_file(output_dir, blocks_per_entity, dates, filename, compression=None):
+    """
+    Produces a sparse (long format) csv file with information about the resources (blocks) that each entity controlled
+    over some timeframe. Each row contains an entity, a date and the number of blocks that the entity produced in the
+    time chunk of the date, and only rows with a positive number of blocks are written. The first rows list all
+    dates (with an empty entity and number of blocks), so that dates without any blocks are also recorded. Any sparse
+    versions of the file with a different compression are removed.
+    :param output_dir: pathlib.PosixPath object of the output directory where the produced csv file is written to.
+    :param blocks_per_entity: a dictionary with entities as keys and dictionaries as values, where each dictionary maps
+        a date to the number of blocks produced by the entity in the corresponding time chunk
+    :param dates: a list of strings, each representing a chunk of time that was analyzed
+    :param filename: str, the filename of the (dense) csv file that corresponds to the aggregated data (see
+        get_blocks_per_entity_filename)
+    :param compression: the compression format of the file ('gzip', 'bz2', 'xz' or 'zstd') or None
+    :returns: pathlib.PosixPath object of the produced file
+    """
+    filepath = output_dir / get_sparse_blocks_per_entity_filename(filename, compression)
+    for other_filepath in get_sparse_blocks_per_entity_filepaths(output_dir, filename):
+        if other_filepath != filepath:
+            other_filepath.unlink()
+    with open_file(filepath, 'wb') as f, io.TextIOWrapper(f, newline='') as text_file:
+        csv_writer = csv.writer(text_file)
+        csv_writer.writerow(['Entity', 'Date', 'Blocks'])  # write header
+        csv_writer.writerows(['', date, ''] for date in dates)
+        for entity, blocks_per_chunk in blocks_per_entity.items():
+            csv_writer.writerows([entity, date, blocks_per_chunk[date]] for date in dates
+                                 if blocks_per_chunk.get(date, 0) > 0)
+    return filepath
+
+
+def get_blocks_per_entity_array_from_file(filepath, population_windows=0):
     """
-    Retrieves information about the number of blocks that each entity produced over some timeframe for some project.
-    :param filepath: the path to the file with the relevant information. It can be either an absolute or a relative
-    path in either a pathlib.PosixPath object or a string.
+    Retrieves information about the number of blocks that each entity produced over some timeframe for some project,
+    in an array-backed structure. If a sparse version of the file exists (see write_sparse_blocks_per_entity_to_file),
+    the data are read from it instead.
+    :param filepath: the path to the (dense) csv file with the relevant information. It can be either an absolute or a
+    relative path in either a pathlib.PosixPath object or a string.
     :param population_windows: int representing the number of windows to look back and forward when determining if an
-    entity is active during a certain time frame
-    :returns: a tuple of length 2 where the first item is a list of time chunks (strings) and the second item is a
-    dictionary with entities (keys) and a list of the number of blocks they produced during each time chunk (values)
-    """
-    blocks_per_entity = defaultdict(dict)
-    with open(filepath, newline='') as f:
-        csv_reader = csv.reader(f)
-        header = next(csv_reader, None)
-        dates = header[1:]
-        for row in csv_reader:
-            entity = row[0]
-            for idx, item in enumerate(row[1:]):
-                if item == '0':
-                    if population_windows == 'all':
-                        blocks_per_entity[entity][dates[idx]] = 0
-                    else:
-                        # If the entity hasn't produced any blocks in the current time chunk, we only consider it as
-                        # active if it has produced at least one block in population_windows time chunks before or after
-                        # (otherwise it's not considered part of the population for this time frame)
-                        for i in range(max(0, idx - population_windows), min(len(row) - 1, idx + population_windows + 1)):
-                            if row[i + 1] != '0':
-                                blocks_per_entity[entity][dates[idx]] = 0
+    entity is active during a certain time frame, or 'all' to consider all entities active in all time frames
+    :returns: a BlocksPerEntity object
+    """
+    filepath = pathlib.Path(filepath)
+    entity_ids = dict()
+    entity_indices, date_indices, counts = array.array('q'), array.array('q'), array.array('q')
+    sparse_filepaths = get_sparse_blocks_per_entity_filepaths(filepath.parent, filepath.name)
+    if sparse_filepaths:
+        dates = []
+        date_ids = dict()
+        with open_file(sparse_filepaths[0]) as f, io.TextIOWrapper(f, newline='') as text_file:
+            csv_reader = csv.reader(text_file)
+            next(csv_reader, None)  # skip header
+            for entity, date, blocks in csv_reader:
+                if entity:
+                    entity_indices.append(entity_ids.setdefault(entity, len(entity_ids)))
+                    date_indices.append(date_ids[date])
+                    counts.append(int(blocks))
                 else:
-                    blocks_per_entity[entity][dates[idx]] = int(item)
-    return dates, blocks_per_entity
+                    date_ids[date] = len(dates)
+                    dates.append(date)
+    else:
+        with open(filepath, newline='') as f:
+            csv_reader = csv.reader(f)
+            header = next(csv_reader, None)
+            dates = header[1:]
+            for row in csv_reader:
+                entity_index = entity_ids.setdefault(row[0], len(entity_ids))
+                for idx, item in enumerate(row[1:]):
+                    if item != '0':
+                        entity_indices.append(entity_index)
+                        date_indices.append(idx)
+                        counts.append(int(item))
+    return BlocksPerEntity.from_cells(dates=dates, entities=list(entity_ids.keys()), entity_indices=entity_indices,
+                                      date_indices=date_indices, counts=counts, population_windows=population_windows)
+
+
+def get_blocks_per_entity_from_file(filepath, population_windows=0):
+    """
+    Retrieves information about the number of blocks that each entity produced over some timeframe for some project
+    (see get_blocks_per_entity_array_from_file)
+    :param filepath: the path to the (dense) csv file with the relevant information. It can be either an absolute or a
+    relative path in either a pathlib.PosixPath object or a string.
+    :param population_windows: int representing the number of windows to look back and forward when determining if an
+    entity is active during a certain time frame, or 'all' to consider all entities active in all time frames
+    :returns: a tuple of length 2 where the first item is a list of time chunks (strings) and the second item is a
+    dictionary with entities (keys) and a dictionary with the number of blocks they produced during each time chunk in
+    which they are active (values)
+    """
+    blocks_per_entity = get_blocks_per_entity_array_from_file(filepath=filepath, population_windows=population_windows)
+    return blocks_per_entity.dates, blocks_per_entity.to_dict()
 
 
 def get_special_addresses(project_name):
@@ -300,15 +459,252 @@ def get_start_end_dates():
     return str(config['timeframe']['start_date']), str(config['timeframe']['end_date'])
 
 
+def get_mapped_data_metadata_filename(clustering_flag):
+    """
+    Retrieves the filename of the file with metadata about the mapped data (e.g. the timeframe that they cover)
+    :param clustering_flag: boolean that determines whether the data is clustered or not
+    :returns: str
+    """
+    return 'mapped_data_' + ('clustered' if clustering_flag else 'non_clustered') + '_metadata.json'
+
+
+def read_mapped_data_metadata(project_dir, clustering_flag):
+    """
+    Reads the metadata of the mapped data of a project
+    :param project_dir: pathlib.PosixPath object of the output directory corresponding to the project
+    :param clustering_flag: boolean that determines whether the data is clustered or not
+    :returns: a dictionary with the metadata, or an empty dictionary if no metadata exist (e.g. for mapped data that
+    were produced by an earlier version of the tool)
+    """
+    try:
+        with open(project_dir / get_mapped_data_metadata_filename(clustering_flag)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+
+def write_mapped_data_metadata(project_dir, clustering_flag, metadata):
+    """
+    Writes the metadata of the mapped data of a project
+    :param project_dir: pathlib.PosixPath object of the output directory corresponding to the project
+    :param clustering_flag: boolean that determines whether the data is clustered or not
+    :param metadata: dictionary with the metadata
+    """
+    with open(project_dir / get_mapped_data_metadata_filename(clustering_flag), 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+
+def get_mapped_data_fingerprint(project_dir, clustering_flag):
+    """
+    Computes a fingerprint of the mapped data of a project, so that it can be determined whether some aggregated data
+    were produced from the current mapped data or not. The metadata of the mapped data (raw data offsets, timeframe and
+    fingerprints of the mapping information and code) determine their contents, so the fingerprint is computed over
+    them, instead of over the (much larger) mapped data file.
+    :param project_dir: pathlib.PosixPath object of the output directory corresponding to the project
+    :param clustering_flag: boolean that determines whether the data is clustered or not
+    :returns: string, the hex digest of a hash over the metadata of the mapped data (or over the size and modification
+    time of the mapped data file, if no metadata exist), or None if there are no mapped data
+    """
+    metadata_file = project_dir / get_mapped_data_metadata_filename(clustering_flag)
+    mapped_data_file = project_dir / get_mapped_data_filename(clustering_flag)
+    if metadata_file.is_file():
+        return hashlib.sha256(metadata_file.read_bytes()).hexdigest()
+    if mapped_data_file.is_file():
+        stat = mapped_data_file.stat()
+        return hashlib.sha256(f'{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()
+    return None
+
+
+def get_mapped_timeframe(project_dir, clustering_flag):
+    """
+    Determines the timeframe that is covered by the mapped data of a project
+    :param project_dir: pathlib.PosixPath object of the output directory corresponding to the project
+    :param clustering_flag: boolean that determines whether the data is clustered or not
+    :returns: a tuple of (start_date, end_date) where each date is a datetime.date object. If the timeframe of the
+    mapped data is not recorded (mapped data from an earlier version of the tool, which always mapped all the raw
+    data), then the widest possible timeframe is returned
+    """
+    metadata = read_mapped_data_metadata(project_dir, clustering_flag)
+    try:
+        mapped_timeframe = metadata['timeframe']
+    except KeyError:
+        return datetime.date.min, datetime.date.max
+    return (datetime.date.fromisoformat(mapped_timeframe['start_date']),
+            datetime.date.fromisoformat(mapped_timeframe['end_date']))
+
+
+def get_mapping_info_fingerprint(project_name):
+    """
+    Computes a fingerprint of the mapping information that is used when mapping the data of a project, so that it can
+    be determined whether some mapped data were produced using the current mapping information or not
+    :param project_name: string that corresponds to the name of the project
+    :returns: string, the hex digest of a hash over the contents of all the (existing) mapping information files of the
+    project
+    """
+    fingerprint = hashlib.sha256()
+    for filepath in [
+        MAPPING_INFO_DIR / 'identifiers' / f'{project_name}.json',
+        MAPPING_INFO_DIR / 'addresses' / f'{project_name}.json',
+        MAPPING_INFO_DIR / 'clusters' / f'{project_name}.json',
+        MAPPING_INFO_DIR / 'legal_links.json',
+        MAPPING_INFO_DIR / 'special_addresses.json'
+    ]:
+        fingerprint.update(str(filepath.relative_to(MAPPING_INFO_DIR)).encode())
+        if filepath.is_file():
+            fingerprint.update(filepath.read_bytes())
+    return fingerprint.hexdigest()
+
+
+def get_appended_offsets(metadata, raw_data_sizes):
+    """
+    Determines the parts of the raw data files of a project that were appended after the data of the project were
+    mapped, based on the byte offsets recorded in the metadata of the mapped data
+    :param metadata: dictionary with the metadata of the mapped data
+    :param raw_data_sizes: dictionary that maps the path of each raw data file (string) to its current size in bytes
+    :returns: a dictionary that maps the path of each raw data file with appended data (string) to a tuple of (start,
+    end) byte offsets. If the metadata include no offsets (mapped data from an earlier version of the tool), then an
+    empty dictionary is returned. If some raw data file was removed or shrunk since the data were mapped (i.e. the
+    mapped data cannot simply be extended), then None is returned
+    """
+    try:
+        mapped_offsets = metadata['raw_data_offsets']
+    except KeyError:
+        return dict()
+    for filepath, offset in mapped_offsets.items():
+        if filepath not in raw_data_sizes.keys() or raw_data_sizes[filepath] < offset:
+            return None
+    return {filepath: (mapped_offsets.get(filepath, 0), size) for filepath, size in raw_data_sizes.items()
+            if size > mapped_offsets.get(filepath, 0)}
+
+
+def get_missing_timeframes(timeframe, mapped_timeframe):
+    """
+    Determines the parts of a timeframe that are not covered by the timeframe of some (already) mapped data. The
+    missing parts are chosen so that, once they are mapped, the mapped data cover one contiguous timeframe.
+    :param timeframe: a tuple of (start_date, end_date) where each date is a datetime.date object
+    :param mapped_timeframe: a tuple of (start_date, end_date) where each date is a datetime.date object, or None if
+        there are no mapped data
+    :returns: a list of (at most two) tuples of (start_date, end_date) where each date is a datetime.date object
+    """
+    if mapped_timeframe is None:
+        return [timeframe]
+    missing_timeframes = []
+    if timeframe[0] < mapped_timeframe[0]:
+        missing_timeframes.append((timeframe[0], mapped_timeframe[0] - datetime.timedelta(days=1)))
+    if timeframe[1] > mapped_timeframe[1]:
+        missing_timeframes.append((mapped_timeframe[1] + datetime.timedelta(days=1), timeframe[1]))
+    return missing_timeframes
+
+
+def get_parse_timeframe(timeframe, estimation_window, population_windows):
+    """
+    Determines the timeframe for which blocks need to be parsed and mapped, i.e. the timeframe of the analysis widened
+    by the windows that are used to determine the population of block producers
+    :param timeframe: a tuple of (start_date, end_date) where each date is a datetime.date object
+    :param estimation_window: int or None. The number of days of each estimation window
+    :param population_windows: int or 'all'. The number of windows to look back and forward when determining if an
+        entity is active during a certain time frame
+    :returns: a tuple of (start_date, end_date) where each date is a datetime.date object
+    """
+    if estimation_window is None or not isinstance(population_windows, int):
+        return timeframe
+    margin = datetime.timedelta(days=estimation_window * population_windows)
+    start = timeframe[0] - margin if timeframe[0] - datetime.date.min > margin else datetime.date.min
+    end = timeframe[1] + margin if datetime.date.max - timeframe[1] > margin else datetime.date.max
+    return start, end
+
+
 def read_mapped_project_data(project_dir):
     """
     Reads the mapped data from a project's output directory
     :param project_dir: pathlib.PosixPath object of the output directory corresponding to the project
-    :returns: a dictionary with the mapped data
+    :returns: a list of dictionaries with the mapped data
+    """
+    return list(iter_mapped_project_data(project_dir))
+
+
+def iter_mapped_project_data(project_dir):
+    """
+    Lazily reads the mapped data from a project's output directory. The mapped data are stored in JSON lines format
+    (one block per line), but files in the (legacy) format of a single JSON array are also supported (in which case the
+    whole file is loaded at once).
+    :param project_dir: pathlib.PosixPath object of the output directory corresponding to the project
+    :returns: a generator of dictionaries with the mapped data of each block
     """
     with open(project_dir / get_mapped_data_filename(get_clustering_flag())) as f:
-        data = json.load(f)
-    return data
+        first_char = f.read(1)
+        while first_char.isspace():
+            first_char = f.read(1)
+        f.seek(0)
+        if first_char == '[':
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_mapped_project_columns(project_dir):
+    """
+    Reads the columnar version of the mapped data of a project (memory-mapped, so it is only loaded as it is accessed),
+    or builds it from the mapped data file if it does not exist or is outdated (e.g. mapped data of older versions)
+    :param project_dir: pathlib.PosixPath object of the output directory corresponding to the project
+    :returns: a dictionary with a numpy array for each column ('number', 'day', 'creator', 'mapping_method'), the list
+    of creators ('creators') and the list of mapping methods ('mapping_methods'), as described in the mapped_columns
+    module
+    """
+    clustering_flag = get_clustering_flag()
+    columns = read_mapped_columns(project_dir / get_mapped_columns_dir_name(clustering_flag),
+                                  project_dir / get_mapped_data_filename(clustering_flag))
+    if columns is None:
+        columns_builder = MappedColumnsBuilder()
+        for block in iter_mapped_project_data(project_dir):
+            columns_builder.add(block)
+        columns = columns_builder.get_columns()
+    return columns
+
+
+def write_mapped_project_data(project_dir, clustering_flag, mapped_data):
+    """
+    Writes mapped data into a project's output directory in JSON lines format (one compact record per line), while the
+    blocks are being produced, so that the mapped data never need to be held in memory. The data are first written
+    into a temporary file, which replaces the mapped data file once all blocks have been written (so the existing
+    mapped data can be read while writing). The columnar version of the mapped data (see mapped_columns module) is
+    built at the same time and saved next to the mapped data file. If there are no blocks, no file is written.
+    :param project_dir: pathlib.PosixPath object of the output directory corresponding to the project
+    :param clustering_flag: boolean that determines whether the data is clustered or not
+    :param mapped_data: iterable of dictionaries with the mapped data of each block
+    :returns: int, the number of blocks that were written
+    """
+    filepath = project_dir / get_mapped_data_filename(clustering_flag)
+    tmp_filepath = filepath.with_name(filepath.name + '.tmp')
+    num_blocks = 0
+    columns_builder = MappedColumnsBuilder()
+    with open(tmp_filepath, 'w') as f:
+        for block in mapped_data:
+            f.write(json.dumps(block, separators=(',', ':')) + '\n')
+            columns_builder.add(block)
+            num_blocks += 1
+    if num_blocks > 0:
+        os.replace(tmp_filepath, filepath)
+        write_mapped_columns(project_dir / get_mapped_columns_dir_name(clustering_flag), columns_builder.get_columns(),
+                             filepath)
+    else:
+        tmp_filepath.unlink()
+    return num_blocks
+
+
+def remove_mapped_project_data(project_dir, clustering_flag):
+    """
+    Removes the mapped data of a project along with everything that is derived from them (metadata, columnar version
+    and block count cube), e.g. when the data are mapped again from scratch and there are no blocks to write
+    :param project_dir: pathlib.PosixPath object of the output directory corresponding to the project
+    :param clustering_flag: boolean that determines whether the data is clustered or not
+    """
+    for filename in [get_mapped_data_filename(clustering_flag), get_mapped_data_metadata_filename(clustering_flag)]:
+        (project_dir / filename).unlink(missing_ok=True)
+    for dirname in [get_mapped_columns_dir_name(clustering_flag), get_block_count_cube_dir_name(clustering_flag)]:
+        shutil.rmtree(project_dir / dirname, ignore_errors=True)
 
 
 def get_representative_dates(time_chunks):
@@ -412,6 +808,32 @@ def get_plot_flag():
         raise ValueError('Flag "plot" missing from config file')
 
 
+def get_trace_memory_flag():
+    """
+    Gets the flag that determines whether to trace the memory that is allocated during each stage of the pipeline
+    :returns: boolean
+    :raises ValueError: if the flag is not set in the config file
+    """
+    config = get_config_data()
+    try:
+        return config['instrumentation']['trace_memory']
+    except KeyError:
+        raise ValueError('Flag "trace_memory" missing from config file')
+
+
+def get_print_summary_flag():
+    """
+    Gets the flag that determines whether to print a summary table with the measurements of each stage of the pipeline
+    :returns: boolean
+    :raises ValueError: if the flag is not set in the config file
+    """
+    config = get_config_data()
+    try:
+        return config['instrumentation']['print_summary']
+    except KeyError:
+        raise ValueError('Flag "print_summary" missing from config file')
+
+
 def get_plot_config_data():
     """
     Retrieves the plot-related config parameters
@@ -446,6 +868,112 @@ def get_clustering_flag():
         raise ValueError('Flag "clustering" missing from config file')
 
 
+def get_aggregation_compression():
+    """
+    Retrieves the compression format to use for the (sparse) aggregated data files
+    :returns: str ('gzip', 'bz2', 'xz' or 'zstd') or None if the files should not be compressed
+    :raises ValueError: if the compression field is missing from the config file or if it is not a supported format
+    """
+    config = get_config_data()
+    try:
+        compression = config['aggregation_output']['compression']
+    except KeyError:
+        raise ValueError('"compression" of aggregation output missing from config file')
+    if compression and compression not in COMPRESSION_EXTENSIONS.values():
+        raise ValueError(f'Unsupported compression format for aggregation output: {compression}')
+    return compression or None
+
+
+def get_dense_export_flag():
+    """
+    Gets the flag that determines whether to export the aggregated data also as dense csv files
+    :returns: boolean
+    :raises ValueError: if the flag is not set in the config file
+    """
+    config = get_config_data()
+    try:
+        return config['aggregation_output']['dense_export']
+    except KeyError:
+        raise ValueError('Flag "dense_export" missing from config file')
+
+
+def get_parse_workers():
+    """
+    Retrieves the number of worker processes to use for parsing the raw block data
+    :returns: int, the number of worker processes (the number of available cores if the config value is 0 or empty)
+    :raises ValueError: if the parse_workers field is missing from the config file or if it is negative
+    """
+    config = get_config_data()
+    try:
+        parse_workers = config['parallelism']['parse_workers']
+    except KeyError:
+        raise ValueError('"parse_workers" missing from config file')
+    if not parse_workers:
+        return os.cpu_count()
+    if parse_workers < 0:
+        raise ValueError('"parse_workers" must be a non-negative number')
+    return parse_workers
+
+
+def get_analyze_workers():
+    """
+    Retrieves the number of worker processes to use for analyzing the aggregated data
+    :returns: int, the number of worker processes (the number of available cores if the config value is 0 or empty)
+    :raises ValueError: if the analyze_workers field is missing from the config file or if it is negative
+    """
+    config = get_config_data()
+    try:
+        analyze_workers = config['parallelism']['analyze_workers']
+    except KeyError:
+        raise ValueError('"analyze_workers" missing from config file')
+    if not analyze_workers:
+        return os.cpu_count()
+    if analyze_workers < 0:
+        raise ValueError('"analyze_workers" must be a non-negative number')
+    return analyze_workers
+
+
+def get_ledger_workers():
+    """
+    Retrieves the number of worker processes to use for parsing, mapping and aggregating the data of different ledgers
+    concurrently
+    :returns: int, the number of worker processes (the number of available cores if the config value is 0 or empty)
+    :raises ValueError: if the ledger_workers field is missing from the config file or if it is negative
+    """
+    config = get_config_data()
+    try:
+        ledger_workers = config['parallelism']['ledger_workers']
+    except KeyError:
+        raise ValueError('"ledger_workers" missing from config file')
+    if not ledger_workers:
+        return os.cpu_count()
+    if ledger_workers < 0:
+        raise ValueError('"ledger_workers" must be a non-negative number')
+    return ledger_workers
+
+
+def get_memory_budget():
+    """
+    Retrieves the memory (in GB) that the ledgers that are processed concurrently can use in total
+    :returns: float, the memory budget (the size of the physical memory if the config value is empty, or None if the
+        size of the physical memory cannot be determined)
+    :raises ValueError: if the memory_budget field is missing from the config file or if it is not positive
+    """
+    config = get_config_data()
+    try:
+        memory_budget = config['parallelism']['memory_budget']
+    except KeyError:
+        raise ValueError('"memory_budget" missing from config file')
+    if memory_budget is None:
+        try:
+            return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+        except (AttributeError, ValueError, OSError):
+            return None
+    if memory_budget <= 0:
+        raise ValueError('"memory_budget" must be a positive number')
+    return memory_budget
+
+
 def get_results_dir(estimation_window, frequency, population_windows):
     """
     Retrieves the path to the results directory for the specific config parameters
@@ -465,6 +993,24 @@ def get_mapped_data_filename(clustering_flag):
     return 'mapped_data_' + ('clustered' if clustering_flag else 'non_clustered') + '.json'
 
 
+def get_mapped_columns_dir_name(clustering_flag):
+    """
+    Retrieves the name of the directory that contains the columnar (binary) version of the mapped data
+    :param clustering_flag: boolean that determines whether the data is clustered or not
+    :returns: str
+    """
+    return 'mapped_columns_' + ('clustered' if clustering_flag else 'non_clustered')
+
+
+def get_block_count_cube_dir_name(clustering_flag):
+    """
+    Retrieves the name of the directory that contains the (entity x day) block count cube of the mapped data
+    :param clustering_flag: boolean that determines whether the data is clustered or not
+    :returns: str
+    """
+    return 'block_count_cube_' + ('clustered' if clustering_flag else 'non_clustered')
+
+
 def get_input_directories():
     """
     Reads the config file and retrieves the directories to look for raw block data
@@ -0,0 +1,181 @@
+"""
+Module with the instrumentation of the pipeline, which records the wall time, CPU time, peak memory and throughput of
+each stage (parsing, mapping, aggregation, analysis, plotting) of each ledger
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+REPORT_FILENAME = 'instrumentation_report.json'
+SUMMARY_COLUMNS = [('stage', 'stage'), ('ledger', 'ledger'), ('wall_time', 'wall (s)'), ('cpu_time', 'cpu (s)'),
+                   ('peak_rss_mb', 'peak rss (MB)'), ('peak_traced_mb', 'peak traced (MB)'), ('records', 'records'),
+                   ('throughput', 'records/s')]
+
+
+def get_cpu_time():
+    """
+    :returns: float, the CPU time (user and system) in seconds of the current process and its terminated child
+    processes (e.g. the worker processes that were used for parsing)
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def get_peak_rss():
+    """
+    :returns: float, the peak resident set size (i.e. the highest amount of physical memory used so far) of the current
+    process in MB, or None if it cannot be determined
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024  # bytes on macOS, kilobytes on Linux
+
+
+def reset_traced_peak():
+    """
+    Resets the peak of the memory that is traced by tracemalloc. Python versions before 3.9 have no
+    tracemalloc.reset_peak, so tracing is restarted instead, which also resets the traced memory to 0.
+    :returns: int, the traced memory (in bytes) that is no longer counted by tracemalloc after the reset
+    """
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+        return 0
+    traced_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    return traced_memory
+
+
+class StageRecorder:
+    """
+    Class that records measurements of the stages of the pipeline. Each record includes the wall time and CPU time of
+    the stage, the peak resident set size of the process at the end of the stage, the peak memory that was allocated
+    by Python during the stage (only if memory tracing is enabled, since tracemalloc slows down the execution), the
+    number of records (e.g. blocks) that the stage processed and its throughput. If a stage is measured within another
+    stage (e.g. parsing, which is interleaved with mapping), its time is not counted in the time of the outer stage,
+    while its peak memory is (since the outer stage holds its memory during the nested stage).
+
+    :ivar trace_memory: boolean, whether to trace the memory allocations of each stage with tracemalloc
+    :ivar records: list of dictionaries, one for each measured stage
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+        # for each stage that is being measured, its peak traced memory up to the start of its latest nested stage
+        # (since the peak of tracemalloc is reset at the start of each stage) and the traced memory of the stage that
+        # tracemalloc no longer counts (see reset_traced_peak)
+        self._traced_memory_stack = []
+
+    def add_record(self, record, wall_time, cpu_time, peak_traced_memory=None):
+        """
+        Completes the measurements of a stage and adds them to the records
+        :param record: dictionary with the stage, ledger and number of records (processed items) of the stage
+        :param wall_time: float, the wall time of the stage in seconds
+        :param cpu_time: float, the CPU time of the stage in seconds
+        :param peak_traced_memory: int, the peak memory (in bytes) that was allocated during the stage, or None
+        """
+        record['wall_time'] = wall_time
+        record['cpu_time'] = cpu_time
+        record['peak_rss_mb'] = get_peak_rss()
+        record['peak_traced_mb'] = None if peak_traced_memory is None else peak_traced_memory / 1024 ** 2
+        records = record.get('records')
+        record['throughput'] = records / wall_time if records is not None and wall_time > 0 else None
+        self.records.append(record)
+
+    @contextmanager
+    def measure(self, stage, ledger=None):
+        """
+        Measures the code that is executed in the context
+        :param stage: string, the name of the stage
+        :param ledger: string, the name of the ledger, or None for stages that concern all ledgers
+        :returns: a context manager that yields the record of the stage (a dictionary), in which the number of
+        processed items can be set ('records')
+        """
+        record = {'stage': stage, 'ledger': ledger, 'records': None}
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            if self._traced_memory_stack:  # keep the peak of the outer stage before resetting it
+                outer_memory = self._traced_memory_stack[-1]
+                outer_memory[0] = max(outer_memory[0], outer_memory[1] + tracemalloc.get_traced_memory()[1])
+                outer_memory[1] += reset_traced_peak()
+            else:
+                reset_traced_peak()
+            self._traced_memory_stack.append([0, 0])
+        num_records = len(self.records)
+        start_wall_time, start_cpu_time = time.perf_counter(), get_cpu_time()
+        try:
+            yield record
+        finally:
+            wall_time, cpu_time = time.perf_counter() - start_wall_time, get_cpu_time() - start_cpu_time
+            peak_traced_memory = None
+            if self.trace_memory:
+                peak_before_nested, untraced_memory = self._traced_memory_stack.pop()
+                peak_traced_memory = max(peak_before_nested, untraced_memory + tracemalloc.get_traced_memory()[1])
+                if self._traced_memory_stack:  # the memory of a nested stage is also part of the outer stage
+                    outer_memory = self._traced_memory_stack[-1]
+                    outer_memory[0] = max(outer_memory[0], outer_memory[1] + peak_traced_memory)
+            if started_tracing:
+                tracemalloc.stop()
+        for nested_record in self.records[num_records:]:
+            wall_time -= nested_record['wall_time']
+            cpu_time -= nested_record['cpu_time']
+        self.add_record(record, wall_time, cpu_time, peak_traced_memory)
+
+    def measure_iterable(self, iterable, stage, ledger=None):
+        """
+        Measures the production of the items of an iterable (e.g. a generator of parsed blocks); the time that is
+        spent by the consumer of the items is not counted. The stage is recorded once the iterable is exhausted.
+        :param iterable: the iterable to measure
+        :param stage: string, the name of the stage
+        :param ledger: string, the name of the ledger, or None for stages that concern all ledgers
+        :returns: a generator with the items of the iterable
+        """
+        record = {'stage': stage, 'ledger': ledger, 'records': 0}
+        wall_time, cpu_time = 0, 0
+        start_wall_time, start_cpu_time = time.perf_counter(), get_cpu_time()
+        for item in iterable:
+            wall_time += time.perf_counter() - start_wall_time
+            cpu_time += get_cpu_time() - start_cpu_time
+            record['records'] += 1
+            yield item
+            start_wall_time, start_cpu_time = time.perf_counter(), get_cpu_time()
+        wall_time += time.perf_counter() - start_wall_time
+        cpu_time += get_cpu_time() - start_cpu_time
+        self.add_record(record, wall_time, cpu_time)
+
+    def write_report(self, filepath, run_info=None):
+        """
+        Writes the records as a JSON report
+        :param filepath: pathlib.PosixPath object of the file to write the report to
+        :param run_info: dictionary with information about the run (e.g. the ledgers and parameters), or None
+        """
+        with open(filepath, 'w') as f:
+            json.dump({'run': run_info or dict(), 'stages': self.records}, f, indent=4, default=str)
+
+    def get_summary_table(self):
+        """
+        :returns: string, a table with the records (one row per stage of each ledger)
+        """
+        def format_value(value):
+            if value is None:
+                return '-'
+            return f'{value:.2f}' if isinstance(value, float) else str(value)
+
+        rows = [[header for _, header in SUMMARY_COLUMNS]] + [
+            [format_value(record.get(key)) for key, _ in SUMMARY_COLUMNS] for record in self.records]
+        widths = [max(len(row[column]) for row in rows) for column in range(len(SUMMARY_COLUMNS))]
+        lines = ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+        lines.insert(1, '  '.join('-' * width for width in widths))
+        return '\n'.join(lines)
@@ -16,17 +16,27 @@ ledger_mapping = {
 }
 
 
-def apply_mapping(project, parsed_data, output_dir):
+def apply_mapping(project, parsed_data, output_dir, previously_mapped_data=None, mapping_state=None):
     """
     Applies the appropriate mapping to the parsed data of a ledger. If the mapping has already
     been applied for this project (i.e. the corresponding output file already exists) then nothing happens,
     unless the relevant flag is set.
     :param project: string that corresponds to the ledger whose data should be mapped
-    :param parsed_data: list of dictionaries. The parsed data of the project
+    :param parsed_data: iterable of dictionaries. The parsed data of the project
     :param output_dir: path to the general output directory
-    :returns: a list of dictionaries (mapped block data)
+    :param previously_mapped_data: iterable of dictionaries (mapped block data) or None. If given, the newly mapped
+        blocks are merged with these (e.g. when extending the timeframe that the mapped data of the project cover)
+    :param mapping_state: dictionary with the state of the mapping after the previously mapped blocks (see
+        DefaultMapping.get_state) or None. If given, the mapping continues from this state (so the parsed data must all
+        come after the previously mapped blocks) and the dictionary is updated with the state after the mapping
+    :returns: int, the number of blocks in the mapped data of the project
     """
     logging.info(f'Mapping {project} blocks to their creators..')
     project_output_dir = output_dir / project
     mapping = ledger_mapping[project](project, project_output_dir, parsed_data)
-    return mapping.perform_mapping()
+    if mapping_state is not None:
+        mapping.set_state(mapping_state)
+    num_blocks = mapping.perform_mapping(previously_mapped_data)
+    if mapping_state is not None:
+        mapping_state.update(mapping.get_state())
+    return num_blocks
@@ -0,0 +1,120 @@
+"""
+Module with functions for storing the mapped data of a project in a columnar (binary) format, i.e. one numpy array per
+field with integer codes, which can be memory-mapped instead of being loaded and decoded
+"""
+import array
+import datetime
+import json
+import os
+import shutil
+import numpy as np
+
+COLUMN_TYPES = {
+    'number': 'int64',
+    'day': 'int32',
+    'creator': 'int32',
+    'mapping_method': 'int8'
+}
+DICTIONARY_FILENAME = 'dictionary.json'
+
+
+class MappedColumnsBuilder:
+    """
+    Class used to build the columns of some mapped data, one block at a time. The blocks' dates are stored as day
+    ordinals (see datetime.date.toordinal) and their creators and mapping methods as indices to lists of distinct values
+
+    :ivar columns: dictionary with an array (of the type given in COLUMN_TYPES) for each column
+    :ivar creator_ids: dictionary that maps each creator to its index
+    :ivar mapping_method_ids: dictionary that maps each mapping method to its index
+    :ivar day_ordinals: dictionary that maps each day (YYYY-MM-DD string) to its ordinal
+    """
+
+    def __init__(self):
+        self.columns = {column: array.array(np.dtype(column_type).char) for column, column_type in COLUMN_TYPES.items()}
+        self.creator_ids = dict()
+        self.mapping_method_ids = dict()
+        self.day_ordinals = dict()
+
+    def add(self, block):
+        """
+        Appends a block to the columns
+        :param block: dictionary with the mapped data of the block
+        """
+        day = block['timestamp'][:10]
+        if day not in self.day_ordinals:
+            self.day_ordinals[day] = datetime.date.fromisoformat(day).toordinal()
+        self.columns['number'].append(int(block['number']))
+        self.columns['day'].append(self.day_ordinals[day])
+        self.columns['creator'].append(self.creator_ids.setdefault(block['creator'], len(self.creator_ids)))
+        mapping_method = block.get('mapping_method')
+        self.columns['mapping_method'].append(self.mapping_method_ids.setdefault(mapping_method,
+                                                                                 len(self.mapping_method_ids)))
+
+    def get_columns(self):
+        """
+        :returns: a dictionary with a numpy array for each column, the list of creators ('creators') and the list of
+        mapping methods ('mapping_methods')
+        """
+        columns = {column: np.frombuffer(values, dtype=COLUMN_TYPES[column]) for column, values in self.columns.items()}
+        columns['creators'] = list(self.creator_ids.keys())
+        columns['mapping_methods'] = list(self.mapping_method_ids.keys())
+        return columns
+
+
+def get_file_signature(filepath):
+    """
+    :param filepath: pathlib.Path object that corresponds to a file
+    :returns: list with the size and the modification time (in ns) of the file, which are used to detect whether the
+    file has changed
+    """
+    stat = filepath.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def write_mapped_columns(columns_dir, columns, mapped_data_file):
+    """
+    Writes the columns of some mapped data into a directory (one .npy file per column and a json file with the lists
+    of distinct creators and mapping methods). The columns are first written into a temporary directory, which then
+    replaces any existing one.
+    :param columns_dir: pathlib.Path object of the directory where the columns will be saved
+    :param columns: dictionary with the columns, as returned by MappedColumnsBuilder.get_columns
+    :param mapped_data_file: pathlib.Path object of the (JSON lines) mapped data file that the columns correspond to
+    """
+    tmp_dir = columns_dir.with_name(columns_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    for column in COLUMN_TYPES.keys():
+        np.save(tmp_dir / f'{column}.npy', columns[column])
+    with open(tmp_dir / DICTIONARY_FILENAME, 'w') as f:
+        json.dump({
+            'num_blocks': len(columns['number']),
+            'creators': columns['creators'],
+            'mapping_methods': columns['mapping_methods'],
+            'mapped_data_signature': get_file_signature(mapped_data_file)
+        }, f)
+    if columns_dir.exists():
+        shutil.rmtree(columns_dir)
+    os.replace(tmp_dir, columns_dir)
+
+
+def read_mapped_columns(columns_dir, mapped_data_file):
+    """
+    Opens the columns of some mapped data, memory-mapping the arrays so that they are only read (lazily) from disk
+    when accessed
+    :param columns_dir: pathlib.Path object of the directory where the columns are saved
+    :param mapped_data_file: pathlib.Path object of the mapped data file that the columns should correspond to
+    :returns: a dictionary with the columns (in the format of MappedColumnsBuilder.get_columns) or None if there are no
+    columns or they do not correspond to the current mapped data file (e.g. it was written by an older version)
+    """
+    try:
+        with open(columns_dir / DICTIONARY_FILENAME) as f:
+            dictionary = json.load(f)
+        if dictionary['mapped_data_signature'] != get_file_signature(mapped_data_file):
+            return None
+    except FileNotFoundError:
+        return None
+    columns = {column: np.load(columns_dir / f'{column}.npy', mmap_mode='r') for column in COLUMN_TYPES.keys()}
+    columns['creators'] = dictionary['creators']
+    columns['mapping_methods'] = dictionary['mapping_methods']
+    return columns
@@ -1,6 +1,12 @@
-import json
+import heapq
+import logging
+from collections import OrderedDict
 
 import consensus_decentralization.helper as hlp
+from consensus_decentralization.mappings.identifier_matcher import IdentifierMatcher
+
+ATTRIBUTION_CACHE_SIZE = 100000  # maximum number of (identifiers, reward addresses, legal links epoch) combinations
+# whose attribution is cached during mapping (0 disables the cache)
 
 
 class DefaultMapping:
@@ -17,75 +23,180 @@ class DefaultMapping:
     a specific entity)
     :ivar known_identifiers: a dictionary with the known identifiers of the project (identifiers that are publicly
     associated with a specific entity)
+    :ivar identifier_matcher: an IdentifierMatcher compiled from the known identifiers (in the order of the dictionary),
+    which is created the first time that it is needed
     :ivar multi_pool_blocks: a list to be populated with blocks that were produced by multiple pools
     :ivar multi_pool_addresses: a list to be populated with addresses that were associated with multiple pools
+    :ivar known_addresses_version: a counter that is incremented every time that the known addresses change (e.g. when
+    new addresses are learned from blocks mapped through known identifiers)
+    :ivar learned_addresses: a dictionary with the addresses that were learned from blocks mapped through known
+    identifiers and the entities that they were associated with (which take precedence over the known addresses)
+    :ivar last_timestamp: the timestamp of the last block that was mapped, or None if no block has been mapped
+    :ivar attribution_cache: an ordered dictionary with the attributions (entity, mapping method) of recently mapped
+    blocks, keyed by the information that determines the attribution (identifiers, reward addresses and legal links
+    epoch), with the least recently used entries first
     """
 
     def __init__(self, project_name, output_dir, data_to_map):
         self.project_name = project_name
         self.output_dir = output_dir
         self.data_to_map = data_to_map
-        self.mapped_data = list()
         self.special_addresses = hlp.get_special_addresses(project_name)
         self.known_addresses = hlp.get_known_addresses(project_name)
         self.known_identifiers = hlp.get_pool_identifiers(project_name)
         self.known_clusters = hlp.get_pool_clusters(project_name)
+        self.identifier_matcher = None
         self.multi_pool_blocks = list()
         self.multi_pool_addresses = list()
+        self.known_addresses_version = 0
+        self.learned_addresses = dict()
+        self.last_timestamp = None
+        self.attribution_cache = OrderedDict()
 
-    def perform_mapping(self):
+    def get_state(self):
+        """
+        Retrieves the state that the mapping accumulates from the blocks it maps, which determines how later blocks are
+        mapped
+        :returns: a dictionary with the learned addresses and the timestamp of the last mapped block
+        """
+        return {'learned_addresses': dict(self.learned_addresses), 'last_timestamp': self.last_timestamp}
+
+    def set_state(self, state):
+        """
+        Restores the state of the mapping after some earlier blocks of the project were mapped (see get_state), so that
+        later blocks are mapped exactly as if all blocks had been mapped at once
+        :param state: dictionary with the learned addresses and the timestamp of the last mapped block
         """
-        Processes the parsed data and outputs the mapped data. The mapped data is a list that contains an entry
-        (dictionary) for each block with the number of the block, its timestamp, the addresses that received rewards
-        for it, the name of the entity that it was mapped to and the mapping method that was used to identify the entity.
-        The mapped data is also saved in a file in the project's output directory.
+        self.learned_addresses = dict(state['learned_addresses'])
+        self.known_addresses.update(self.learned_addresses)
+        self.known_addresses_version += 1
+        self.last_timestamp = state['last_timestamp']
+
+    def perform_mapping(self, previously_mapped_data=None):
+        """
+        Processes the parsed data and outputs the mapped data. The mapped data contain an entry (dictionary) for each
+        block with the number of the block, its timestamp, the addresses that received rewards for it, the name of the
+        entity that it was mapped to and the mapping method that was used to identify the entity.
+        The mapped data are saved in a file in the project's output directory as the blocks are mapped (so they are
+        never held in memory).
         Also outputs a file with the blocks that were produced by multiple pools and a file
         with the addresses that were associated with multiple pools, if any such blocks/addresses were found for the
         project.
-        :returns: a list of dictionaries (mapped block data)
+        :param previously_mapped_data: iterable of dictionaries (mapped block data) or None. If given, the newly mapped
+            blocks are merged with these blocks (in chronological order) before being saved, and the multi-pool
+            blocks/addresses that are found are added to the existing files
+        :returns: int, the number of blocks in the saved mapped data
         """
         clustering_flag = hlp.get_clustering_flag()
+        mapped_data = self.map_blocks(clustering_flag)
+        if previously_mapped_data is not None:
+            mapped_data = self.merge_mapped_data(previously_mapped_data, mapped_data)
+        num_blocks = self.write_mapped_data(clustering_flag, mapped_data)
+        self.write_multi_pool_files(append=previously_mapped_data is not None)
+
+        return num_blocks
+
+    def map_blocks(self, clustering_flag):
+        """
+        Lazily maps the parsed data, one block at a time. The attribution of each block is cached (see
+        map_block_with_cache), and the hit rate of the cache is logged once all blocks have been mapped.
+        :param clustering_flag: boolean, indicating whether the mapping methods should be used
+        :returns: a generator of dictionaries (mapped block data)
+        """
+        cache_hits, cache_lookups = 0, 0
         for block in self.data_to_map:
-            if not clustering_flag:
-                entity = self.fallback_mapping(block)
-                mapping_method = 'fallback_mapping'
+            cache_key = (block['identifiers'], block['reward_addresses'],
+                         hlp.get_legal_links_epoch(hlp.get_date_from_block(block)) if clustering_flag else None)
+            cache_lookups += 1
+            if cache_key in self.attribution_cache:
+                cache_hits += 1
+                self.attribution_cache.move_to_end(cache_key)
+                entity, mapping_method = self.attribution_cache[cache_key]
             else:
-                entity = self.map_from_known_identifiers(block)
-                if entity:
-                    mapping_method = 'known_identifiers'
-                else:
-                    entity = self.map_from_known_addresses(block)
-                    if entity:
-                        mapping_method = 'known_addresses'
-                    else:
-                        entity = self.fallback_mapping(block)
-                        mapping_method = 'fallback_mapping'
-
-                cluster = self.map_from_known_clusters(block)
-                if cluster:
-                    entity = cluster
-                    mapping_method = 'known_clusters'
-
-                # Finally, check legal links to map to the highest-level entity, if relevant
-                day = hlp.get_date_from_block(block)
-                legal_links = hlp.get_pool_legal_links(timeframe=day)
-                if entity in legal_links.keys():
-                    entity = legal_links[entity]
-                    mapping_method = 'known_legal_links'
-
-            self.mapped_data.append({
+                entity, mapping_method = self.map_block_with_cache(block, clustering_flag, cache_key)
+            self.last_timestamp = block['timestamp']
+
+            yield {
                 "number": block['number'],
                 "timestamp": block['timestamp'],
                 "reward_addresses": block['reward_addresses'],
                 "creator": entity,
                 "mapping_method": mapping_method
-            })
+            }
 
-        if len(self.mapped_data) > 0:
-            self.write_mapped_data(clustering_flag)
-        self.write_multi_pool_files()
+        if cache_lookups > 0:
+            logging.info(f'Attribution cache of {self.project_name} mapping: {cache_hits} hits out of {cache_lookups} '
+                         f'blocks ({cache_hits / cache_lookups:.1%})')
 
-        return self.mapped_data
+    def map_block(self, block, clustering_flag):
+        """
+        Determines the entity that produced a block, trying the different mapping methods in order of priority
+        :param block: dictionary with block information (block number, timestamp, identifiers, reward addresses)
+        :param clustering_flag: boolean, indicating whether the mapping methods should be used (otherwise the block is
+            simply mapped to its reward addresses)
+        :returns: a tuple of (entity, mapping method)
+        """
+        if not clustering_flag:
+            return self.fallback_mapping(block), 'fallback_mapping'
+
+        entity = self.map_from_known_identifiers(block)
+        if entity:
+            mapping_method = 'known_identifiers'
+        else:
+            entity = self.map_from_known_addresses(block)
+            if entity:
+                mapping_method = 'known_addresses'
+            else:
+                entity = self.fallback_mapping(block)
+                mapping_method = 'fallback_mapping'
+
+        cluster = self.map_from_known_clusters(block)
+        if cluster:
+            entity = cluster
+            mapping_method = 'known_clusters'
+
+        # Finally, check legal links to map to the highest-level entity, if relevant
+        day = hlp.get_date_from_block(block)
+        legal_links = hlp.get_legal_links_on_day(day)
+        if entity in legal_links.keys():
+            entity = legal_links[entity]
+            mapping_method = 'known_legal_links'
+        return entity, mapping_method
+
+    def map_block_with_cache(self, block, clustering_flag, cache_key):
+        """
+        Maps a block (see map_block) and caches its attribution, so that it can be reused for blocks with the same
+        identifiers and reward addresses (within the same legal links epoch). The cache is kept consistent with the side
+        effects of mapping: attributions that were produced while logging a multi-pool block or address are not cached
+        (so that the logging happens again for the next such block), and the cache is cleared whenever the known
+        addresses change (since older attributions may depend on them)
+        :param block: dictionary with block information (block number, timestamp, identifiers, reward addresses)
+        :param clustering_flag: boolean, indicating whether the mapping methods should be used
+        :param cache_key: tuple of (identifiers, reward addresses, legal links epoch) of the block
+        :returns: a tuple of (entity, mapping method)
+        """
+        num_multi_pool_logs = len(self.multi_pool_blocks) + len(self.multi_pool_addresses)
+        known_addresses_version = self.known_addresses_version
+        attribution = self.map_block(block, clustering_flag)
+        if known_addresses_version != self.known_addresses_version:
+            self.attribution_cache.clear()
+        if ATTRIBUTION_CACHE_SIZE > 0 and num_multi_pool_logs == len(self.multi_pool_blocks) + len(
+                self.multi_pool_addresses):
+            self.attribution_cache[cache_key] = attribution
+            if len(self.attribution_cache) > ATTRIBUTION_CACHE_SIZE:
+                self.attribution_cache.popitem(last=False)
+        return attribution
+
+    @staticmethod
+    def merge_mapped_data(previously_mapped_data, mapped_data):
+        """
+        Lazily merges the newly mapped blocks with some previously mapped blocks, so that all of them are sorted by
+        timestamp
+        :param previously_mapped_data: iterable of dictionaries (mapped block data) sorted by timestamp
+        :param mapped_data: iterable of dictionaries (newly mapped block data) sorted by timestamp
+        :returns: a generator of dictionaries (mapped block data) sorted by timestamp
+        """
+        return heapq.merge(previously_mapped_data, mapped_data, key=lambda block: block['timestamp'])
 
     def get_reward_addresses(self, block):
         """
@@ -104,24 +215,31 @@ class DefaultMapping:
     def map_from_known_identifiers(self, block):
         """
         Maps one block to its block producer (pool) based on known identifiers (tag, etc).
+        If more than one known identifier is contained in the identifiers of the block, the one that comes first in the
+        known identifiers is used. All known identifiers are matched in a single pass over the block identifiers (see
+        IdentifierMatcher).
         If successful, it also updates the pool's known addresses with the reward addresses of the block and,
         if some address is found to also be associated with another pool, it adds it to the list of multi-pool addresses
         :param block: dictionary with block information (block number, timestamp, identifiers, reward addresses)
         :returns: the name of the pool that produced the block, if it was successfully mapped, otherwise None
         """
-        block_identifier = block['identifiers']
-        for identifier in self.known_identifiers.keys():
-            if identifier in block_identifier:
-                entity = self.known_identifiers[identifier]['name']
-                reward_addresses = self.get_reward_addresses(block)
-                if reward_addresses:
-                    for address in reward_addresses:
-                        if address in self.known_addresses.keys() and self.known_addresses[address] != entity:
-                            self.multi_pool_addresses.append(
-                                f'{block["number"]},{block["timestamp"]},{address},{entity}')
-                        self.known_addresses[address] = entity
-                return entity
-        return None
+        if self.identifier_matcher is None:
+            self.identifier_matcher = IdentifierMatcher(list(self.known_identifiers.keys()))
+        identifier = self.identifier_matcher.find_first(block['identifiers'])
+        if identifier is None:
+            return None
+        entity = self.known_identifiers[identifier]['name']
+        reward_addresses = self.get_reward_addresses(block)
+        if reward_addresses:
+            for address in reward_addresses:
+                if self.known_addresses.get(address) != entity:
+                    if address in self.known_addresses.keys():
+                        self.multi_pool_addresses.append(
+                            f'{block["number"]},{block["timestamp"]},{address},{entity}')
+                    self.known_addresses[address] = entity
+                    self.learned_addresses[address] = entity
+                    self.known_addresses_version += 1
+        return entity
 
     def map_from_known_addresses(self, block):
         """
@@ -173,25 +291,35 @@ class DefaultMapping:
             return '----- UNDEFINED BLOCK PRODUCER -----'
         return '/'.join([addr for addr in sorted(reward_addresses)])
 
-    def write_multi_pool_files(self):
+    def write_multi_pool_files(self, append=False):
         """
         Writes the files with the blocks that were produced by multiple pools and the addresses that were associated
         with multiple pools, if any such blocks/addresses were found for the project
+        :param append: boolean. If True, the blocks/addresses are added to the existing files (e.g. when the mapped
+            blocks are added to previously mapped ones), otherwise the files are replaced (and any existing file is
+            removed if no such blocks/addresses were found)
         """
-        if self.multi_pool_addresses:
-            with open(self.output_dir / 'multi_pool_addresses.csv', 'w') as f:
-                f.write('Block No,Timestamp,Address,Entity\n' + '\n'.join(self.multi_pool_addresses))
-
-        if self.multi_pool_blocks:
-            with open(self.output_dir / 'multi_pool_blocks.csv', 'w') as f:
-                f.write('Block No,Timestamp,Entities\n' + '\n'.join(self.multi_pool_blocks))
+        multi_pool_files = [('multi_pool_addresses.csv', 'Block No,Timestamp,Address,Entity', self.multi_pool_addresses),
+                            ('multi_pool_blocks.csv', 'Block No,Timestamp,Entities', self.multi_pool_blocks)]
+        for filename, header, entries in multi_pool_files:
+            filepath = self.output_dir / filename
+            if append and filepath.is_file():
+                if entries:
+                    with open(filepath, 'a') as f:
+                        f.write('\n' + '\n'.join(entries))
+            elif entries:
+                with open(filepath, 'w') as f:
+                    f.write(header + '\n' + '\n'.join(entries))
+            elif not append and filepath.is_file():
+                filepath.unlink()
 
-    def write_mapped_data(self, clustering_flag):
+    def write_mapped_data(self, clustering_flag, mapped_data):
         """
         Writes the mapped data into a file in a directory associated with the mapping instance. Specifically,
-        into a folder named after the project, inside the general output directory
+        into a folder named after the project, inside the general output directory. The data are written in JSON lines
+        format, one block at a time (see helper.write_mapped_project_data)
         :param clustering_flag: boolean, indicating whether clustering was used in the mapping process
+        :param mapped_data: iterable of dictionaries (mapped block data)
+        :returns: int, the number of blocks that were written
         """
-        filename = hlp.get_mapped_data_filename(clustering_flag)
-        with open(self.output_dir / filename, 'w') as f:
-            json.dump(self.mapped_data, f, indent=4)
+        return hlp.write_mapped_project_data(self.output_dir, clustering_flag, mapped_data)
@@ -11,24 +11,21 @@ class DummyMapping(DefaultMapping):
     def __init__(self, project_name, output_dir, data_to_map):
         super().__init__(project_name, output_dir, data_to_map)
 
-    def perform_mapping(self):
+    def perform_mapping(self, previously_mapped_data=None):
         """
         Overrides perform_mapping method of parent class.
-        :returns: a list of dictionaries ("mapped" block data)
+        :param previously_mapped_data: iterable of dictionaries (mapped block data) or None. If given, the newly mapped
+            blocks are merged with these blocks (in chronological order) before being saved
+        :returns: int, the number of blocks in the saved ("mapped") data
         """
-        for block in self.data_to_map:
-            reward_addresses = block['reward_addresses'].split(',')
-            entity = reward_addresses[0]
+        mapped_data = ({
+            "number": block['number'],
+            "timestamp": block['timestamp'],
+            "reward_addresses": block['reward_addresses'],
+            "creator": block['reward_addresses'].split(',')[0],
+            "mapping_method": 'no_mapping'
+        } for block in self.data_to_map)
 
-            self.mapped_data.append({
-                "number": block['number'],
-                "timestamp": block['timestamp'],
-                "reward_addresses": block['reward_addresses'],
-                "creator": entity,
-                "mapping_method": 'no_mapping'
-            })
-
-        if len(self.mapped_data) > 0:
-            self.write_mapped_data(hlp.get_clustering_flag())
-
-        return self.mapped_data
+        if previously_mapped_data is not None:
+            mapped_data = self.merge_mapped_data(previously_mapped_data, mapped_data)
+        return self.write_mapped_data(hlp.get_clustering_flag(), mapped_data)
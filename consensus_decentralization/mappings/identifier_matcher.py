@@ -0,0 +1,96 @@
+from collections import deque
+
+
+class IdentifierMatcher:
+    """
+    A multi-pattern string matcher (Aho–Corasick automaton) that finds which of a list of identifiers (patterns) are
+    contained in some text, scanning the text only once regardless of the number of identifiers. The automaton is
+    compiled into a deterministic one (i.e. each state has a transition for every character that appears in some
+    identifier), so that scanning a text requires one dictionary lookup per character.
+
+    :ivar identifiers: the list of identifiers, in the order of their priority
+    :ivar transitions: a list with one dictionary per state of the automaton, mapping a character to the next state
+    :ivar best_match: a list with the (lowest) index of the identifier that is matched when reaching each state of the
+    automaton, or None if no identifier is matched
+    :ivar empty_match: the index of the empty identifier (which is contained in every text), or None
+    """
+
+    def __init__(self, identifiers):
+        """
+        Compiles the automaton
+        :param identifiers: list of strings, in the order of their priority (lower index means higher priority)
+        """
+        self.identifiers = identifiers
+        self.transitions = [dict()]
+        self.best_match = [None]
+        self.empty_match = None
+        for index, identifier in enumerate(identifiers):
+            if not identifier:
+                if self.empty_match is None:
+                    self.empty_match = index
+                continue
+            state = 0
+            for char in identifier:
+                if char not in self.transitions[state]:
+                    self.transitions.append(dict())
+                    self.best_match.append(None)
+                    self.transitions[state][char] = len(self.transitions) - 1
+                state = self.transitions[state][char]
+            if self.best_match[state] is None:
+                self.best_match[state] = index
+
+        # Breadth-first construction of the failure links, which are folded into the transitions of each state
+        failure = [0] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            self.best_match[state] = self.get_best(self.best_match[state], self.best_match[failure[state]])
+            for char, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                # the transitions of the failure state have already been completed, since it is a shallower state
+                failure[next_state] = self.transitions[failure[state]].get(char, 0)
+            for char, next_state in self.transitions[failure[state]].items():
+                self.transitions[state].setdefault(char, next_state)
+
+    @staticmethod
+    def get_best(index, other_index):
+        """
+        Determines which of two identifier indices corresponds to the identifier with the highest priority
+        :param index: int or None
+        :param other_index: int or None
+        :returns: the lowest of the two indices (ignoring None values), or None if both are None
+        """
+        if index is None:
+            return other_index
+        if other_index is None:
+            return index
+        return min(index, other_index)
+
+    def find_first(self, text):
+        """
+        Finds the identifier with the highest priority (lowest index) that is contained in some text
+        :param text: string
+        :returns: the identifier or None if no identifier is contained in the text
+        """
+        index = self.find_first_index(text)
+        return None if index is None else self.identifiers[index]
+
+    def find_first_index(self, text):
+        """
+        Finds the index of the identifier with the highest priority (lowest index) that is contained in some text
+        :param text: string
+        :returns: the index of the identifier or None if no identifier is contained in the text
+        """
+        best = self.empty_match
+        if best == 0:
+            return best
+        transitions, best_match = self.transitions, self.best_match
+        state = 0
+        for char in text:
+            state = transitions[state].get(char, 0)
+            match = best_match[state]
+            if match is not None and (best is None or match < best):
+                best = match
+                if best == 0:
+                    break
+        return best
@@ -0,0 +1,241 @@
+"""
+Module with the batched metric engine, which computes the metrics for many dates at once with array operations, instead
+of calling the compute_<metric> function of each metric for the distribution of each date. The batched function of each
+metric is registered in the metric registry (see metric_registry), through which the metrics are computed.
+"""
+from functools import cached_property
+import numpy as np
+
+CELLS_PER_BATCH = 4000000
+INITIAL_TOP_ENTITIES = 256
+# if more than this fraction of the entities are needed, it is cheaper to sort the distributions than select them
+MAX_SELECTION_FRACTION = 0.25
+
+
+class DistributionBatch:
+    """
+    Class that holds the block distributions of a batch of dates as the columns of a matrix, with the (positive) number
+    of blocks of the entities of each date (in the order of the entities) padded with zeros. The columns are only
+    fully sorted if some metric needs them sorted (e.g. the Gini coefficient); the metrics that only need the top
+    entities of each date get them through a partial selection (see get_top_blocks).
+
+    :ivar blocks: 2-dimensional array (entity position x date) with the numbers of blocks
+    :ivar num_active: array with the number of entities that produced blocks in each date
+    :ivar num_zero_entities: array with the number of entities that are part of the population of each date without
+        producing any blocks
+    :ivar totals: array with the total number of blocks of each date
+    """
+
+    def __init__(self, blocks, num_active, num_zero_entities):
+        self.blocks = blocks
+        self.num_active = num_active
+        self.num_zero_entities = num_zero_entities
+        self.totals = blocks.sum(axis=0)
+        self.active_mask = np.arange(blocks.shape[0])[:, np.newaxis] < num_active
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.shares = blocks / self.totals
+        self._top_blocks = blocks[:0]
+
+    @classmethod
+    def from_blocks_per_entity(cls, blocks_per_entity, first_date, last_date):
+        """
+        :param blocks_per_entity: a BlocksPerEntity object
+        :param first_date: int, the index of the first date of the batch
+        :param last_date: int, the index of the date after the last date of the batch
+        :returns: a DistributionBatch object with the distributions of the dates in [first_date, last_date)
+        """
+        offsets = blocks_per_entity.date_offsets[first_date:last_date + 1]
+        num_active = np.diff(offsets)
+        counts = blocks_per_entity.counts[offsets[0]:offsets[-1]]
+        cell_dates = np.repeat(np.arange(last_date - first_date), num_active)
+        positions = np.arange(len(counts)) - (offsets[cell_dates] - offsets[0])
+        blocks = np.zeros((num_active.max(initial=0), last_date - first_date), dtype=np.int64)
+        blocks[positions, cell_dates] = counts
+        num_zero_entities = blocks_per_entity.population_sizes[first_date:last_date] - num_active
+        return cls(blocks=blocks, num_active=num_active, num_zero_entities=num_zero_entities)
+
+    @cached_property
+    def blocks_per_date(self):
+        """
+        :returns: 2-dimensional array (date x entity position) with the numbers of blocks, i.e. the transposed (and
+        contiguous) blocks matrix, on which the distribution of each date can be partitioned efficiently
+        """
+        return np.ascontiguousarray(self.blocks.T)
+
+    @cached_property
+    def sorted_blocks(self):
+        """
+        :returns: 2-dimensional array (rank x date) with the numbers of blocks of each date sorted in descending order
+        """
+        return np.ascontiguousarray(-np.sort(-self.blocks_per_date, axis=1).T)
+
+    def get_top_blocks(self, k):
+        """
+        Retrieves the numbers of blocks of the k entities of each date that produced the most blocks, by partitioning
+        the columns instead of sorting them (unless they are already sorted). The largest selection so far is kept, so
+        that it is shared by all metrics that need the top entities.
+        :param k: int, the number of top entities
+        :returns: 2-dimensional array (rank x date) with the (at most k) largest numbers of blocks of each date, sorted
+        in descending order
+        """
+        num_rows = self.blocks.shape[0]
+        if k > MAX_SELECTION_FRACTION * num_rows or 'sorted_blocks' in self.__dict__:
+            return self.sorted_blocks[:k]
+        if len(self._top_blocks) < k:
+            # at least INITIAL_TOP_ENTITIES are selected, so that a single selection is enough for most metrics, and
+            # the selection is done on the (contiguous) rows of the transposed matrix, which is much faster
+            num_selected = min(max(k, INITIAL_TOP_ENTITIES), num_rows)
+            top_blocks = np.partition(self.blocks_per_date, num_rows - num_selected, axis=1)[:, num_rows - num_selected:]
+            self._top_blocks = -np.sort(-top_blocks.T, axis=0)
+        return self._top_blocks[:k]
+
+    def get_log2_shares(self):
+        """
+        :returns: 2-dimensional array with the base-2 logarithms of the shares (0 for the padding)
+        """
+        return np.log2(np.where(self.active_mask, self.shares, 1))
+
+
+def batched_entropy(batch, alpha):
+    """
+    Calculates the entropy of the distributions of a batch (see compute_entropy)
+    :param batch: a DistributionBatch object
+    :param alpha: the entropy parameter
+    :returns: array with the entropy of each distribution (nan if there were no blocks)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if alpha == 1:
+            entropy = 0 - (np.where(batch.active_mask, batch.shares, 0) * batch.get_log2_shares()).sum(axis=0)
+        elif alpha == -1:
+            entropy = -np.log2(batch.shares.max(axis=0)) if len(batch.shares) else np.zeros(batch.shares.shape[1])
+        else:
+            sum_freqs = np.where(batch.active_mask, np.power(batch.shares, alpha), 0).sum(axis=0)
+            # the entities without blocks only contribute to Hartley entropy (or make the entropy infinite if alpha < 0)
+            sum_freqs += np.where(batch.num_zero_entities > 0, batch.num_zero_entities * np.power(0.0, alpha), 0)
+            entropy = np.log2(sum_freqs) / (1 - alpha)
+    return np.where(batch.totals > 0, entropy, np.nan)
+
+
+def batched_entropy_percentage(batch, alpha):
+    """
+    Calculates the entropy of the distributions of a batch as a fraction of the maximum entropy for the number of
+    entities that produced blocks (see compute_entropy_percentage)
+    :param batch: a DistributionBatch object
+    :param alpha: the entropy parameter
+    :returns: array with the entropy percentage of each distribution (nan if there were no blocks)
+    """
+    # the maximum entropy (of a uniform distribution) is log2(n) for any alpha; if it is 0 the percentage is 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentage = np.where(batch.num_active > 1, batched_entropy(batch, alpha) / np.log2(batch.num_active), 0)
+    return np.where(batch.totals > 0, percentage, np.nan)
+
+
+def batched_gini(batch):
+    """
+    Calculates the Gini coefficient of the distributions of a batch (see compute_gini)
+    :param batch: a DistributionBatch object
+    :returns: array with the Gini coefficient of each distribution (nan if there were no blocks)
+    """
+    n = batch.num_active + batch.num_zero_entities
+    # the 1-based index of each entity when all entities (including the ones without blocks) are sorted in ascending order
+    # (this is the only metric that needs the fully sorted distributions)
+    index = batch.num_zero_entities + batch.num_active - np.arange(batch.sorted_blocks.shape[0])[:, np.newaxis]
+    numerators = ((2 * index - n - 1) * batch.sorted_blocks).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(batch.totals > 0, numerators / (n * batch.totals), np.nan)
+
+
+def batched_hhi(batch):
+    """
+    Calculates the Herfindahl-Hirschman index of the distributions of a batch (see compute_hhi)
+    :param batch: a DistributionBatch object
+    :returns: array with the HHI of each distribution (nan if there were no blocks)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hhi = np.square(100 * batch.blocks / batch.totals).sum(axis=0)
+    return np.where(batch.totals > 0, hhi, np.nan)
+
+
+def batched_theil_index(batch):
+    """
+    Calculates the Theil index of the distributions of a batch (see compute_theil_index)
+    :param batch: a DistributionBatch object
+    :returns: array with the Theil index of each distribution (0 if there were no entities)
+    """
+    n = batch.num_active + batch.num_zero_entities
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = batch.blocks / (batch.totals / n)
+        theil = (np.where(batch.active_mask, x, 0) * np.log(np.where(batch.active_mask, x, 1))).sum(axis=0) / n
+    return np.where(n > 0, theil, 0)
+
+
+def batched_tau_index(batch, threshold):
+    """
+    Calculates the tau-decentralization index of the distributions of a batch (see compute_tau_index)
+    :param batch: a DistributionBatch object
+    :param threshold: float, the parameter of the tau-decentralization index
+    :returns: array with the tau index of each distribution (-1 if there were no blocks)
+    """
+    num_top_entities = INITIAL_TOP_ENTITIES
+    while True:
+        top_blocks = batch.get_top_blocks(num_top_entities)
+        top_active_mask = batch.active_mask[:len(top_blocks)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cumulative_shares = np.cumsum(np.where(top_active_mask, top_blocks / batch.totals, 0), axis=0)
+        # more top entities are needed if the threshold is not reached for some date that has more entities
+        if len(top_blocks) < num_top_entities or not np.any((cumulative_shares[-1] < threshold) & (
+                batch.num_active > len(top_blocks))):
+            break
+        num_top_entities *= 4
+    # the share of blocks that is covered before each entity is added
+    covered_before = np.vstack((np.zeros((1, cumulative_shares.shape[1])), cumulative_shares[:-1]))
+    tau_index = ((covered_before < threshold) & top_active_mask).sum(axis=0)
+    return np.where(batch.totals > 0, tau_index, -1)
+
+
+def batched_nakamoto_coefficient(batch):
+    """
+    Calculates the Nakamoto coefficient of the distributions of a batch (see compute_nakamoto_coefficient)
+    :param batch: a DistributionBatch object
+    :returns: array with the Nakamoto coefficient of each distribution (-1 if there were no blocks)
+    """
+    return batched_tau_index(batch, 0.5)
+
+
+def batched_concentration_ratio(batch, topn):
+    """
+    Calculates the n-concentration ratio of the distributions of a batch (see compute_concentration_ratio)
+    :param batch: a DistributionBatch object
+    :param topn: the number of top block producers to consider
+    :returns: array with the concentration ratio of each distribution (0 if there were no blocks)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(batch.totals > 0, batch.get_top_blocks(topn).sum(axis=0) / batch.totals, 0)
+
+
+def batched_total_entities(batch):
+    """
+    Computes the number of entities that produced blocks in the dates of a batch (see compute_total_entities)
+    :param batch: a DistributionBatch object
+    :returns: array with the number of entities that produced blocks in each date
+    """
+    return batch.num_active
+
+
+def to_metric_values(values, value_type, int_zero_mask):
+    """
+    Converts the array of results of a batched metric into a list of values in the format of the compute_<metric>
+    functions
+    :param values: array with the results of a batched metric, where nan (for floats) or -1 (for ints) means that the
+        metric is undefined
+    :param value_type: the type of the values (int or float)
+    :param int_zero_mask: boolean array with the dates for which the value is the integer 0, or None
+    :returns: list with the value of the metric for each date (None if the metric is undefined)
+    """
+    if value_type is int:
+        return [None if value < 0 else value for value in values.astype(np.int64).tolist()]
+    metric_values = [None if value != value else value for value in values.astype(np.float64).tolist()]
+    if int_zero_mask is not None:
+        for idx in np.flatnonzero(int_zero_mask).tolist():
+            metric_values[idx] = 0
+    return metric_values
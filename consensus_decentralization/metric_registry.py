@@ -0,0 +1,82 @@
+"""
+Module with the registry of the metrics, which is used to compute all the configured metrics for all the dates of some
+aggregated data with the batched metric engine (see metric_engine)
+"""
+from collections import namedtuple
+import numpy as np
+from consensus_decentralization import metric_engine
+from consensus_decentralization.metric_engine import DistributionBatch, to_metric_values
+
+Metric = namedtuple('Metric', ['function', 'value_type', 'get_int_zero_mask'])
+
+METRIC_REGISTRY = {}
+
+
+def register_metric(name, function, value_type, get_int_zero_mask=None):
+    """
+    Adds a metric to the registry
+    :param name: string, the name of the metric (as used in the config file)
+    :param function: function that takes a DistributionBatch object (and the parameter of the metric, if any) and
+        returns an array with the value of the metric for each date of the batch, where nan (for floats) or -1 (for
+        ints) means that the metric is undefined. Its results must be the same as the ones of the compute_<metric>
+        function of the metric for the distribution of each date.
+    :param value_type: the type of the values of the metric (int or float)
+    :param get_int_zero_mask: function that takes a DistributionBatch object and returns the mask of the dates for which
+        the compute_<metric> function returns the integer 0, or None if there are no such dates
+    """
+    if value_type not in (int, float):
+        raise ValueError(f'Unknown value type {value_type} for metric {name}')
+    METRIC_REGISTRY[name] = Metric(function=function, value_type=value_type, get_int_zero_mask=get_int_zero_mask)
+
+
+register_metric('entropy', metric_engine.batched_entropy, float)
+register_metric('entropy_percentage', metric_engine.batched_entropy_percentage, float,
+                lambda batch: (batch.totals > 0) & (batch.num_active <= 1))
+register_metric('gini', metric_engine.batched_gini, float)
+register_metric('hhi', metric_engine.batched_hhi, float)
+register_metric('theil_index', metric_engine.batched_theil_index, float,
+                lambda batch: batch.num_active + batch.num_zero_entities == 0)
+register_metric('tau_index', metric_engine.batched_tau_index, int)
+register_metric('nakamoto_coefficient', metric_engine.batched_nakamoto_coefficient, int)
+register_metric('concentration_ratio', metric_engine.batched_concentration_ratio, float,
+                lambda batch: batch.totals == 0)
+register_metric('total_entities', metric_engine.batched_total_entities, int)
+
+
+def get_metric(name):
+    """
+    :param name: string, the name of a metric
+    :returns: the Metric of the registry with the given name
+    :raises ValueError: if there is no such metric
+    """
+    try:
+        return METRIC_REGISTRY[name]
+    except KeyError:
+        raise ValueError(f'Unknown metric {name}. The available metrics are: {list(METRIC_REGISTRY.keys())}')
+
+
+def compute_metrics(blocks_per_entity, metric_params):
+    """
+    Computes the given metrics for all the dates of some aggregated data, for batches of dates at a time (see
+    metric_engine.CELLS_PER_BATCH)
+    :param blocks_per_entity: a BlocksPerEntity object. Dates without any blocks are treated as having no entities.
+    :param metric_params: list of tuples (metric_name, metric, param), where param is the parameter of the metric (or
+        None)
+    :returns: a dictionary with the metric names (keys) and a list with the value of the metric for each date (values)
+    :raises ValueError: if some metric is not in the registry
+    """
+    metrics = [(metric_name, get_metric(metric), param) for metric_name, metric, param in metric_params]
+    num_dates = len(blocks_per_entity.dates)
+    max_active = int(np.diff(blocks_per_entity.date_offsets).max(initial=0))
+    dates_per_batch = max(1, metric_engine.CELLS_PER_BATCH // max(max_active, 1))
+    results = {metric_name: [] for metric_name, _, _ in metric_params}
+    for first_date in range(0, num_dates, dates_per_batch):
+        batch = DistributionBatch.from_blocks_per_entity(blocks_per_entity, first_date,
+                                                         min(num_dates, first_date + dates_per_batch))
+        # dates without any blocks are treated as having no entities at all
+        batch.num_zero_entities = np.where(batch.totals > 0, batch.num_zero_entities, 0)
+        for metric_name, metric, param in metrics:
+            values = metric.function(batch, param) if param is not None else metric.function(batch)
+            int_zero_mask = metric.get_int_zero_mask(batch) if metric.get_int_zero_mask else None
+            results[metric_name].extend(to_metric_values(values, metric.value_type, int_zero_mask))
+    return results
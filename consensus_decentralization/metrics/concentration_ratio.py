@@ -1,9 +1,25 @@
-def compute_concentration_ratio(block_distribution, topn):
+from consensus_decentralization.metrics.distribution_statistics import DistributionStatistics
+
+
+def compute_concentration_ratio(block_distribution, topn, num_zero_entities=0):
     """
     Calculates the n-concentration ratio of a distribution of balances
     :param block_distribution: a list of integers, each being the blocks that an entity has produced, sorted in descending order
     :param topn: the number of top block producers to consider
+    :param num_zero_entities: the number of entities that are part of the population without producing any blocks
+        (they do not affect the result)
     :returns: float that represents the ratio of blocks produced by the top n block producers (0 if there weren't any)
     """
-    total_blocks = sum(block_distribution)
-    return sum(block_distribution[:topn]) / total_blocks if total_blocks else 0
+    return compute_concentration_ratio_from_statistics(DistributionStatistics(block_distribution, num_zero_entities),
+                                                       topn)
+
+
+def compute_concentration_ratio_from_statistics(statistics, topn):
+    """
+    Calculates the n-concentration ratio of a distribution of balances
+    :param statistics: a DistributionStatistics object
+    :param topn: the number of top block producers to consider
+    :returns: float that represents the ratio of blocks produced by the top n block producers (0 if there weren't any)
+    """
+    total_blocks = statistics.total
+    return sum(statistics.sorted_distribution[:topn]) / total_blocks if total_blocks else 0
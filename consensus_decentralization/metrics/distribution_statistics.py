@@ -0,0 +1,67 @@
+from functools import cached_property
+from math import log
+
+
+class DistributionStatistics:
+    """
+    Class that holds a distribution of blocks to entities and the statistics of it that the metrics use (see the
+    compute_<metric>_from_statistics functions). The statistics are computed (once) when they are first accessed. If
+    the distribution is not sorted, it is only sorted when the sorted distribution is first accessed (the selection of
+    the top entities of unsorted distributions is done by the batched metric engine, see metric_engine).
+
+    :ivar block_distribution: a list of integers, each being the blocks that an entity has produced
+    :ivar num_zero_entities: the number of entities that are part of the population without producing any blocks (and
+        are not included in block_distribution)
+    :ivar is_sorted: boolean, indicating whether block_distribution is sorted in descending order
+    """
+
+    def __init__(self, block_distribution, num_zero_entities=0, is_sorted=True):
+        self.block_distribution = block_distribution
+        self.num_zero_entities = num_zero_entities
+        self.is_sorted = is_sorted
+
+    @cached_property
+    def total(self):
+        """
+        :returns: the total number of blocks
+        """
+        return sum(self.block_distribution)
+
+    @cached_property
+    def shares(self):
+        """
+        :returns: a list with the share of blocks of each entity of block_distribution (empty if there are no blocks)
+        """
+        if self.total == 0:
+            return []
+        return [nblocks / self.total for nblocks in self.block_distribution]
+
+    @cached_property
+    def sorted_distribution(self):
+        """
+        :returns: a list with the number of blocks of each entity, sorted in descending order
+        """
+        if self.is_sorted:
+            return self.block_distribution
+        return sorted(self.block_distribution, reverse=True)
+
+    @cached_property
+    def log_shares(self):
+        """
+        :returns: a list with the base-2 logarithm of the share of blocks of each entity (None for 0 shares)
+        """
+        return [log(share, 2) if share > 0 else None for share in self.shares]
+
+    @cached_property
+    def n_active(self):
+        """
+        :returns: the number of entities that have produced blocks
+        """
+        return len([nblocks for nblocks in self.block_distribution if nblocks > 0])
+
+    @cached_property
+    def n_entities(self):
+        """
+        :returns: the number of entities of the population (including the ones without blocks)
+        """
+        return len(self.block_distribution) + self.num_zero_entities
@@ -1,8 +1,8 @@
 from math import log
-from consensus_decentralization.metrics.total_entities import compute_total_entities
+from consensus_decentralization.metrics.distribution_statistics import DistributionStatistics
 
 
-def compute_entropy(block_distribution, alpha):
+def compute_entropy(block_distribution, alpha, num_zero_entities=0):
     """
     Calculates the entropy of a distribution of blocks to entities
     Pi is the relative frequency of each entity.
@@ -11,24 +11,34 @@ def compute_entropy(block_distribution, alpha):
     Min entropy (alpha=-1): -log max Pi
     :param block_distribution: a list of integers, each being the blocks that an entity has produced, sorted in descending order
     :param alpha: the entropy parameter (depending on its value the corresponding entropy measure is used)
+    :param num_zero_entities: the number of entities that are part of the population without producing any blocks
     :returns: a float that represents the entropy of the data or None if the data is empty
     """
-    all_blocks = sum(block_distribution)
-    if all_blocks == 0:
+    return compute_entropy_from_statistics(DistributionStatistics(block_distribution, num_zero_entities), alpha)
+
+
+def compute_entropy_from_statistics(statistics, alpha):
+    """
+    Calculates the entropy of a distribution of blocks to entities (see compute_entropy)
+    :param statistics: a DistributionStatistics object
+    :param alpha: the entropy parameter (depending on its value the corresponding entropy measure is used)
+    :returns: a float that represents the entropy of the data or None if the data is empty
+    """
+    if statistics.total == 0:
         return None
     if alpha == 1:
         entropy = 0
-        for value in block_distribution:
-            rel_freq = value / all_blocks
+        for rel_freq, log_rel_freq in zip(statistics.shares, statistics.log_shares):
             if rel_freq > 0:
-                entropy -= rel_freq * log(rel_freq, 2)
+                entropy -= rel_freq * log_rel_freq
     else:
         if alpha == -1:
-            entropy = - log(max(block_distribution)/all_blocks, 2)
+            entropy = - max(log_rel_freq for log_rel_freq in statistics.log_shares if log_rel_freq is not None)
         else:
-            sum_freqs = 0
-            for entry in block_distribution:
-                sum_freqs += pow(entry/all_blocks, alpha)
+            num_zero_entities = statistics.num_zero_entities
+            sum_freqs = num_zero_entities * pow(0, alpha) if num_zero_entities else 0
+            for rel_freq in statistics.shares:
+                sum_freqs += pow(rel_freq, alpha)
             entropy = log(sum_freqs, 2) / (1 - alpha)
 
     return entropy
@@ -38,11 +48,24 @@ def compute_max_entropy(num_entities, alpha):
     return compute_entropy([1 for i in range(num_entities)], alpha)
 
 
-def compute_entropy_percentage(block_distribution, alpha):
-    if sum(block_distribution) == 0:
+def compute_entropy_percentage(block_distribution, alpha, num_zero_entities=0):
+    return compute_entropy_percentage_from_statistics(DistributionStatistics(block_distribution, num_zero_entities),
+                                                      alpha)
+
+
+def compute_entropy_percentage_from_statistics(statistics, alpha):
+    """
+    Calculates the entropy of a distribution of blocks to entities as a fraction of the maximum entropy for the number
+    of entities that have produced blocks
+    :param statistics: a DistributionStatistics object
+    :param alpha: the entropy parameter
+    :returns: a float that represents the entropy percentage of the data, 0 if there is only one entity or None if the
+    data is empty
+    """
+    if statistics.total == 0:
         return None
     try:
-        total_entities = compute_total_entities(block_distribution)
-        return compute_entropy(block_distribution, alpha) / compute_max_entropy(total_entities, alpha)
+        # the maximum entropy (that of the uniform distribution) is log2(n) for any alpha
+        return compute_entropy_from_statistics(statistics, alpha) / log(statistics.n_active, 2)
     except ZeroDivisionError:
         return 0
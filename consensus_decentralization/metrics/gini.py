@@ -1,16 +1,31 @@
 import numpy as np
+from consensus_decentralization.metrics.distribution_statistics import DistributionStatistics
 
 
-def compute_gini(block_distribution):
+def compute_gini(block_distribution, num_zero_entities=0):
     """
     Calculates the Gini coefficient of a distribution of blocks to entities
     :param block_distribution: a list of integers, each being the blocks that an entity has produced, sorted in descending order
+    :param num_zero_entities: the number of entities that are part of the population without producing any blocks
     :returns: a float that represents the Gini coefficient of the given distribution or None if the data is empty
     """
-    if sum(block_distribution) == 0:
+    # the distribution is sorted anyway, so it is not required to be sorted already
+    return compute_gini_from_statistics(DistributionStatistics(block_distribution, num_zero_entities, is_sorted=False))
+
+
+def compute_gini_from_statistics(statistics):
+    """
+    Calculates the Gini coefficient of a distribution of blocks to entities
+    :param statistics: a DistributionStatistics object
+    :returns: a float that represents the Gini coefficient of the given distribution or None if the data is empty
+    """
+    if statistics.total == 0:
         return None
-    array = np.array(block_distribution)
-    return gini(array)
+    # the entities are sorted in ascending order, after the entities without blocks
+    array = np.array(statistics.sorted_distribution[::-1])
+    n = statistics.n_entities
+    index = np.arange(statistics.num_zero_entities + 1, n + 1)
+    return (np.sum((2 * index - n - 1) * array)) / (n * statistics.total)
 
 
 def gini(array):
@@ -1,4 +1,7 @@
-def compute_hhi(block_distribution):
+from consensus_decentralization.metrics.distribution_statistics import DistributionStatistics
+
+
+def compute_hhi(block_distribution, num_zero_entities=0):
     """
     Calculates the Herfindahl-Hirschman index of a distribution of blocks to entities
     From investopedia: The HHI is calculated by squaring the market share of each firm competing in a market and then
@@ -7,14 +10,27 @@ def compute_hhi(block_distribution):
     competitive marketplace, an HHI of 1,500 to 2,500 to be a moderately concentrated marketplace,
     and an HHI of 2,500 or greater to be a highly concentrated marketplace.
     :param block_distribution: a list of integers, each being the blocks that an entity has produced, sorted in descending order
+    :param num_zero_entities: the number of entities that are part of the population without producing any blocks
+        (they do not affect the result)
+    :return: float between 0 and 10,000 that represents the HHI of the given distribution or None if the data is empty
+    """
+    return compute_hhi_from_statistics(DistributionStatistics(block_distribution, num_zero_entities))
+
+
+def compute_hhi_from_statistics(statistics):
+    """
+    Calculates the Herfindahl-Hirschman index of a distribution of blocks to entities
+    :param statistics: a DistributionStatistics object
     :return: float between 0 and 10,000 that represents the HHI of the given distribution or None if the data is empty
     """
-    total_blocks = sum(block_distribution)
+    total_blocks = statistics.total
     if total_blocks == 0:
         return None
 
     hhi = 0
-    for num_blocks in block_distribution:
+    for num_blocks in statistics.block_distribution:
+        # the share is computed from the number of blocks (and not taken from statistics.shares), so that the
+        # percentages of "round" shares are exact
         hhi += pow(100 * num_blocks / total_blocks, 2)
 
     return hhi
@@ -1,10 +1,23 @@
-from consensus_decentralization.metrics.tau_index import compute_tau_index
+from consensus_decentralization.metrics.distribution_statistics import DistributionStatistics
+from consensus_decentralization.metrics.tau_index import compute_tau_index_from_statistics
 
 
-def compute_nakamoto_coefficient(block_distribution):
+def compute_nakamoto_coefficient(block_distribution, num_zero_entities=0):
     """
     Calculates the Nakamoto coefficient of a distribution of blocks to entities
     :param block_distribution: a list of integers, each being the blocks that an entity has produced, sorted in descending order
+    :param num_zero_entities: the number of entities that are part of the population without producing any blocks
+        (they do not affect the result)
     :returns: int that represents the Nakamoto coefficient of the given distribution, or None if the data is empty
     """
-    return compute_tau_index(block_distribution, 0.5)
+    return compute_nakamoto_coefficient_from_statistics(DistributionStatistics(block_distribution, num_zero_entities))
+
+
+def compute_nakamoto_coefficient_from_statistics(statistics):
+    """
+    Calculates the Nakamoto coefficient of a distribution of blocks to entities, i.e. its tau index for a threshold of
+    50%
+    :param statistics: a DistributionStatistics object
+    :returns: int that represents the Nakamoto coefficient of the given distribution, or None if the data is empty
+    """
+    return compute_tau_index_from_statistics(statistics, 0.5)
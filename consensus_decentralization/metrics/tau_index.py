@@ -1,16 +1,32 @@
-def compute_tau_index(block_distribution, threshold):
+from consensus_decentralization.metrics.distribution_statistics import DistributionStatistics
+
+
+def compute_tau_index(block_distribution, threshold, num_zero_entities=0):
     """
     Calculates the tau-decentralization index of a distribution of blocks
     :param block_distribution: a list of integers, each being the blocks that an entity has produced, sorted in descending order
     :param threshold: float, the parameter of the tau-decentralization index, i.e. the threshold for the power
     ratio that is captured by the index (e.g. 0.66 for 66%)
+    :param num_zero_entities: the number of entities that are part of the population without producing any blocks
+        (they do not affect the result)
     :returns: int that corresponds to the tau index of the given distribution, or None if there were no blocks
     """
-    total_blocks = sum(block_distribution)
+    return compute_tau_index_from_statistics(DistributionStatistics(block_distribution, num_zero_entities), threshold)
+
+
+def compute_tau_index_from_statistics(statistics, threshold):
+    """
+    Calculates the tau-decentralization index of a distribution of blocks, i.e. the minimum number of (top) entities
+    whose cumulative share of blocks reaches the threshold
+    :param statistics: a DistributionStatistics object
+    :param threshold: float, the parameter of the tau-decentralization index
+    :returns: int that corresponds to the tau index of the given distribution, or None if there were no blocks
+    """
+    total_blocks = statistics.total
     if total_blocks == 0:
         return None
     tau_index, power_ratio_covered = 0, 0
-    for block_amount in block_distribution:
+    for block_amount in statistics.sorted_distribution:
         if power_ratio_covered >= threshold:
             break
         tau_index += 1
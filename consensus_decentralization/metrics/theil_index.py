@@ -1,19 +1,29 @@
 from math import log
+from consensus_decentralization.metrics.distribution_statistics import DistributionStatistics
 
 
-def compute_theil_index(block_distribution):
+def compute_theil_index(block_distribution, num_zero_entities=0):
     """
     Calculates the Thiel index of a distribution of blocks to entities
     :param block_distribution: a list of integers, each being the blocks that an entity has produced, sorted in descending order
+    :param num_zero_entities: the number of entities that are part of the population without producing any blocks
     :returns: float that represents the Thiel index of the given distribution
     """
-    n = len(block_distribution)
+    return compute_theil_index_from_statistics(DistributionStatistics(block_distribution, num_zero_entities))
+
+
+def compute_theil_index_from_statistics(statistics):
+    """
+    Calculates the Thiel index of a distribution of blocks to entities
+    :param statistics: a DistributionStatistics object
+    :returns: float that represents the Thiel index of the given distribution
+    """
+    n = statistics.n_entities
     if n == 0:
         return 0
-    total_blocks = sum(block_distribution)
-    mu = total_blocks / n
+    mu = statistics.total / n
     theil = 0
-    for nblocks in block_distribution:
+    for nblocks in statistics.block_distribution:
         x = nblocks / mu
         if x > 0:
             theil += x * log(x)
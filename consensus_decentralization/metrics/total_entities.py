@@ -1,7 +1,21 @@
-def compute_total_entities(block_distribution):
+from consensus_decentralization.metrics.distribution_statistics import DistributionStatistics
+
+
+def compute_total_entities(block_distribution, num_zero_entities=0):
     """
     Computes the number of entities that have produced blocks in the given timeframe.
     :param block_distribution: list of integers, each being the blocks that an entity has produced
+    :param num_zero_entities: the number of entities that are part of the population without producing any blocks
+        (they are not counted)
     :returns: an integer that represents the number of entities that have produced blocks
     """
-    return len([v for v in block_distribution if v > 0])
+    return compute_total_entities_from_statistics(DistributionStatistics(block_distribution, num_zero_entities))
+
+
+def compute_total_entities_from_statistics(statistics):
+    """
+    Computes the number of entities that have produced blocks in the given timeframe.
+    :param statistics: a DistributionStatistics object
+    :returns: an integer that represents the number of entities that have produced blocks
+    """
+    return statistics.n_active
@@ -16,13 +16,31 @@ ledger_parser = {
 }
 
 
-def parse(ledger, input_dirs):
+def parse(ledger, input_dirs, workers=1, timeframes=None, offsets=None):
     """
     Parses raw data
     :param ledger: string that corresponds to the ledger whose data should be parsed
     :param input_dirs: list of paths that point to the directories that contain raw block data
-    :returns: list of dictionaries (the parsed data of the project)
+    :param workers: int, the number of worker processes to use for decoding the raw data
+    :param timeframes: list of (start_date, end_date) tuples, where each date is a datetime.date object, or None. If
+        given, only the blocks that were produced within these timeframes are parsed
+    :param offsets: dictionary that maps the path of each raw data file (string) to a tuple of (start, end) byte
+        offsets, or None. If given, only the blocks that are stored within these offsets are parsed
+    :returns: generator of dictionaries (the parsed data of the project), sorted by timestamp
     """
     logging.info(f'Parsing {ledger} data..')
-    parser = ledger_parser[ledger](ledger=ledger, input_dirs=input_dirs)
+    parser = ledger_parser[ledger](ledger=ledger, input_dirs=input_dirs, workers=workers, timeframes=timeframes,
+                                   offsets=offsets)
     return parser.parse()
+
+
+def get_raw_data_checkpoint(ledger, input_dirs):
+    """
+    Determines how far the raw data of a ledger currently extend
+    :param ledger: string that corresponds to the ledger whose raw data should be considered
+    :param input_dirs: list of paths that point to the directories that contain raw block data
+    :returns: dictionary with the size of each raw data file in bytes ('raw_data_offsets') and the number of the last
+        block stored in the raw data ('last_block_number')
+    :raises FileNotFoundError: if there are no raw data for the ledger in the input directories
+    """
+    return ledger_parser[ledger](ledger=ledger, input_dirs=input_dirs).get_checkpoint()
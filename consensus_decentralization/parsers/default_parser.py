@@ -1,7 +1,25 @@
 import codecs
+import contextlib
+import heapq
 import json
+import logging
+import pathlib
+import queue
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from consensus_decentralization.compression import COMPRESSION_EXTENSIONS, get_compression, open_file
 
 MIN_TX_VALUE = 0
+SORT_RUN_SIZE = 500000  # maximum number of blocks that are held in memory at once when the raw data need sorting
+RANGES_PER_WORKER = 4  # number of byte ranges that each worker process handles (on average) when parsing in parallel
+LAST_LINE_CHUNK_SIZE = 65536  # number of bytes to read at a time when looking for the last line of a file
+PREFETCH_BATCH_SIZE = 256  # number of blocks that are handed over at once by a thread that reads a raw data file
+PREFETCH_BATCHES = 8  # maximum number of batches that a thread that reads a raw data file can read ahead
+TIMESTAMP_PATTERN = re.compile(rb'"timestamp"\s*:\s*"([^"]*)"')
 
 
 class DefaultParser:
@@ -11,11 +29,21 @@ class DefaultParser:
 
     :ivar ledger: the name of the ledger associated with a specific parser instance
     :ivar input_dirs: the directories where the raw block data are stored
+    :ivar workers: the number of worker processes to use for decoding the raw data (1 means no parallelism)
+    :ivar timeframes: a list of (start_date, end_date) tuples of strings in YYYY-MM-DD format, or None. If given, only
+    blocks that were produced within (any of) these timeframes are parsed, while all other blocks are skipped before
+    being decoded
+    :ivar offsets: a dictionary that maps the path of a raw data file (string) to a tuple of (start, end) byte offsets,
+    or None. If given, only the lines of the file that start within these offsets are parsed (e.g. to only parse the
+    blocks that were appended to the file after some earlier run)
     """
 
-    def __init__(self, ledger, input_dirs):
+    def __init__(self, ledger, input_dirs, workers=1, timeframes=None, offsets=None):
         self.ledger = ledger
         self.input_dirs = input_dirs
+        self.workers = workers
+        self.timeframes = None if timeframes is None else [(str(start), str(end)) for start, end in timeframes]
+        self.offsets = offsets
 
     @staticmethod
     def parse_identifiers(block_identifiers):
@@ -27,47 +55,449 @@ class DefaultParser:
         """
         return str(codecs.decode(block_identifiers, 'hex'))
 
-    def get_input_file(self):
+    @staticmethod
+    def get_timestamp(line):
         """
-        Determines the file that contains the raw data for the project. The file is expected to be named
-        <ledger>_raw_data.json and to be located in (exactly) one of the input directories.
-        :returns: a Path object that corresponds to the file containing the raw data
-        :raises FileNotFoundError: if the file does not exist in any of the input directories
+        Retrieves the timestamp of a block directly from its raw json line, without decoding the entire block
+        :param line: bytes that correspond to one line of the raw data file (i.e. one block)
+        :returns: the timestamp of the block
         """
-        filename = f'{self.ledger}_raw_data.json'
-        for input_dir in self.input_dirs:
-            filepath = input_dir / filename
-            if filepath.is_file():
-                return filepath
-        raise FileNotFoundError(f'File {self.ledger}_raw_data.json not found in the input directories. Skipping '
-                                f'{self.ledger}..')
+        match = TIMESTAMP_PATTERN.search(line)
+        if match:
+            return match.group(1).decode()
+        return json.loads(line)['timestamp']
 
-    def read_and_sort_data(self):
+    @staticmethod
+    def decode_block(line):
+        """
+        Decodes a raw block, keeping only the fields that are needed for parsing it. Specifically, from each output of
+        the (coinbase) transaction of the block, only the first address and the value are kept, while the script
+        data (script_asm, script_hex, type, required_signatures) are dropped as soon as the block is decoded, so that
+        they are never retained in memory or written to temporary files. Should be overridden by a project-specific
+        parser if the raw data have a different structure.
+        :param line: bytes that correspond to one line of the raw data file (i.e. one block)
+        :returns: dictionary with the (projected) raw data of the block
+        """
+        block = json.loads(line)
+        return {
+            'number': block['number'],
+            'timestamp': block['timestamp'],
+            'identifiers': block['identifiers'],
+            'outputs': [{'addresses': tx['addresses'][:1], 'value': tx['value']} for tx in block['outputs']]
+        }
+
+    def project_line(self, line):
+        """
+        Projects a raw block to the fields that are needed for parsing it (see decode_block), re-encoding it as a
+        compact json line
+        :param line: bytes that correspond to one line of the raw data file (i.e. one block)
+        :returns: bytes that correspond to the projected block, terminated by a newline character
+        """
+        return json.dumps(self.decode_block(line), separators=(',', ':')).encode() + b'\n'
+
+    def get_input_files(self):
+        """
+        Determines the files that contain the raw data for the project. The raw data may be split into multiple files
+        (shards, e.g. one per month), which can be located in any of the input directories. Each file is expected to
+        be named <ledger>_raw_data<suffix>.json, where the suffix is optional (e.g. bitcoin_raw_data.json or
+        bitcoin_raw_data_2023-01.json), possibly followed by the extension of a compression format (e.g.
+        bitcoin_raw_data.json.gz).
+        :returns: a list of Path objects that correspond to the files containing the raw data
+        :raises FileNotFoundError: if no such file exists in any of the input directories
+        """
+        extensions = ['.json'] + [f'.json{extension}' for extension in COMPRESSION_EXTENSIONS.keys()]
+        input_files = sorted(filepath for input_dir in self.input_dirs
+                             for filepath in pathlib.Path(input_dir).glob(f'{self.ledger}_raw_data*.json*')
+                             if filepath.is_file() and filepath.name.endswith(tuple(extensions)))
+        if not input_files:
+            raise FileNotFoundError(f'File {self.ledger}_raw_data.json not found in the input directories. Skipping '
+                                    f'{self.ledger}..')
+        return input_files
+
+    def get_files_to_parse(self):
+        """
+        Determines the raw data files that need to be parsed, i.e. all the files of the project or, if the parser is
+        restricted to specific byte offsets, only the files for which offsets are given
+        :returns: a list of Path objects that correspond to the files to parse
+        """
+        return [filepath for filepath in self.get_input_files() if self.offsets is None or str(filepath) in self.offsets]
+
+    def get_checkpoint(self):
+        """
+        Determines how far the raw data of the project currently extend, so that the blocks that are appended to the
+        raw data later on can be parsed separately
+        :returns: a dictionary with the current size of each raw data file ('raw_data_offsets', mapping the path of the
+        file to its size in bytes) and the number of the last block stored in the raw data ('last_block_number', i.e.
+        the highest number among the last blocks of the files, int or None if there are no blocks)
+        :raises FileNotFoundError: if no raw data file exists in any of the input directories
+        """
+        raw_data_offsets, last_block_numbers = dict(), list()
+        for filepath in self.get_input_files():
+            file_size = filepath.stat().st_size
+            raw_data_offsets[str(filepath)] = file_size
+            last_line = self.read_last_line(filepath, file_size)
+            if last_line is not None:
+                last_block_numbers.append(int(self.decode_block(last_line)['number']))
+        return {
+            'raw_data_offsets': raw_data_offsets,
+            'last_block_number': max(last_block_numbers, default=None)
+        }
+
+    def get_offsets(self, filepath):
+        """
+        Determines the part of a raw data file that should be parsed
+        :param filepath: the path to the file
+        :returns: a tuple of (start, end) byte offsets
+        """
+        if self.offsets is None:
+            return 0, filepath.stat().st_size
+        return self.offsets[str(filepath)]
+
+    @staticmethod
+    def read_lines(filepath, start=0, end=None):
+        """
+        Lazily reads the (non-empty) lines of a file, which may be compressed (see compression.open_file)
+        :param filepath: the path to the file
+        :param start: the byte offset to start reading from, which should correspond to the beginning of a line (or,
+            for compressed files, of a compressed stream)
+        :param end: the byte offset to stop reading at (i.e. only lines that start before it are read) or None to read
+            until the end of the file
+        :returns: a generator of bytes, each corresponding to one block, terminated by a newline character
+        """
+        is_compressed = get_compression(filepath) is not None
+        with open_file(filepath, start=start, end=end) as f:
+            position = start
+            for line in f:
+                if not is_compressed:
+                    if end is not None and position >= end:
+                        break
+                    position += len(line)
+                if line.strip():
+                    yield line if line.endswith(b'\n') else line + b'\n'
+
+    def is_selected(self, line):
+        """
+        Determines whether a block falls within the timeframes that the parser is restricted to, using only its
+        timestamp (i.e. without decoding the entire block)
+        :param line: bytes that correspond to one line of the raw data file (i.e. one block)
+        :returns: True if the parser is not restricted to specific timeframes or if the block was produced within one
+        of them, otherwise False
+        """
+        if self.timeframes is None:
+            return True
+        day = self.get_timestamp(line)[:10]
+        return any(start <= day <= end for start, end in self.timeframes)
+
+    def read_selected_lines(self, filepath):
+        """
+        Lazily reads the lines of (the relevant part of) a raw data file that correspond to blocks within the timeframes
+        of the parser
+        :param filepath: the path to the file
+        :returns: a generator of bytes, each corresponding to one block, terminated by a newline character
+        """
+        start, end = self.get_offsets(filepath)
+        lines = self.read_lines(filepath, start, end)
+        if get_compression(filepath) is not None:  # decompress in a separate thread, overlapping with json decoding
+            lines = self.prefetch(lines)
+        return (line for line in lines if self.is_selected(line))
+
+    def is_sorted(self, filepath):
+        """
+        Checks, in a single streaming pass, whether the blocks of a raw data file are already sorted by timestamp
+        :param filepath: the path to the file
+        :returns: True if the blocks appear in chronological order in the file, otherwise False
+        """
+        previous_timestamp = None
+        for line in self.read_selected_lines(filepath):
+            timestamp = self.get_timestamp(line)
+            if previous_timestamp is not None and timestamp < previous_timestamp:
+                return False
+            previous_timestamp = timestamp
+        return True
+
+    @staticmethod
+    def read_last_line(filepath, end):
+        """
+        Reads the last (non-empty) line of a file that starts before some byte offset, by reading the file backwards in
+        chunks. Compressed files cannot be read backwards, so they are decompressed up to the offset instead.
+        :param filepath: the path to the file
+        :param end: the byte offset, which should correspond to the end of a line (or, for compressed files, of a
+            compressed stream)
+        :returns: bytes, the last line (without the newline character), or None if there are no lines before the offset
+        """
+        if get_compression(filepath) is not None:
+            last_line = None
+            for last_line in DefaultParser.read_lines(filepath, 0, end):
+                pass
+            return None if last_line is None else last_line.rstrip()
+        with open(filepath, 'rb') as f:
+            position, chunk = end, b''
+            while position > 0:
+                read_size = min(LAST_LINE_CHUNK_SIZE, position)
+                position -= read_size
+                f.seek(position)
+                chunk = f.read(read_size) + chunk
+                lines = chunk.rstrip()
+                if b'\n' in lines or position == 0:
+                    return lines.rsplit(b'\n', 1)[-1] or None
+        return None
+
+    @staticmethod
+    def write_run(run, filepath):
         """
-        Reads the "raw" block data associated with the project
-        :returns: a list of dictionaries (block data) sorted by timestamp
+        Sorts a run of blocks by timestamp and writes it into a (temporary) file
+        :param run: list of (timestamp, line) tuples, each corresponding to a block
+        :param filepath: the path to the file where the sorted run will be written
+        :returns: the path to the file
         """
+        run.sort(key=lambda x: x[0])
+        with open(filepath, 'wb') as f:
+            f.writelines(line for _, line in run)
+        return filepath
+
+    def write_sorted_runs(self, filepath, tmp_dir):
+        """
+        Splits the raw data into runs of at most SORT_RUN_SIZE blocks, sorts each run by timestamp and writes it into
+        a temporary file. The blocks are projected (see project_line) before being added to a run, so that the runs
+        only hold the data that are needed for parsing.
+        :param filepath: the path to the raw data file
+        :param tmp_dir: pathlib.Path object of the directory where the sorted runs will be written
+        :returns: a list of paths, each corresponding to a file with a sorted run
+        """
+        run_files = []
+        run = []
+        for line in self.read_selected_lines(filepath):
+            run.append((self.get_timestamp(line), self.project_line(line)))
+            if len(run) >= SORT_RUN_SIZE:
+                run_files.append(self.write_run(run, tmp_dir / f'run_{len(run_files)}.json'))
+                run = []
+        if run:
+            run_files.append(self.write_run(run, tmp_dir / f'run_{len(run_files)}.json'))
+        return run_files
+
+    def merge_sorted_runs(self, filepath):
+        """
+        Sorts the raw data with an external merge sort, so that only a bounded number of blocks is held in memory
+        at any time: the data are split into sorted runs that are spilled to temporary files, which are then merged
+        lazily by timestamp. Blocks with the same timestamp retain the order in which they appear in the file.
+        :param filepath: the path to the raw data file
+        :returns: a generator of dictionaries (projected block data, see decode_block) sorted by timestamp
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_files = self.write_sorted_runs(filepath, pathlib.Path(tmp_dir))
+            with contextlib.ExitStack() as stack:
+                runs = [self.read_lines(run_file) for run_file in run_files]
+                for run in runs:
+                    stack.callback(run.close)
+                for line in heapq.merge(*runs, key=self.get_timestamp):
+                    yield self.decode_block(line)
+
+    def read_and_sort_file(self, filepath):
+        """
+        Reads the "raw" block data of one raw data file. If the data are not already sorted, they are sorted
+        out-of-core (see merge_sorted_runs), so the entire file is never loaded into memory.
+        :param filepath: the path to the raw data file
+        :returns: a generator of dictionaries (projected block data, see decode_block) sorted by timestamp
+        """
+        if self.is_sorted(filepath):
+            return (self.decode_block(line) for line in self.read_selected_lines(filepath))
+        return self.merge_sorted_runs(filepath)
+
+    @staticmethod
+    def prefetch(blocks):
+        """
+        Consumes an iterable of blocks in a background thread, so that the blocks are read ahead (in batches of
+        PREFETCH_BATCH_SIZE blocks, at most PREFETCH_BATCHES batches at a time) while the consumer processes the
+        blocks that have already been read. Any exception raised while reading the blocks is re-raised to the consumer.
+        :param blocks: iterable of blocks (e.g. a generator that reads a raw data file)
+        :returns: a generator that yields the same blocks in the same order
+        """
+        batches = queue.Queue(maxsize=PREFETCH_BATCHES)
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_ahead():
+            try:
+                batch = []
+                for block in blocks:
+                    batch.append(block)
+                    if len(batch) >= PREFETCH_BATCH_SIZE:
+                        if not put((batch, None)):
+                            return
+                        batch = []
+                put((batch, None))
+                put((None, None))
+            except Exception as e:
+                put((None, e))
+            finally:
+                close = getattr(blocks, 'close', None)
+                if close is not None:
+                    close()
+
+        thread = threading.Thread(target=read_ahead, daemon=True)
+        thread.start()
         try:
-            filepath = self.get_input_file()
-        except FileNotFoundError as e:
-            raise e
-        with open(filepath) as f:
-            contents = f.read()
-        data = [json.loads(item) for item in contents.strip().split('\n')]
-        data = sorted(data, key=lambda x: x['timestamp'])
-        return data
+            while True:
+                batch, exception = batches.get()
+                if exception is not None:
+                    raise exception
+                if batch is None:
+                    return
+                yield from batch
+        finally:
+            stopped.set()
+            thread.join()
+
+    @staticmethod
+    def deduplicate(blocks):
+        """
+        Removes duplicate blocks (e.g. blocks that are included in more than one raw data file) from a stream of blocks
+        sorted by timestamp. Since copies of the same block have the same timestamp, they are adjacent to each other
+        (within the group of blocks with that timestamp), so only the numbers of the current group need to be held.
+        :param blocks: iterable of dictionaries (block data) sorted by timestamp
+        :returns: a generator of dictionaries (block data) sorted by timestamp, where only the first occurrence of each
+        block is kept
+        """
+        current_timestamp, current_numbers = None, set()
+        for block in blocks:
+            if block['timestamp'] != current_timestamp:
+                current_timestamp, current_numbers = block['timestamp'], set()
+            if block['number'] in current_numbers:
+                continue
+            current_numbers.add(block['number'])
+            yield block
+
+    def read_and_sort_data(self):
+        """
+        Reads the "raw" block data associated with the project. If the data are split into multiple files, the files
+        are read concurrently (each one by a separate thread, see prefetch) and their blocks are merged lazily by
+        timestamp. Blocks that appear in more than one file are only returned once.
+        :returns: a generator of dictionaries (projected block data, see decode_block) sorted by timestamp
+        """
+        input_files = self.get_files_to_parse()
+        if len(input_files) == 1:
+            return self.deduplicate(self.read_and_sort_file(input_files[0]))
+        return self.merge_files(input_files)
+
+    def merge_files(self, input_files):
+        """
+        Merges the (sorted) blocks of multiple raw data files, reading the files concurrently
+        :param input_files: list of paths to raw data files
+        :returns: a generator of dictionaries (projected block data, see decode_block) sorted by timestamp
+        """
+        with contextlib.ExitStack() as stack:
+            streams = [self.prefetch(self.read_and_sort_file(filepath)) for filepath in input_files]
+            for stream in streams:
+                stack.callback(stream.close)
+            yield from self.deduplicate(heapq.merge(*streams, key=lambda block: block['timestamp']))
+
+    @staticmethod
+    def get_byte_ranges(filepath, num_ranges, start=0, end=None):
+        """
+        Splits (part of) a file into (at most) num_ranges byte ranges of roughly equal size, each starting at the
+        beginning of a line and ending right after a newline character (or at the end of the file). Compressed files
+        cannot be split, so they always correspond to a single range.
+        :param filepath: the path to the file
+        :param num_ranges: the number of ranges to split the file into
+        :param start: the byte offset where the part of the file to split starts (beginning of a line)
+        :param end: the byte offset where the part of the file to split ends, or None for the end of the file
+        :returns: a list of (start, end) tuples, where start is inclusive and end exclusive
+        """
+        if end is None:
+            end = filepath.stat().st_size
+        if get_compression(filepath) is not None:
+            return [(start, end)] if start < end else []
+        boundaries = [start]
+        with open(filepath, 'rb') as f:
+            for i in range(1, num_ranges):
+                position = start + (end - start) * i // num_ranges
+                if position <= boundaries[-1]:
+                    continue
+                f.seek(position - 1)
+                f.readline()  # move to the beginning of the next line
+                if f.tell() >= end:
+                    break
+                boundaries.append(f.tell())
+        boundaries.append(end)
+        return [(range_start, range_end) for range_start, range_end in zip(boundaries, boundaries[1:])
+                if range_start < range_end]
+
+    def parse_byte_range(self, filepath, start, end):
+        """
+        Decodes and parses the blocks that are contained in a byte range of a raw data file (and fall within the
+        timeframes of the parser)
+        :param filepath: the path to the file
+        :param start: the offset of the first byte of the range (which is the first byte of a line)
+        :param end: the offset right after the last byte of the range
+        :returns: a list of dictionaries (parsed block data) sorted by timestamp
+        """
+        parsed_blocks = [self.parse_block(self.decode_block(line)) for line in self.read_lines(filepath, start, end)
+                         if self.is_selected(line)]
+        parsed_blocks.sort(key=lambda block: block['timestamp'])
+        return parsed_blocks
+
+    def parse_in_parallel(self):
+        """
+        Parses the raw data using multiple processes. The raw data files are split into newline-aligned byte ranges
+        (a number of ranges proportional to the size of each file), which are decoded and parsed by a pool of worker
+        processes. The (sorted) results of the ranges are then merged by timestamp, so that the blocks are returned in
+        the same order as when parsing sequentially. Note that, unlike sequential parsing, this keeps all parsed blocks
+        in memory.
+        :returns: a generator of dictionaries (the parsed data of the project) sorted by timestamp
+        """
+        file_offsets = {filepath: self.get_offsets(filepath) for filepath in self.get_files_to_parse()}
+        total_size = sum(end - start for start, end in file_offsets.values())
+        byte_ranges = []
+        for filepath, (start, end) in file_offsets.items():
+            num_ranges = max(1, round(self.workers * RANGES_PER_WORKER * (end - start) / total_size)) if total_size else 1
+            byte_ranges.extend((filepath, range_start, range_end) for range_start, range_end in
+                               self.get_byte_ranges(filepath, num_ranges, start, end))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.parse_byte_range, filepath, start, end) for filepath, start, end in
+                       byte_ranges]
+            parsed_ranges = [future.result() for future in futures]
+        yield from self.deduplicate(heapq.merge(*parsed_ranges, key=lambda block: block['timestamp']))
+
+    def parse_block(self, block):
+        """
+        Parses a single (raw) block, keeping only the information that is relevant to the analysis
+        :param block: dictionary with the raw data of the block
+        :returns: dictionary with the parsed data of the block (number, timestamp, identifiers, reward addresses)
+        """
+        block['reward_addresses'] = ','.join(sorted([tx['addresses'][0] for tx in block['outputs'] if
+                                                     (tx['addresses'] and int(tx['value']) > MIN_TX_VALUE)]))
+        del block['outputs']
+        block['identifiers'] = self.parse_identifiers(block['identifiers'])
+        return block
 
     def parse(self):
         """
         Parses the data and writes the results into a file in a directory associated with the parser instance
-        (specifically in <general output directory>/<project_name>)
-        :returns: a list of dictionaries (the parsed data of the project)
+        (specifically in <general output directory>/<project_name>). If more than one worker is used, the raw data
+        are decoded in parallel (see parse_in_parallel). The throughput of the parser is logged once all blocks have
+        been parsed.
+        :returns: a generator of dictionaries (the parsed data of the project)
         """
-        data = self.read_and_sort_data()
+        if self.workers > 1:
+            parsed_blocks = self.parse_in_parallel()
+        else:
+            parsed_blocks = (self.parse_block(block) for block in self.read_and_sort_data())
 
-        for block in data:
-            block['reward_addresses'] = ','.join(sorted([tx['addresses'][0] for tx in block['outputs'] if
-                                                         (tx['addresses'] and int(tx['value']) > MIN_TX_VALUE)]))
-            del block['outputs']
-            block['identifiers'] = self.parse_identifiers(block['identifiers'])
-        return data
+        num_blocks, parsing_time = 0, 0
+        start_time = time.perf_counter()
+        for block in parsed_blocks:
+            num_blocks += 1
+            parsing_time += time.perf_counter() - start_time
+            yield block
+            start_time = time.perf_counter()  # time spent by the consumer of the generator is not counted
+        parsing_time += time.perf_counter() - start_time
+        logging.info(f'Parsed {num_blocks} {self.ledger} blocks in {parsing_time:.2f} seconds using {self.workers} '
+                     f'worker(s) ({num_blocks / parsing_time if parsing_time else 0:.0f} blocks/s)')
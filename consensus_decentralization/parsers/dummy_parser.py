@@ -1,3 +1,4 @@
+import json
 from consensus_decentralization.parsers.default_parser import DefaultParser
 
 
@@ -6,8 +7,8 @@ class DummyParser(DefaultParser):
     Dummy parser that only sorts the raw data. Used when the data are already in the required format.
     """
 
-    def __init__(self, ledger, input_dirs):
-        super().__init__(ledger, input_dirs)
+    def __init__(self, ledger, input_dirs, workers=1, timeframes=None, offsets=None):
+        super().__init__(ledger, input_dirs, workers, timeframes, offsets)
 
     @staticmethod
     def parse_identifiers(block_identifiers):
@@ -18,18 +19,36 @@ class DummyParser(DefaultParser):
         """
         return block_identifiers
 
-    def parse(self):
+    @staticmethod
+    def decode_block(line):
+        """
+        Overrides the decode_block method of the DefaultParser class. The raw data of the projects that use this parser
+        only include the required fields, so the entire block is decoded.
+        :param line: bytes that correspond to one line of the raw data file (i.e. one block)
+        :returns: dictionary with the raw data of the block
+        """
+        return json.loads(line)
+
+    def project_line(self, line):
         """
-        Sorts the data, makes sure that each entry includes all required fields and writes the results into a file in a
-        directory associated with the parser instance (specifically in <general output directory>/<project_name>)
+        Overrides the project_line method of the DefaultParser class. Returns the line as is, since there are no
+        fields to drop.
+        :param line: bytes that correspond to one line of the raw data file (i.e. one block)
+        :returns: the given line
         """
-        data = self.read_and_sort_data()
+        return line
 
-        for block in data:
-            if 'identifiers' not in block.keys():
-                block['identifiers'] = None
-            else:
-                block['identifiers'] = self.parse_identifiers(block['identifiers'])
-            if 'reward_addresses' not in block.keys():
-                block['reward_addresses'] = None
-            yield block
+    def parse_block(self, block):
+        """
+        Overrides the parse_block method of the DefaultParser class. Makes sure that the block includes all required
+        fields.
+        :param block: dictionary with the raw data of the block
+        :returns: dictionary with the parsed data of the block (number, timestamp, identifiers, reward addresses)
+        """
+        if 'identifiers' not in block.keys():
+            block['identifiers'] = None
+        else:
+            block['identifiers'] = self.parse_identifiers(block['identifiers'])
+        if 'reward_addresses' not in block.keys():
+            block['reward_addresses'] = None
+        return block
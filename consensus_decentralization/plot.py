@@ -3,7 +3,6 @@ import logging
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import seaborn as sns
-import numpy as np
 import consensus_decentralization.helper as hlp
 import colorcet as cc
 import pandas as pd
@@ -142,31 +141,19 @@ def plot_dynamics_per_ledger(ledgers, aggregated_data_filename, output_dir, top_
         figures_path = output_dir / ledger
         figures_path.mkdir(parents=True, exist_ok=True)
 
-        time_chunks, blocks_per_entity = hlp.get_blocks_per_entity_from_file(
+        blocks_per_entity = hlp.get_blocks_per_entity_array_from_file(
             filepath=ledger_path / hlp.get_aggregated_data_dir_name(hlp.get_clustering_flag()) / aggregated_data_filename
         )
 
-        total_blocks_per_time_chunk = [0] * len(time_chunks)
-        for entity, block_values in blocks_per_entity.items():
-            for time_chunk, nblocks in block_values.items():
-                total_blocks_per_time_chunk[time_chunks.index(time_chunk)] += nblocks
-
-        total_blocks_per_time_chunk = np.array(total_blocks_per_time_chunk)
+        blocks_array = blocks_per_entity.to_dense()
+        active_idx = blocks_array.any(axis=1).nonzero()[0]  # only keep entities with at least one block
+        blocks_array = blocks_array[active_idx]
+        entities = [blocks_per_entity.entities[i] for i in active_idx]
+        total_blocks_per_time_chunk = blocks_array.sum(axis=0)
         nonzero_idx = total_blocks_per_time_chunk.nonzero()[0]  # only keep time chunks with at least one block
         total_blocks_per_time_chunk = total_blocks_per_time_chunk[nonzero_idx]
-        time_chunks = [time_chunks[i] for i in nonzero_idx]
-
-        blocks_array = []
-        for entity, block_values in blocks_per_entity.items():
-            entity_array = []
-            for time_chunk in time_chunks:
-                try:
-                    entity_array.append(block_values[time_chunk])
-                except KeyError:
-                    entity_array.append(0)
-            blocks_array.append(entity_array)
-
-        blocks_array = np.array(blocks_array)
+        blocks_array = blocks_array[:, nonzero_idx]
+        time_chunks = [blocks_per_entity.dates[i] for i in nonzero_idx]
 
         if unit == 'relative':
             block_shares_array = blocks_array / total_blocks_per_time_chunk * 100
@@ -183,7 +170,7 @@ def plot_dynamics_per_ledger(ledgers, aggregated_data_filename, output_dir, top_
             f"{entity_name if len(entity_name) <= 15 else entity_name[:15] + '..'}"
             f"({round(max_values_per_pool[i], 1)}{'%' if unit == 'relative' else ''})"
             if any(values[i] > legend_threshold) else f'_{entity_name}'
-            for i, entity_name in enumerate(blocks_per_entity.keys())
+            for i, entity_name in enumerate(entities)
         ]
         if top_k > 0:  # only keep the top k pools (i.e. the pools that produced the most blocks in total)
             total_value_per_pool = values.sum(axis=1)
@@ -0,0 +1,106 @@
+"""
+Module with the stage cache, which determines whether the output of a stage of the pipeline (mapping, aggregation) can
+be reused, based on a hash of the inputs of the stage, and keeps a manifest per ledger that records when and why each
+stage ran (or was skipped)
+"""
+import datetime
+import hashlib
+import json
+import pathlib
+from functools import lru_cache
+
+PACKAGE_DIR = pathlib.Path(__file__).resolve().parent
+MANIFEST_FILENAME = 'stage_manifest.json'
+# the modules (files or packages, relative to the package directory) whose code determines the output of each stage;
+# helper.py is included in both, since it holds e.g. the resolution of legal links (map) and the writing of the
+# mapped and aggregated data (map, aggregate)
+STAGE_SOURCES = {
+    'map': ['parse.py', 'parsers', 'map.py', 'mappings', 'mapped_columns.py', 'helper.py'],
+    'aggregate': ['aggregate.py', 'block_count_cube.py', 'mapped_columns.py', 'compression.py', 'helper.py']
+}
+
+
+@lru_cache(maxsize=None)
+def get_code_fingerprint(stage):
+    """
+    Computes a fingerprint of the code of a stage, so that outputs that were produced by a different version of the
+    code can be detected
+    :param stage: string, one of the keys of STAGE_SOURCES
+    :returns: string, the hex digest of a hash over the contents of the source files of the stage
+    """
+    fingerprint = hashlib.sha256()
+    for source in STAGE_SOURCES[stage]:
+        source_path = PACKAGE_DIR / source
+        for filepath in sorted(source_path.rglob('*.py')) if source_path.is_dir() else [source_path]:
+            fingerprint.update(str(filepath.relative_to(PACKAGE_DIR)).encode())
+            fingerprint.update(filepath.read_bytes())
+    return fingerprint.hexdigest()
+
+
+def get_stage_key(inputs):
+    """
+    :param inputs: dictionary with the (JSON-serializable) inputs of a stage, e.g. fingerprints of the input files and
+        the values of the relevant parameters
+    :returns: string, the hex digest of a hash over the inputs, which identifies the output of the stage
+    """
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def read_manifest(ledger_dir):
+    """
+    :param ledger_dir: pathlib.PosixPath object of the output directory of a ledger
+    :returns: dictionary with the stage ids (keys) and the latest manifest entry of each stage (values), or an empty
+    dictionary if there is no manifest
+    """
+    try:
+        with open(ledger_dir / MANIFEST_FILENAME) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+
+def get_run_reason(ledger_dir, stage_id, inputs, output_exists, force_reason=None):
+    """
+    Determines whether a stage needs to run, by comparing the key of its inputs to the one that was recorded in the
+    manifest when its existing output was produced
+    :param ledger_dir: pathlib.PosixPath object of the output directory of the ledger
+    :param stage_id: string that identifies the stage and its output, e.g. 'aggregate:<output file>'
+    :param inputs: dictionary with the inputs of the stage (see get_stage_key)
+    :param output_exists: boolean, whether the output of the stage exists
+    :param force_reason: string with the reason why the stage should run regardless of its inputs, or None
+    :returns: string with the reason why the stage needs to run, or None if its existing output can be reused
+    """
+    if force_reason is not None:
+        return force_reason
+    if not output_exists:
+        return 'no existing output'
+    previous_entry = read_manifest(ledger_dir).get(stage_id)
+    if previous_entry is None:
+        return 'no record of the inputs of the existing output'
+    if previous_entry['key'] != get_stage_key(inputs):
+        inputs = json.loads(json.dumps(inputs, default=str))  # to compare them with the (JSON) recorded inputs
+        previous_inputs = previous_entry.get('inputs', dict())
+        changed_inputs = sorted(name for name in set(inputs) | set(previous_inputs)
+                                if inputs.get(name) != previous_inputs.get(name))
+        return f'inputs changed: {", ".join(changed_inputs)}'
+    return None
+
+
+def record_stage(ledger_dir, stage_id, inputs, reason):
+    """
+    Records in the manifest of a ledger that a stage ran (or was skipped) and why
+    :param ledger_dir: pathlib.PosixPath object of the output directory of the ledger
+    :param stage_id: string that identifies the stage and its output, e.g. 'aggregate:<output file>'
+    :param inputs: dictionary with the inputs of the stage (see get_stage_key)
+    :param reason: string with the reason why the stage ran, or None if its existing output was reused
+    """
+    manifest = read_manifest(ledger_dir)
+    manifest[stage_id] = {
+        'key': get_stage_key(inputs),
+        'inputs': inputs,
+        'ran': reason is not None,
+        'reason': reason if reason is not None else 'inputs unchanged',
+        'time': datetime.datetime.now().isoformat(timespec='seconds')
+    }
+    with open(ledger_dir / MANIFEST_FILENAME, 'w') as f:
+        json.dump(manifest, f, indent=4, default=str)
@@ -9,6 +9,7 @@
     `data_collection_scripts` directory of the project under the name 'google-service-account-key.json'
 """
 import consensus_decentralization.helper as hlp
+from consensus_decentralization.compression import COMPRESSION_EXTENSIONS, open_file
 import google.cloud.bigquery as bq
 import json
 import argparse
@@ -19,7 +20,19 @@ from datetime import datetime
 from consensus_decentralization.helper import ROOT_DIR
 
 
-def collect_data(raw_data_dir, ledgers, from_block, to_date):
+def get_raw_data_file(raw_data_dir, ledger, compression):
+    """
+    Determines the file where the raw data of a ledger are stored
+    :param raw_data_dir: the directory where the raw data are stored
+    :param ledger: the ledger whose raw data are considered
+    :param compression: the compression format of the raw data (e.g. 'gzip') or None for uncompressed raw data
+    :returns: a Path object that corresponds to the raw data file
+    """
+    extensions = {compression: extension for extension, compression in COMPRESSION_EXTENSIONS.items()}
+    return raw_data_dir / (f'{ledger}_raw_data.json' + (extensions[compression] if compression else ''))
+
+
+def collect_data(raw_data_dir, ledgers, from_block, to_date, compression=None):
     data_collection_dir = ROOT_DIR / "data_collection_scripts"
 
     with open(data_collection_dir / "queries.yaml") as f:
@@ -28,7 +41,7 @@ def collect_data(raw_data_dir, ledgers, from_block, to_date):
     client = bq.Client.from_service_account_json(json_credentials_path=data_collection_dir / "google-service-account-key.json")
 
     for ledger in ledgers:
-        file = raw_data_dir / f'{ledger}_raw_data.json'
+        file = get_raw_data_file(raw_data_dir, ledger, compression)
         logging.info(f"Querying {ledger} from block {from_block[ledger]} until {to_date}..")
 
         query = (queries[ledger]).replace("{{block_number}}", str(from_block[ledger]) if from_block[ledger] else "-1").replace("{{timestamp}}", to_date)
@@ -46,25 +59,28 @@ def collect_data(raw_data_dir, ledgers, from_block, to_date):
                 continue
 
         logging.info(f"Writing {ledger} data to file..")
-        # Append result to file
-        with open(file, 'a') as f:
+        # Append result to file (compressed files get a new compressed stream, so that they can be read incrementally)
+        with open_file(file, 'ab') as f:
             for row in rows:
-                f.write(json.dumps(dict(row), default=str) + "\n")
+                f.write((json.dumps(dict(row), default=str) + "\n").encode())
         logging.info(f'Done writing {ledger} data to file.\n')
 
 
 def get_last_block_collected(file):
     """
     Get the last block collected for a ledger. This is useful for knowing where to start collecting data from.
-    Assumes that the data is stored in a json lines file, ordered in increasing block number.
+    Assumes that the data is stored in a (possibly compressed) json lines file, ordered in increasing block number.
     :param file: the file that corresponds to the ledger to get the last block collected for
     :returns: the number of the last ledger block collected in the file
     """
     if not file.is_file():
         return None
-    with open(file) as f:
+    line = None
+    with open_file(file) as f:
         for line in f:
             pass
+    if line is None:
+        return None
     last_block = json.loads(line)
     return last_block['number']
 
@@ -89,10 +105,19 @@ if __name__ == '__main__':
         default=datetime.today().strftime('%Y-%m-%d'),
         help='The date until which to get data for (YYYY-MM-DD format). Defaults to today.'
     )
+    parser.add_argument(
+        '--compression',
+        type=str.lower,
+        default=None,
+        choices=list(COMPRESSION_EXTENSIONS.values()),
+        help='The compression format to write the raw data in. Defaults to no compression.'
+    )
 
     args = parser.parse_args()
     raw_data_dir = hlp.get_input_directories()[0]
     if not raw_data_dir.is_dir():
         raw_data_dir.mkdir()
-    from_block = {ledger: get_last_block_collected(file=raw_data_dir / f'{ledger}_raw_data.json') for ledger in args.ledgers}
-    collect_data(raw_data_dir=raw_data_dir, ledgers=args.ledgers, from_block=from_block, to_date=args.to_date)
+    from_block = {ledger: get_last_block_collected(file=get_raw_data_file(raw_data_dir, ledger, args.compression))
+                  for ledger in args.ledgers}
+    collect_data(raw_data_dir=raw_data_dir, ledgers=args.ledgers, from_block=from_block, to_date=args.to_date,
+                 compression=args.compression)
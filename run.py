@@ -1,22 +1,297 @@
+import heapq
+import itertools
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from consensus_decentralization.aggregate import aggregate
+from consensus_decentralization.instrumentation import StageRecorder, REPORT_FILENAME
 from consensus_decentralization.map import apply_mapping
 from consensus_decentralization.analyze import analyze
-from consensus_decentralization.parse import parse
+from consensus_decentralization.parse import parse, get_raw_data_checkpoint
 from consensus_decentralization.plot import plot
 import consensus_decentralization.helper as hlp
+import consensus_decentralization.stage_cache as cache
 
 logging.basicConfig(format='[%(asctime)s] %(message)s', datefmt='%Y/%m/%d %I:%M:%S %p', level=logging.INFO)
 
+MEMORY_PER_LEDGER = 2  # estimated peak memory (in GB) of parsing, mapping and aggregating the data of a single ledger
 
-def process_data(force_map, ledger_dir, ledger, output_dir):
+
+def get_new_blocks(blocks, ledger_dir, last_block_number):
+    """
+    Filters out the blocks that have already been mapped, e.g. blocks that were collected again and appended to the raw
+    data, or blocks of a new raw data file that overlaps with older ones
+    :param blocks: iterable of dictionaries (parsed block data)
+    :param ledger_dir: pathlib.PosixPath object of the output directory of the ledger, which contains the mapped data
+    :param last_block_number: int or None. The number of the last block that was stored in the raw data when they were
+        mapped; since raw data are collected in increasing block number, blocks with higher numbers cannot have been
+        mapped already
+    :returns: generator of dictionaries (parsed block data) that have not been mapped yet
+    """
+    mapped_numbers = None
+    for block in blocks:
+        block_number = int(block['number'])
+        if last_block_number is None or block_number <= last_block_number:
+            if mapped_numbers is None:
+                mapped_numbers = np.sort(hlp.read_mapped_project_columns(ledger_dir)['number'])
+            idx = np.searchsorted(mapped_numbers, block_number)
+            if idx < len(mapped_numbers) and mapped_numbers[idx] == block_number:
+                continue
+        yield block
+
+
+def get_initial_mapping_state():
+    """
+    :returns: dictionary with the state of a mapping before any blocks are mapped (see DefaultMapping.get_state)
+    """
+    return {'learned_addresses': dict(), 'last_timestamp': None}
+
+
+def parse_new_blocks(ledger, raw_data_dirs, checkpoint, missing_timeframes, appended_offsets, ledger_dir,
+                     mapped_timeframe, metadata, recorder):
+    """
+    Parses the blocks that need to be mapped, i.e. the blocks of the timeframes that are not covered by the mapped data
+    and the blocks that were appended to the raw data since the data were mapped
+    :param ledger: string that corresponds to the ledger whose data should be parsed
+    :param raw_data_dirs: list of pathlib.PosixPath objects of the directories with the raw data
+    :param checkpoint: dictionary with the byte offsets of the raw data files and the last block number (see
+        parse.get_raw_data_checkpoint)
+    :param missing_timeframes: list of tuples of (start_date, end_date), the timeframes to parse all the blocks of
+    :param appended_offsets: dictionary with the raw data files (keys) and the byte ranges (values) that were appended to
+        them since the data were mapped
+    :param ledger_dir: pathlib.PosixPath object of the output directory of the ledger
+    :param mapped_timeframe: tuple of (start_date, end_date), the timeframe of the mapped data, or None
+    :param metadata: dictionary with the metadata of the mapped data, or None
+    :param recorder: StageRecorder object that records the measurements of the parsing
+    :returns: generator of dictionaries (parsed block data) sorted by timestamp
+    """
+    parse_workers = hlp.get_parse_workers()
+    parsed_data = []
+    if missing_timeframes:
+        parsed_data.append(recorder.measure_iterable(parse(
+            ledger=ledger, input_dirs=raw_data_dirs, workers=parse_workers, timeframes=missing_timeframes,
+            offsets={filepath: (0, size) for filepath, size in checkpoint['raw_data_offsets'].items()}),
+            stage='parse', ledger=ledger))
+    if appended_offsets:
+        appended_data = parse(ledger=ledger, input_dirs=raw_data_dirs, workers=parse_workers,
+                              timeframes=[mapped_timeframe], offsets=appended_offsets)
+        parsed_data.append(recorder.measure_iterable(
+            get_new_blocks(appended_data, ledger_dir, metadata.get('last_block_number')), stage='parse', ledger=ledger))
+    return heapq.merge(*parsed_data, key=lambda block: block['timestamp'])
+
+
+def process_data(force_map, ledger_dir, ledger, output_dir, timeframe, recorder=None):
+    """
+    Parses and maps the raw data of a ledger for some timeframe. If mapped data for (part of) the timeframe already
+    exist, then only the missing part of the timeframe is parsed and mapped, along with any blocks that were appended
+    to the raw data since the data were mapped, and the results are merged with the existing mapped data. The part of
+    the raw data that has been mapped (byte offsets and last block number) is recorded in the metadata of the mapped
+    data, together with fingerprints of the mapping information and of the code that were used and the state of the
+    mapping (e.g. the addresses it learned), so that the new blocks are mapped exactly as in a single run over all the
+    blocks; if the mapping information or the code of the mapping stage change, the raw data are rewritten or some new
+    block precedes the mapped ones, all the blocks of the (covered) timeframe are mapped again. Whether (and why) the data were parsed and mapped is recorded in the stage manifest of the ledger
+    (see stage_cache).
+    :param force_map: bool. If True, then all the blocks of the timeframe are parsed and mapped, regardless of whether
+        mapped data already exist
+    :param ledger_dir: pathlib.PosixPath object of the output directory of the ledger
+    :param ledger: string that corresponds to the ledger whose data should be processed
+    :param output_dir: pathlib.PosixPath object of the general output directory
+    :param timeframe: tuple of (start_date, end_date) where each date is a datetime.date object
+    :param recorder: StageRecorder object that records the measurements of the parsing, or None
+    :returns: int, the number of blocks in the mapped data of the ledger, or None if no parsing / mapping took place
+    """
+    if recorder is None:
+        recorder = StageRecorder()
     clustering_flag = hlp.get_clustering_flag()
-    mapped_data_file = ledger_dir / hlp.get_mapped_data_filename(clustering_flag)
-    if force_map or not mapped_data_file.is_file():
-        raw_data_dirs = hlp.get_input_directories()
-        parsed_data = parse(ledger=ledger, input_dirs=raw_data_dirs)
-        return apply_mapping(ledger, parsed_data=parsed_data, output_dir=output_dir)
-    return None
+    mapped_data_filename = hlp.get_mapped_data_filename(clustering_flag)
+    mapped_data_file = ledger_dir / mapped_data_filename
+    stage_id = f'map:{mapped_data_filename}'
+    fingerprint = hlp.get_mapping_info_fingerprint(ledger)
+    code_fingerprint = cache.get_code_fingerprint('map')
+    stage_inputs = {'mapping_info': fingerprint, 'clustering': clustering_flag, 'code': code_fingerprint,
+                    'timeframe': [str(timeframe[0]), str(timeframe[1])]}
+    metadata = None
+    if force_map:
+        reason = 'forced by the force_map flag'
+    elif not mapped_data_file.is_file():
+        reason = 'no existing output'
+    else:
+        reason = None
+        metadata = hlp.read_mapped_data_metadata(ledger_dir, clustering_flag)
+
+    raw_data_dirs = hlp.get_input_directories()
+    try:
+        checkpoint = get_raw_data_checkpoint(ledger, raw_data_dirs)
+    except FileNotFoundError:
+        # the existing mapped data can still be used, as long as they cover the entire timeframe
+        if metadata is None or hlp.get_missing_timeframes(
+                timeframe, hlp.get_mapped_timeframe(ledger_dir, clustering_flag)):
+            raise
+        cache.record_stage(ledger_dir, stage_id, stage_inputs, reason=None)
+        return None
+    stage_inputs['raw_data'] = checkpoint
+
+    appended_offsets = None
+    if metadata is not None:
+        # mapped data from earlier versions of the tool may not have (some of) the fingerprints
+        recorded_fingerprints = [('mapping_info', 'mapping_info_fingerprint', fingerprint),
+                                 ('code', 'code_fingerprint', code_fingerprint)]
+        changed_inputs = [name for name, key, value in recorded_fingerprints if metadata.get(key, value) != value]
+        if changed_inputs:
+            reason = f'inputs changed: {", ".join(changed_inputs)}'
+        else:
+            appended_offsets = hlp.get_appended_offsets(metadata, checkpoint['raw_data_offsets'])
+            if appended_offsets is None:
+                reason = 'inputs changed: raw_data (rewritten)'
+    if appended_offsets is None:  # there are no (reusable) mapped data, so everything needs to be mapped from scratch
+        mapped_timeframe = None
+        appended_offsets = dict()
+    else:
+        mapped_timeframe = hlp.get_mapped_timeframe(ledger_dir, clustering_flag)
+    missing_timeframes = hlp.get_missing_timeframes(timeframe, mapped_timeframe)
+    if not missing_timeframes and not appended_offsets:
+        cache.record_stage(ledger_dir, stage_id, stage_inputs, reason=None)
+        return None
+    if reason is None:
+        reason = ' and '.join((['timeframe not covered by the mapped data'] if missing_timeframes else []) +
+                              (['inputs changed: raw_data (appended)'] if appended_offsets else []))
+
+    # the mapping of a block depends on the addresses that were learned from earlier blocks, so new blocks can only be
+    # mapped on top of the existing mapped data (continuing from the recorded state of the mapping) if they all come
+    # after the mapped blocks; otherwise, the whole covered timeframe is mapped again from scratch
+    remap_reason = None
+    if mapped_timeframe is not None:
+        if 'mapping_state' not in metadata:
+            remap_reason = 'there is no record of the state of the mapping'
+        elif timeframe[0] < mapped_timeframe[0]:
+            remap_reason = 'new blocks precede the mapped ones'
+    mapping_state = get_initial_mapping_state() if mapped_timeframe is None else metadata['mapping_state']
+    if remap_reason is None:
+        parsed_data = parse_new_blocks(ledger, raw_data_dirs, checkpoint, missing_timeframes, appended_offsets,
+                                       ledger_dir, mapped_timeframe, metadata, recorder)
+        if mapped_timeframe is not None:
+            first_block = next(parsed_data, None)  # the earliest new block, since the parsed data are sorted by time
+            if first_block is not None and mapping_state['last_timestamp'] is not None and \
+                    first_block['timestamp'] < mapping_state['last_timestamp']:
+                parsed_data.close()
+                remap_reason = 'new blocks precede the mapped ones'
+            elif first_block is not None:
+                parsed_data = itertools.chain([first_block], parsed_data)
+    if remap_reason is not None:
+        reason += f'; all blocks are mapped again, since {remap_reason}'
+        timeframe = (min(timeframe[0], mapped_timeframe[0]), max(timeframe[1], mapped_timeframe[1]))
+        mapped_timeframe, mapping_state = None, get_initial_mapping_state()
+        parsed_data = parse_new_blocks(ledger, raw_data_dirs, checkpoint, [timeframe], dict(), ledger_dir,
+                                       mapped_timeframe=None, metadata=None, recorder=recorder)
+    previously_mapped_data = None if mapped_timeframe is None else hlp.iter_mapped_project_data(ledger_dir)
+    num_mapped_blocks = apply_mapping(ledger, parsed_data=parsed_data, output_dir=output_dir,
+                                      previously_mapped_data=previously_mapped_data, mapping_state=mapping_state)
+    if mapped_timeframe is None and num_mapped_blocks == 0:
+        # no mapped data file is written if there are no blocks, so any existing (outdated) mapped data are removed
+        hlp.remove_mapped_project_data(ledger_dir, clustering_flag)
+
+    if mapped_data_file.is_file():
+        covered_timeframe = timeframe if mapped_timeframe is None else (
+            min(timeframe[0], mapped_timeframe[0]), max(timeframe[1], mapped_timeframe[1]))
+        metadata = {
+            'timeframe': {'start_date': str(covered_timeframe[0]), 'end_date': str(covered_timeframe[1])},
+            **checkpoint,
+            'mapping_info_fingerprint': fingerprint,
+            'code_fingerprint': code_fingerprint,
+            'mapping_state': mapping_state
+        }
+        hlp.write_mapped_data_metadata(ledger_dir, clustering_flag, metadata)
+    cache.record_stage(ledger_dir, stage_id, stage_inputs, reason)
+    return num_mapped_blocks
+
+
+def process_ledger(ledger, interim_dir, timeframe, parse_timeframe, estimation_window, frequency, force_map):
+    """
+    Parses, maps and aggregates the data of a single ledger
+    :param ledger: string, the name of the ledger
+    :param interim_dir: pathlib.PosixPath object of the directory where the output data will be saved
+    :param timeframe: tuple of (start_date, end_date) where each date is a datetime.date object, the timeframe to
+        aggregate the data for
+    :param parse_timeframe: tuple of (start_date, end_date), the (possibly wider) timeframe to parse and map the data for
+    :param estimation_window: int or None, the number of days to consider for the estimation of the power of an entity
+    :param frequency: int or None, the number of days between each data point considered in the analysis
+    :param force_map: boolean, whether to map and aggregate the data even if the relevant output files already exist
+    :returns: list of dictionaries, the measurements of the stages (see StageRecorder)
+    :raises FileNotFoundError: if there are no raw data for the ledger (and no mapped data that can be used instead)
+    """
+    ledger_dir = interim_dir / ledger
+    ledger_dir.mkdir(parents=True, exist_ok=True)  # create ledger output directory if it doesn't already exist
+    recorder = StageRecorder(trace_memory=hlp.get_trace_memory_flag())
+
+    with recorder.measure('map', ledger) as record:
+        num_mapped_blocks = process_data(force_map, ledger_dir, ledger, interim_dir, parse_timeframe, recorder)
+        record['records'] = num_mapped_blocks or 0
+
+    with recorder.measure('aggregate', ledger) as record:
+        timeframe_chunks = aggregate(
+            ledger,
+            interim_dir,
+            timeframe,
+            estimation_window,
+            frequency,
+            force_map,
+            mapped_data=[] if num_mapped_blocks == 0 else None  # no mapped data file is written if there are no blocks
+        )
+        record['records'] = len(timeframe_chunks) if timeframe_chunks is not None else 0
+    return recorder.records
+
+
+def get_num_ledger_workers(num_ledgers):
+    """
+    Determines how many ledgers to process concurrently, based on the configured number of workers, the number of
+    available cores and the memory budget (assuming that each ledger needs up to MEMORY_PER_LEDGER GB)
+    :param num_ledgers: int, the number of ledgers to process
+    :returns: int, the number of worker processes (at least 1)
+    """
+    workers = min(hlp.get_ledger_workers(), os.cpu_count() or 1, num_ledgers)
+    memory_budget = hlp.get_memory_budget()
+    if memory_budget is not None:
+        workers = min(workers, int(memory_budget // MEMORY_PER_LEDGER))
+    return max(workers, 1)
+
+
+def process_ledgers(ledgers, workers, **kwargs):
+    """
+    Parses, maps and aggregates the data of multiple ledgers (see process_ledger). If more than one worker is used, the
+    ledgers are processed concurrently by a pool of worker processes, since their inputs and outputs are disjoint.
+    Ledgers without raw data are skipped (without affecting the processing of the other ledgers).
+    :param ledgers: list of strings that correspond to the ledgers whose data should be processed
+    :param workers: int, the number of worker processes (1 means that the ledgers are processed sequentially)
+    :param kwargs: the rest of the arguments of process_ledger
+    :returns: a tuple of length 2 where the first item is a list with the ledgers that were processed successfully (in
+    the given order) and the second item is a list with the measurements of their stages (see StageRecorder)
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_ledger, ledger, **kwargs) for ledger in ledgers]
+            outcomes = []
+            for future in futures:
+                exception = future.exception()
+                outcomes.append((None if exception else future.result(), exception))
+    else:
+        outcomes = []
+        for ledger in ledgers:
+            try:
+                outcomes.append((process_ledger(ledger, **kwargs), None))
+            except FileNotFoundError as e:
+                outcomes.append((None, e))
+
+    processed_ledgers, stage_records = [], []
+    for ledger, (ledger_records, exception) in zip(ledgers, outcomes):
+        if exception is None:
+            processed_ledgers.append(ledger)
+            stage_records.extend(ledger_records)
+        elif isinstance(exception, FileNotFoundError):
+            logging.error(repr(exception))
+        else:
+            raise exception
+    return processed_ledgers, stage_records
 
 
 def main(ledgers, timeframe, estimation_window, frequency, population_windows, interim_dir=hlp.INTERIM_DIR,
@@ -32,56 +307,58 @@ def main(ledgers, timeframe, estimation_window, frequency, population_windows, i
         of days between each data point considered in the analysis). If None, only one data point will be considered,
         spanning the entire timeframe (i.e. it needs to be combined with None estimation_window).
     :param interim_dir: pathlib.PosixPath object of the directory where the output data will be saved
+    :param results_dir: pathlib.PosixPath object of the directory where the results (metrics, figures and the
+        instrumentation report with the measurements of each stage) will be saved
     """
     logging.info(f"The ledgers that will be analyzed are: {','.join(ledgers)}")
 
     force_map = hlp.get_force_map_flag()
+    parse_timeframe = hlp.get_parse_timeframe(timeframe, estimation_window, population_windows)
+    recorder = StageRecorder(trace_memory=hlp.get_trace_memory_flag())
+    run_info = {'ledgers': list(ledgers), 'timeframe': [str(timeframe[0]), str(timeframe[1])],
+                'estimation_window': estimation_window, 'frequency': frequency,
+                'population_windows': population_windows}
 
-    for ledger in list(ledgers):
-        ledger_dir = interim_dir / ledger
-        ledger_dir.mkdir(parents=True, exist_ok=True)  # create ledger output directory if it doesn't already exist
-
-        try:
-            mapped_data = process_data(force_map, ledger_dir, ledger, interim_dir)
-        except FileNotFoundError as e:
-            logging.error(repr(e))
-            ledgers.remove(ledger)
-            continue
-
-        aggregate(
-            ledger,
-            interim_dir,
-            timeframe,
-            estimation_window,
-            frequency,
-            force_map,
-            mapped_data=mapped_data
-        )
+    ledgers, stage_records = process_ledgers(
+        ledgers, workers=get_num_ledger_workers(len(ledgers)), interim_dir=interim_dir, timeframe=timeframe,
+        parse_timeframe=parse_timeframe, estimation_window=estimation_window, frequency=frequency, force_map=force_map)
+    recorder.records.extend(stage_records)
 
     if ledgers:
         aggregated_data_filename = hlp.get_blocks_per_entity_filename(timeframe, estimation_window, frequency)
         metrics_dir = results_dir / 'metrics'
         metrics_dir.mkdir(parents=True, exist_ok=True)
 
-        used_metrics = analyze(
-            projects=ledgers,
-            aggregated_data_filename=aggregated_data_filename,
-            population_windows=population_windows,
-            input_dir=interim_dir,
-            output_dir=metrics_dir
-        )
+        with recorder.measure('analyze') as record:
+            used_metrics = analyze(
+                projects=ledgers,
+                aggregated_data_filename=aggregated_data_filename,
+                population_windows=population_windows,
+                input_dir=interim_dir,
+                output_dir=metrics_dir,
+                workers=hlp.get_analyze_workers()
+            )
+            with open(metrics_dir / 'output.csv') as f:
+                record['records'] = sum(1 for _ in f) - 1  # the (ledger, date) rows with results
 
         if hlp.get_plot_flag():
             figures_dir = results_dir / 'figures'
             figures_dir.mkdir(parents=True, exist_ok=True)
-            plot(
-                ledgers=ledgers,
-                metrics=used_metrics,
-                aggregated_data_filename=aggregated_data_filename,
-                animated=hlp.get_plot_config_data()['animated'],
-                metrics_dir=metrics_dir,
-                figures_dir=figures_dir
-            )
+            with recorder.measure('plot') as record:
+                plot(
+                    ledgers=ledgers,
+                    metrics=used_metrics,
+                    aggregated_data_filename=aggregated_data_filename,
+                    animated=hlp.get_plot_config_data()['animated'],
+                    metrics_dir=metrics_dir,
+                    figures_dir=figures_dir
+                )
+                record['records'] = len(used_metrics)
+
+    results_dir.mkdir(parents=True, exist_ok=True)
+    recorder.write_report(results_dir / REPORT_FILENAME, run_info)
+    if hlp.get_print_summary_flag():
+        logging.info(f'Instrumentation summary:\n{recorder.get_summary_table()}')
 
 
 if __name__ == '__main__':
@@ -1,14 +1,18 @@
 import datetime
 import json
 import shutil
+import numpy as np
 import pytest
-from consensus_decentralization.helper import INTERIM_DIR
+from consensus_decentralization.helper import INTERIM_DIR, write_mapped_project_data, get_mapped_columns_dir_name, \
+    get_block_count_cube_dir_name
 from consensus_decentralization.aggregate import aggregate, Aggregator, divide_timeframe
-from consensus_decentralization.helper import get_clustering_flag
+from consensus_decentralization.helper import get_clustering_flag, config, get_blocks_per_entity_from_file
+from consensus_decentralization.mapped_columns import read_mapped_columns
+from consensus_decentralization.block_count_cube import BlockCountCube
 
 
 @pytest.fixture
-def setup_and_cleanup():
+def setup_and_cleanup(monkeypatch):
     """
     This function can be used to set up the right conditions for a test and also clean up after the test is finished.
     The part before the yield command is run before the test (setup) and the part after the yield command is run
@@ -18,6 +22,8 @@ def setup_and_cleanup():
     test_io_dir = INTERIM_DIR / "test_output"
     # Mock return value of get_clustering_flag
     get_clustering_flag.return_value = True
+    # Export the aggregated data also as dense csv files, which are checked by the tests
+    monkeypatch.setitem(config, 'aggregation_output', {'compression': None, 'dense_export': True})
     yield test_io_dir
     # Clean up
     shutil.rmtree(test_io_dir)
@@ -140,6 +146,31 @@ def test_aggregate(setup_and_cleanup, mock_sample_bitcoin_mapped_data):
     assert output_file.is_file()
 
 
+def test_aggregate_sparse_output(setup_and_cleanup, mock_sample_bitcoin_mapped_data, monkeypatch):
+    test_io_dir = setup_and_cleanup
+    aggregated_data_dir = test_io_dir / 'sample_bitcoin/blocks_per_entity_clustered'
+    timeframe = (datetime.date(2018, 2, 1), datetime.date(2018, 3, 31))
+    aggregate(project='sample_bitcoin', output_dir=test_io_dir, timeframe=timeframe, estimation_window=30,
+              frequency=30, force_aggregate=True)
+    dense_file = aggregated_data_dir / '30_day_window_from_2018-02-01_to_2018-03-31_sampled_every_30_days.csv'
+    expected_data = get_blocks_per_entity_from_file(dense_file, population_windows=1)
+    for filepath in aggregated_data_dir.iterdir():
+        filepath.unlink()
+
+    # by default, only the (sparse) aggregated data are written
+    monkeypatch.setitem(config, 'aggregation_output', {'compression': 'gzip', 'dense_export': False})
+    timeframes_chunks = aggregate(project='sample_bitcoin', output_dir=test_io_dir, timeframe=timeframe,
+                                  estimation_window=30, frequency=30, force_aggregate=False)
+    assert len(timeframes_chunks) == 1
+    assert not dense_file.is_file()
+    assert [filepath.name for filepath in aggregated_data_dir.iterdir()] == [
+        '30_day_window_from_2018-02-01_to_2018-03-31_sampled_every_30_days.sparse.csv.gz']
+    assert get_blocks_per_entity_from_file(dense_file, population_windows=1) == expected_data
+    # the aggregation is not repeated if the sparse file exists
+    assert aggregate(project='sample_bitcoin', output_dir=test_io_dir, timeframe=timeframe, estimation_window=30,
+                     frequency=30, force_aggregate=False) is None
+
+
 def test_aggregate_method(setup_and_cleanup, mock_sample_bitcoin_mapped_data):
     aggregator = Aggregator(project='sample_bitcoin', io_dir=setup_and_cleanup / 'sample_bitcoin')
 
@@ -156,6 +187,102 @@ def test_aggregate_method(setup_and_cleanup, mock_sample_bitcoin_mapped_data):
     assert sum(blocks_per_entity.values()) == 0
 
 
+def test_aggregate_mapped_columns(setup_and_cleanup, mock_sample_bitcoin_mapped_data):
+    project_dir = setup_and_cleanup / 'sample_bitcoin'
+    mapped_data_file = project_dir / 'mapped_data_clustered.json'
+    columns_dir = project_dir / get_mapped_columns_dir_name(True)
+    # mapped data of older versions have no columns, so the aggregator builds them from the mapped data file
+    assert read_mapped_columns(columns_dir, mapped_data_file) is None
+    legacy_aggregator = Aggregator(project='sample_bitcoin', io_dir=project_dir)
+
+    write_mapped_project_data(project_dir, True, mock_sample_bitcoin_mapped_data)
+    columns = read_mapped_columns(columns_dir, mapped_data_file)
+    assert isinstance(columns['day'], np.memmap)
+    assert columns['number'].tolist() == [int(block['number']) for block in mock_sample_bitcoin_mapped_data]
+    assert [datetime.date.fromordinal(day).isoformat() for day in columns['day']] == [
+        block['timestamp'][:10] for block in mock_sample_bitcoin_mapped_data]
+    assert [columns['creators'][i] for i in columns['creator']] == [
+        block['creator'] for block in mock_sample_bitcoin_mapped_data]
+    assert [columns['mapping_methods'][i] for i in columns['mapping_method']] == [
+        block['mapping_method'] for block in mock_sample_bitcoin_mapped_data]
+
+    aggregator = Aggregator(project='sample_bitcoin', io_dir=project_dir)
+    assert aggregator.monthly_data_breaking_points == legacy_aggregator.monthly_data_breaking_points
+    for timeframe in [(datetime.date(2018, 2, 1), datetime.date(2018, 2, 28)),
+                      (datetime.date(2018, 2, 10), datetime.date(2020, 9, 19)),
+                      (datetime.date(2010, 1, 1), datetime.date(2023, 12, 31))]:
+        assert list(aggregator.aggregate(*timeframe).items()) == list(legacy_aggregator.aggregate(*timeframe).items())
+
+    # the columns are ignored if the mapped data file changes
+    mapped_data_file.write_text(mapped_data_file.read_text() + '\n')
+    assert read_mapped_columns(columns_dir, mapped_data_file) is None
+
+
+def test_aggregate_time_chunks(setup_and_cleanup, mock_sample_ethereum_mapped_data):
+    # blocks sorted by date, with a few entities (some of which produce blocks only occasionally)
+    start_date = datetime.date(2021, 1, 1)
+    mapped_data = [
+        {'number': str(i), 'timestamp': f'{start_date + datetime.timedelta(days=i // 5)} 00:00:00 UTC',
+         'creator': f'entity_{(i * 7) % 11 if i % 13 else i % 4}'}
+        for i in range(1000)
+    ]
+    aggregator = Aggregator(project='sample_bitcoin', io_dir=setup_and_cleanup / 'sample_bitcoin',
+                            mapped_data=mapped_data)
+    timeframe = (datetime.date(2020, 12, 1), datetime.date(2021, 8, 31))
+    for estimation_window, frequency in [(30, 1), (7, 3), (7, 30), (30, 30), (None, None)]:
+        time_chunks = divide_timeframe(timeframe=timeframe, estimation_window=estimation_window, frequency=frequency)
+        blocks_per_entity = [aggregator.aggregate(chunk_start, chunk_end) for chunk_start, chunk_end in time_chunks]
+        # the (in-memory) block count cube produces the same dictionaries, with the entities in the same order (which
+        # determines the order of the rows of the output file)
+        assert [list(chunk.items()) for chunk in aggregator.aggregate_time_chunks(time_chunks)] == \
+            [list(chunk.items()) for chunk in blocks_per_entity]
+    assert not (setup_and_cleanup / 'sample_bitcoin' / get_block_count_cube_dir_name(True)).exists()
+
+    # blocks that are not sorted by date are aggregated separately for each time chunk
+    aggregator = Aggregator(project='sample_ethereum', io_dir=setup_and_cleanup / 'sample_ethereum')
+    time_chunks = [(datetime.date(2020, 11, 1), datetime.date(2023, 1, 31)),
+                   (datetime.date(2020, 11, 3), datetime.date(2023, 1, 11))]
+    assert aggregator.aggregate_time_chunks(time_chunks) == [
+        {'MEV Builder: 0x3B...436': 1, '0x45133a7e1cc7e18555ae8a4ee632a8a61de90df6': 1, 'TEST2': 5, 'TEST': 3}] * 2
+
+
+def test_block_count_cube(setup_and_cleanup):
+    project_dir = setup_and_cleanup / 'sample_bitcoin'
+    project_dir.mkdir(parents=True, exist_ok=True)
+    start_date = datetime.date(2021, 1, 1)
+    mapped_data = [
+        {'number': str(i), 'timestamp': f'{start_date + datetime.timedelta(days=i // 5)} 00:00:00 UTC',
+         'creator': f'entity_{(i * 7) % 11 if i % 13 else i % 4}', 'mapping_method': 'known_identifiers'}
+        for i in range(1000)
+    ]
+    write_mapped_project_data(project_dir, True, mapped_data)
+    cube_dir = project_dir / get_block_count_cube_dir_name(True)
+    mapped_data_file = project_dir / 'mapped_data_clustered.json'
+    assert BlockCountCube.load(cube_dir, mapped_data_file) is None
+
+    aggregator = Aggregator(project='sample_bitcoin', io_dir=project_dir)
+    timeframe = (datetime.date(2020, 12, 1), datetime.date(2021, 8, 31))
+    for estimation_window, frequency in [(30, 1), (7, 3), (7, 30), (30, 30), (None, None)]:
+        time_chunks = divide_timeframe(timeframe=timeframe, estimation_window=estimation_window, frequency=frequency)
+        assert aggregator.aggregate_time_chunks(time_chunks) == [aggregator.aggregate(*chunk) for chunk in time_chunks]
+    # the cube can answer time chunks in any order
+    time_chunks = [(datetime.date(2021, 3, 1), datetime.date(2021, 3, 31)), (datetime.date(2021, 1, 1), start_date)]
+    assert aggregator.aggregate_time_chunks(time_chunks) == [aggregator.aggregate(*chunk) for chunk in time_chunks]
+
+    # the cube is saved and reused, until the mapped data change
+    block_count_cube = BlockCountCube.load(cube_dir, mapped_data_file)
+    assert block_count_cube.blocks_sorted
+    assert block_count_cube.cumulative_counts[-1] == len(mapped_data)
+    write_mapped_project_data(project_dir, True, mapped_data[:500])
+    assert BlockCountCube.load(cube_dir, mapped_data_file) is None
+    aggregator = Aggregator(project='sample_bitcoin', io_dir=project_dir)
+    assert sum(aggregator.aggregate_time_chunks([timeframe])[0].values()) == 500
+
+    # a cube can also be built when there are no blocks
+    empty_cube = BlockCountCube.from_columns(np.array([], dtype=np.int32), np.array([], dtype=np.int32), [])
+    assert empty_cube.aggregate_time_chunks([timeframe]) == [{}]
+
+
 def test_bitcoin_aggregation(setup_and_cleanup, mock_sample_bitcoin_mapped_data):
     test_io_dir = setup_and_cleanup
 
@@ -1,3 +1,4 @@
+import random
 import shutil
 import pytest
 from consensus_decentralization.helper import INTERIM_DIR, get_clustering_flag
@@ -118,3 +119,42 @@ def test_analyze(setup_and_cleanup):
             assert len(lines) == 2
             assert lines[0] == 'timeframe,sample_bitcoin\n'
             assert lines[1] == '2010,\n'
+
+
+def test_analyze_in_parallel(setup_and_cleanup):
+    """
+    Ensure that analyzing with multiple worker processes produces the same output files as analyzing sequentially
+    """
+    test_output_dir = setup_and_cleanup
+    projects = ['sample_bitcoin', 'sample_cardano']
+    filename = 'day_from_2018-01-01_to_2018-01-30.csv'
+    rng = random.Random(42)
+    for project in projects:
+        aggregated_data_path = test_output_dir / project / 'blocks_per_entity_clustered'
+        aggregated_data_path.mkdir(parents=True, exist_ok=True)
+        dates = [f'2018-01-{day:02d}' for day in range(1, 31)]
+        rows = [f'Entity \\ Date,{",".join(dates)}\n']
+        for entity in range(15):
+            rows.append(f'entity_{entity},' + ','.join(str(rng.choice([0, 0, 1, 2, 7])) for _ in dates) + '\n')
+        with open(aggregated_data_path / filename, 'w') as f:
+            f.writelines(rows)
+
+    for workers in [1, 3]:
+        output_dir = test_output_dir / f'metrics_{workers}'
+        output_dir.mkdir(parents=True, exist_ok=True)
+        analyze(
+            projects=projects,
+            aggregated_data_filename=filename,
+            input_dir=test_output_dir,
+            output_dir=output_dir,
+            population_windows=1,
+            workers=workers
+        )
+
+    output_files = sorted(path.name for path in (test_output_dir / 'metrics_1').iterdir())
+    assert 'output.csv' in output_files
+    assert output_files == sorted(path.name for path in (test_output_dir / 'metrics_3').iterdir())
+    for output_file in output_files:
+        with open(test_output_dir / 'metrics_1' / output_file) as f1, \
+                open(test_output_dir / 'metrics_3' / output_file) as f2:
+            assert f1.read() == f2.read()
@@ -1,15 +1,19 @@
 import datetime
+import json
 import os
 import pathlib
 import shutil
-from run import main
+from run import main, process_data, process_ledger, process_ledgers
+from consensus_decentralization.instrumentation import REPORT_FILENAME
 from consensus_decentralization.parse import ledger_parser
 from consensus_decentralization.parsers.default_parser import DefaultParser
 from consensus_decentralization.parsers.dummy_parser import DummyParser
 from consensus_decentralization.map import ledger_mapping
 from consensus_decentralization.mappings.default_mapping import DefaultMapping
 from consensus_decentralization.mappings.cardano_mapping import CardanoMapping
-from consensus_decentralization.helper import INTERIM_DIR, config
+from consensus_decentralization.helper import INTERIM_DIR, config, get_mapped_timeframe, read_mapped_project_data
+import consensus_decentralization.helper as hlp
+import consensus_decentralization.stage_cache as cache
 import pytest
 
 
@@ -88,6 +92,13 @@ def test_end_to_end(setup_and_cleanup):
         population_windows=0
     )
 
+    with open(test_output_dir / REPORT_FILENAME) as f:
+        report = json.load(f)
+    assert report['run']['ledgers'] == ['sample_bitcoin', 'sample_cardano']
+    assert [(record['ledger'], record['stage']) for record in report['stages']] == [
+        ('sample_bitcoin', 'parse'), ('sample_bitcoin', 'map'), ('sample_bitcoin', 'aggregate'),
+        ('sample_cardano', 'parse'), ('sample_cardano', 'map'), ('sample_cardano', 'aggregate'), (None, 'analyze')]
+
     expected_entropy = [
         'timeframe,sample_bitcoin,sample_cardano\n',
         '2010-07-02,,\n'
@@ -191,3 +202,261 @@ def test_end_to_end(setup_and_cleanup):
         lines = f.readlines()
         for idx, line in enumerate(lines):
             assert line == expected_nc[idx]
+
+
+def test_process_data_extends_mapped_timeframe(setup_and_cleanup):
+    test_output_dir, _ = setup_and_cleanup
+    ledger_dir = test_output_dir / 'sample_bitcoin'
+    ledger_dir.mkdir(parents=True, exist_ok=True)
+
+    timeframe = (datetime.date(2018, 2, 10), datetime.date(2018, 2, 28))
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == 5
+    mapped_data = read_mapped_project_data(ledger_dir)
+    assert [block['number'] for block in mapped_data] == ['509373', '509432', '510199', '510888', '511342']
+    assert get_mapped_timeframe(ledger_dir, clustering_flag=True) == timeframe
+
+    # the timeframe is already covered by the mapped data, so nothing is parsed or mapped
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) is None
+
+    wider_timeframe = (datetime.date(2018, 2, 1), datetime.date(2018, 3, 31))
+    num_blocks = process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, wider_timeframe)
+    assert get_mapped_timeframe(ledger_dir, clustering_flag=True) == wider_timeframe
+    mapped_data = read_mapped_project_data(ledger_dir)
+    assert len(mapped_data) == num_blocks
+
+    assert process_data(True, ledger_dir, 'sample_bitcoin', test_output_dir, wider_timeframe) == num_blocks
+    assert read_mapped_project_data(ledger_dir) == mapped_data
+
+
+def test_process_data_maps_appended_blocks(setup_and_cleanup, monkeypatch):
+    test_output_dir, _ = setup_and_cleanup
+    ledger_dir = test_output_dir / 'sample_bitcoin'
+    ledger_dir.mkdir(parents=True, exist_ok=True)
+
+    # raw data are collected (and appended to the raw data file) in increasing block number
+    with open(hlp.get_input_directories()[0] / 'sample_bitcoin_raw_data.json') as f:
+        lines = sorted(f.readlines(), key=lambda line: int(json.loads(line)['number']))
+    raw_data_dir = test_output_dir / 'raw_data'
+    raw_data_dir.mkdir(parents=True, exist_ok=True)
+    raw_data_file = raw_data_dir / 'sample_bitcoin_raw_data.json'
+    monkeypatch.setattr(hlp, 'get_input_directories', lambda: [raw_data_dir])
+
+    timeframe = (datetime.date(2018, 1, 1), datetime.date(2021, 12, 31))
+    with open(raw_data_file, 'w') as f:
+        f.writelines(lines[:8])
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == 8
+    metadata = hlp.read_mapped_data_metadata(ledger_dir, clustering_flag=True)
+    assert metadata['raw_data_offsets'] == {str(raw_data_file): raw_data_file.stat().st_size}
+    assert metadata['last_block_number'] == 510888
+
+    # only the appended blocks are parsed and mapped, and the result is the same as mapping everything from scratch
+    with open(raw_data_file, 'a') as f:
+        f.writelines(lines[8:])
+    num_blocks = process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe)
+    mapped_data = read_mapped_project_data(ledger_dir)
+    assert len(mapped_data) == num_blocks
+    assert process_data(True, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == num_blocks
+    assert read_mapped_project_data(ledger_dir) == mapped_data
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) is None
+
+    # blocks that were already collected (and appended again) are not mapped twice
+    with open(raw_data_file, 'a') as f:
+        f.writelines(lines[-1:])
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == num_blocks
+    assert read_mapped_project_data(ledger_dir) == mapped_data
+
+    # a change in the mapping information means that all blocks (without duplicates) need to be mapped again
+    monkeypatch.setattr(hlp, 'get_mapping_info_fingerprint', lambda project_name: 'updated')
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == 13
+    assert hlp.read_mapped_data_metadata(ledger_dir, clustering_flag=True)['mapping_info_fingerprint'] == 'updated'
+
+
+def get_raw_block(number, timestamp, identifier=None):
+    """
+    Creates a raw block with the reward addresses of the first sample block (which are not known addresses)
+    :param number: int, the number of the block
+    :param timestamp: string, the timestamp of the block
+    :param identifier: string, the (known) identifier of the block, or None for a block without identifiers
+    :returns: string, the raw block as a line of a raw data file
+    """
+    with open(hlp.get_input_directories()[0] / 'sample_bitcoin_raw_data.json') as f:
+        block = json.loads(f.readline())
+    block.update(number=str(number), timestamp=timestamp,
+                 identifiers=identifier.encode().hex() if identifier is not None else '00')
+    return json.dumps(block) + '\n'
+
+
+def write_learned_address_raw_data(raw_data_dir):
+    """
+    Writes raw data with two blocks that have the same reward addresses: the first one (in February 2018) is mapped
+    through a known identifier, so its addresses are learned, while the second one (in March 2018) has no identifier,
+    so it can only be mapped through the learned addresses
+    """
+    raw_data_dir.mkdir(parents=True, exist_ok=True)
+    with open(raw_data_dir / 'sample_bitcoin_raw_data.json', 'w') as f:
+        f.write(get_raw_block(1, '2018-02-05 04:54:34 UTC', '/mined by gbminers/') +
+                get_raw_block(2, '2018-03-05 04:54:34 UTC'))
+
+
+@pytest.mark.parametrize('first_timeframe', [
+    (datetime.date(2018, 2, 1), datetime.date(2018, 2, 28)),  # the timeframe is extended after the mapped data
+    (datetime.date(2018, 3, 1), datetime.date(2018, 3, 31))  # the timeframe is extended before the mapped data
+])
+def test_process_data_keeps_learned_addresses(setup_and_cleanup, monkeypatch, first_timeframe):
+    test_output_dir, _ = setup_and_cleanup
+    ledger_dir = test_output_dir / 'sample_bitcoin'
+    ledger_dir.mkdir(parents=True, exist_ok=True)
+    raw_data_dir = test_output_dir / 'raw_data'
+    write_learned_address_raw_data(raw_data_dir)
+    monkeypatch.setattr(hlp, 'get_input_directories', lambda: [raw_data_dir])
+
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, first_timeframe) == 1
+    timeframe = (datetime.date(2018, 2, 1), datetime.date(2018, 3, 31))
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == 2
+    mapped_data = read_mapped_project_data(ledger_dir)
+    assert [(block['creator'], block['mapping_method']) for block in mapped_data] == [
+        ('GBMiners', 'known_identifiers'), ('GBMiners', 'known_addresses')]
+
+    # the result is the same as mapping all the blocks at once
+    assert process_data(True, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == 2
+    assert read_mapped_project_data(ledger_dir) == mapped_data
+
+
+def test_process_data_maps_appended_blocks_like_a_full_run(setup_and_cleanup, monkeypatch):
+    test_output_dir, _ = setup_and_cleanup
+    ledger_dir = test_output_dir / 'sample_bitcoin'
+    ledger_dir.mkdir(parents=True, exist_ok=True)
+    raw_data_dir = test_output_dir / 'raw_data'
+    raw_data_dir.mkdir(parents=True, exist_ok=True)
+    raw_data_file = raw_data_dir / 'sample_bitcoin_raw_data.json'
+    # the addresses of the first block are associated with another pool by the second one
+    raw_blocks = [get_raw_block(1, '2018-02-05 04:54:34 UTC', '/mined by gbminers/'),
+                  get_raw_block(2, '2018-03-05 04:54:34 UTC', '/btcpool/'),
+                  get_raw_block(3, '2018-04-05 04:54:34 UTC', '/mined by gbminers/'),
+                  get_raw_block(4, '2018-04-06 04:54:34 UTC'),
+                  get_raw_block(5, '2018-02-06 04:54:34 UTC')]
+    monkeypatch.setattr(hlp, 'get_input_directories', lambda: [raw_data_dir])
+    timeframe = (datetime.date(2018, 2, 1), datetime.date(2018, 4, 30))
+    multi_pool_files = ['multi_pool_addresses.csv', 'multi_pool_blocks.csv']
+
+    def map_from_scratch():
+        shutil.rmtree(ledger_dir)
+        ledger_dir.mkdir()
+        assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) is not None
+        return read_mapped_project_data(ledger_dir), {filename: (ledger_dir / filename).read_text()
+                                                      for filename in multi_pool_files
+                                                      if (ledger_dir / filename).is_file()}
+
+    with open(raw_data_file, 'w') as f:
+        f.writelines(raw_blocks[:2])
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == 2
+    assert (ledger_dir / 'multi_pool_addresses.csv').is_file()
+
+    # the appended blocks are mapped on their own, through (and adding to) what was learned from the mapped blocks
+    with open(raw_data_file, 'a') as f:
+        f.writelines(raw_blocks[2:4])
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == 4
+    assert 'all blocks are mapped again' not in cache.read_manifest(ledger_dir)['map:mapped_data_clustered.json'][
+        'reason']
+    mapped_data = read_mapped_project_data(ledger_dir)
+    assert [(block['creator'], block['mapping_method']) for block in mapped_data[2:]] == [
+        ('GBMiners', 'known_identifiers'), ('GBMiners', 'known_addresses')]
+    multi_pool_data = {filename: (ledger_dir / filename).read_text() for filename in multi_pool_files
+                       if (ledger_dir / filename).is_file()}
+    assert len(multi_pool_data['multi_pool_addresses.csv'].splitlines()) > 3
+    assert map_from_scratch() == (mapped_data, multi_pool_data)
+
+    # an appended block that precedes the last mapped block means that all blocks need to be mapped again
+    with open(raw_data_file, 'a') as f:
+        f.writelines(raw_blocks[4:])
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == 5
+    assert 'all blocks are mapped again' in cache.read_manifest(ledger_dir)['map:mapped_data_clustered.json']['reason']
+    mapped_data = read_mapped_project_data(ledger_dir)
+    assert mapped_data[1]['creator'] == 'GBMiners'
+    multi_pool_data = {filename: (ledger_dir / filename).read_text() for filename in multi_pool_files
+                       if (ledger_dir / filename).is_file()}
+    assert map_from_scratch() == (mapped_data, multi_pool_data)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_process_ledgers(setup_and_cleanup, workers):
+    test_output_dir, _ = setup_and_cleanup
+    ledger_mapping['sample_missing'] = DefaultMapping
+    ledger_parser['sample_missing'] = DefaultParser  # there are no raw data for this ledger
+
+    timeframe = (datetime.date(2018, 2, 1), datetime.date(2018, 3, 31))
+    processed_ledgers, stage_records = process_ledgers(
+        ['sample_bitcoin', 'sample_missing', 'sample_cardano'], workers=workers, interim_dir=test_output_dir,
+        timeframe=timeframe, parse_timeframe=timeframe, estimation_window=30, frequency=30, force_map=True)
+    assert processed_ledgers == ['sample_bitcoin', 'sample_cardano']
+    assert [(record['ledger'], record['stage']) for record in stage_records] == [
+        ('sample_bitcoin', 'parse'), ('sample_bitcoin', 'map'), ('sample_bitcoin', 'aggregate'),
+        ('sample_cardano', 'parse'), ('sample_cardano', 'map'), ('sample_cardano', 'aggregate')]
+    aggregated_data_filename = hlp.get_blocks_per_entity_filename(timeframe, 30, 30)
+    for ledger in processed_ledgers:
+        dates, _ = hlp.get_blocks_per_entity_from_file(
+            test_output_dir / ledger / 'blocks_per_entity_clustered' / aggregated_data_filename)
+        assert dates[0] == '2018-02-15'
+    assert not (test_output_dir / 'sample_missing' / 'blocks_per_entity_clustered').exists()
+    del ledger_mapping['sample_missing']
+    del ledger_parser['sample_missing']
+
+
+def test_process_ledger_reuses_stage_outputs(setup_and_cleanup, monkeypatch):
+    test_output_dir, _ = setup_and_cleanup
+    ledger_dir = test_output_dir / 'sample_bitcoin'
+    timeframe = (datetime.date(2018, 2, 1), datetime.date(2018, 3, 31))
+    aggregated_data_filename = hlp.get_blocks_per_entity_filename(timeframe, 30, 30)
+    map_stage = 'map:mapped_data_clustered.json'
+    aggregate_stage = f'aggregate:blocks_per_entity_clustered/{aggregated_data_filename}'
+
+    def run_stages():
+        process_ledger('sample_bitcoin', interim_dir=test_output_dir, timeframe=timeframe, parse_timeframe=timeframe,
+                       estimation_window=30, frequency=30, force_map=False)
+        manifest = cache.read_manifest(ledger_dir)
+        return (manifest[map_stage]['ran'], manifest[map_stage]['reason'], manifest[aggregate_stage]['ran'],
+                manifest[aggregate_stage]['reason'])
+
+    assert run_stages() == (True, 'no existing output', True, 'no existing output')
+    assert run_stages() == (False, 'inputs unchanged', False, 'inputs unchanged')
+
+    # a change in the mapping information means that the data are mapped and aggregated again
+    monkeypatch.setattr(hlp, 'get_mapping_info_fingerprint', lambda project_name: 'updated')
+    assert run_stages() == (True, 'inputs changed: mapping_info', True, 'inputs changed: mapped_data')
+    assert run_stages() == (False, 'inputs unchanged', False, 'inputs unchanged')
+
+    # a change in the code of the aggregation stage means that only the aggregation runs again
+    get_code_fingerprint = cache.get_code_fingerprint
+    monkeypatch.setattr(cache, 'get_code_fingerprint',
+                        lambda stage: 'updated' if stage == 'aggregate' else get_code_fingerprint(stage))
+    assert run_stages() == (False, 'inputs unchanged', True, 'inputs changed: code')
+
+
+def test_process_data_removes_outdated_mapped_data(setup_and_cleanup, monkeypatch):
+    test_output_dir, _ = setup_and_cleanup
+    ledger_dir = test_output_dir / 'sample_bitcoin'
+    ledger_dir.mkdir(parents=True, exist_ok=True)
+    timeframe = (datetime.date(2018, 1, 1), datetime.date(2023, 12, 31))
+
+    num_blocks = process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe)
+    assert num_blocks > 0
+    mapped_data = read_mapped_project_data(ledger_dir)
+
+    # remapping from scratch a timeframe without blocks removes the outdated mapped data
+    monkeypatch.setattr(hlp, 'get_mapping_info_fingerprint', lambda project_name: 'updated')
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir,
+                        (datetime.date(2010, 1, 1), datetime.date(2010, 12, 31))) == 0
+    assert not (ledger_dir / hlp.get_mapped_data_filename(True)).exists()
+    assert not (ledger_dir / hlp.get_mapped_data_metadata_filename(True)).exists()
+    assert not (ledger_dir / hlp.get_mapped_columns_dir_name(True)).exists()
+    assert not (ledger_dir / hlp.get_block_count_cube_dir_name(True)).exists()
+
+    # so the blocks are not counted twice when the timeframe is mapped again
+    assert process_data(False, ledger_dir, 'sample_bitcoin', test_output_dir, timeframe) == num_blocks
+    assert read_mapped_project_data(ledger_dir) == mapped_data
+    process_ledger('sample_bitcoin', interim_dir=test_output_dir, timeframe=timeframe, parse_timeframe=timeframe,
+                   estimation_window=None, frequency=None, force_map=False)
+    _, blocks_per_entity = hlp.get_blocks_per_entity_from_file(
+        ledger_dir / 'blocks_per_entity_clustered' / hlp.get_blocks_per_entity_filename(timeframe, None, None))
+    assert sum(blocks for entity_blocks in blocks_per_entity.values() for blocks in entity_blocks.values()) == \
+        num_blocks
@@ -1,11 +1,15 @@
 import datetime
 import argparse
+import json
 import shutil
 import pytest
 from consensus_decentralization.helper import get_pool_identifiers, get_pool_legal_links, get_known_addresses, \
     get_pool_clusters, write_blocks_per_entity_to_file, get_blocks_per_entity_from_file, get_timeframe_beginning, \
     get_timeframe_end, get_time_period, get_ledgers, valid_date, INTERIM_DIR, get_blocks_per_entity_filename, \
-    get_representative_dates
+    get_representative_dates, get_missing_timeframes, get_parse_timeframe, get_appended_offsets, \
+    get_mapping_info_fingerprint, get_legal_links_on_day, get_legal_links_timeline, write_mapped_project_data, \
+    read_mapped_project_data, iter_mapped_project_data, get_mapped_data_filename, config, \
+    write_sparse_blocks_per_entity_to_file, get_sparse_blocks_per_entity_filepaths, get_blocks_per_entity_array_from_file
 from consensus_decentralization.map import ledger_mapping
 
 
@@ -103,6 +107,71 @@ def test_write_read_blocks_per_entity(setup_and_cleanup):
     ])
 
 
+@pytest.mark.parametrize('compression', [None, 'gzip', 'bz2', 'xz'])
+def test_write_read_sparse_blocks_per_entity(setup_and_cleanup, compression):
+    output_dir = setup_and_cleanup
+
+    blocks_per_entity = {
+        'Entity 1': {'2018': 1, '2019': 3, '2020': 2, '2021': 3},
+        'Entity 2': {'2018': 2, '2019': 2, '2021': 1},
+        'Entity 3': {'2018': 2},
+        'Entity 4': {'2021': 1},
+        'Entity, with "special" characters': {'2019': 5}
+    }
+    dates = ['2017', '2018', '2019', '2020', '2021', '2022']
+
+    write_blocks_per_entity_to_file(output_dir=output_dir, blocks_per_entity=blocks_per_entity, dates=dates,
+                                    filename='test.csv')
+    dense_data = {population_windows: get_blocks_per_entity_from_file(output_dir / 'test.csv', population_windows)
+                  for population_windows in [0, 1, 2, 'all']}
+
+    sparse_filepath = write_sparse_blocks_per_entity_to_file(output_dir=output_dir,
+                                                             blocks_per_entity=blocks_per_entity, dates=dates,
+                                                             filename='test.csv', compression=compression)
+    assert get_sparse_blocks_per_entity_filepaths(output_dir, 'test.csv') == [sparse_filepath]
+    # the sparse file takes precedence over the dense one and the data are the same
+    for population_windows, (dense_dates, dense_bpe) in dense_data.items():
+        dates_read, bpe = get_blocks_per_entity_from_file(output_dir / 'test.csv', population_windows)
+        assert dates_read == dense_dates == dates
+        assert bpe == dense_bpe
+        assert list(bpe.keys()) == list(blocks_per_entity.keys())
+
+    # writing the sparse file with a different compression replaces it
+    other_filepath = write_sparse_blocks_per_entity_to_file(output_dir=output_dir, blocks_per_entity={}, dates=dates,
+                                                            filename='test.csv',
+                                                            compression=None if compression else 'gzip')
+    assert get_sparse_blocks_per_entity_filepaths(output_dir, 'test.csv') == [other_filepath]
+    assert get_blocks_per_entity_from_file(output_dir / 'test.csv', 1) == (dates, {})
+
+
+def test_get_blocks_per_entity_array_from_file(setup_and_cleanup):
+    output_dir = setup_and_cleanup
+
+    blocks_per_entity = {
+        'Entity 1': {'2017': 4, '2021': 1},
+        'Entity 2': {'2019': 2},
+        'Entity 3': {'2018': 1, '2019': 1, '2022': 7},
+    }
+    dates = ['2017', '2018', '2019', '2020', '2021', '2022']
+    dense = [[blocks_per_entity[entity].get(date, 0) for date in dates] for entity in blocks_per_entity.keys()]
+
+    write_blocks_per_entity_to_file(output_dir=output_dir, blocks_per_entity=blocks_per_entity, dates=dates,
+                                    filename='test.csv')
+    for population_windows in [0, 1, 2, 10, 'all']:
+        bpe = get_blocks_per_entity_array_from_file(output_dir / 'test.csv', population_windows)
+        assert bpe.dates == dates
+        assert bpe.entities == list(blocks_per_entity.keys())
+        assert bpe.to_dense().tolist() == dense
+        for date_index in range(len(dates)):
+            # the entities that are part of the population are those with blocks within population_windows dates
+            window = range(len(dates)) if population_windows == 'all' else range(
+                max(0, date_index - population_windows), min(len(dates), date_index + population_windows + 1))
+            population_counts = [row[date_index] for row in dense if any(row[i] > 0 for i in window)]
+            assert bpe.get_date_counts(date_index).tolist() == [count for count in population_counts if count > 0]
+            assert bpe.get_date_distribution(date_index) == (sorted(population_counts, reverse=True)[
+                :len(population_counts) - population_counts.count(0)], population_counts.count(0))
+
+
 def test_valid_date():
     for d in ['2022', '2022-01', '2022-01-01']:
         assert valid_date(d)
@@ -184,3 +253,97 @@ def test_get_representative_dates():
         ]
     representative_dates = get_representative_dates(time_chunks)
     assert representative_dates == ['2022-07-02', '2023-07-02', '2024-07-01']
+
+
+def test_get_missing_timeframes():
+    timeframe = (datetime.date(2022, 1, 1), datetime.date(2022, 12, 31))
+    assert get_missing_timeframes(timeframe, None) == [timeframe]
+    assert get_missing_timeframes(timeframe, (datetime.date.min, datetime.date.max)) == []
+    assert get_missing_timeframes(timeframe, (datetime.date(2021, 1, 1), datetime.date(2022, 12, 31))) == []
+
+    mapped_timeframe = (datetime.date(2022, 3, 1), datetime.date(2022, 5, 31))
+    assert get_missing_timeframes(timeframe, mapped_timeframe) == [
+        (datetime.date(2022, 1, 1), datetime.date(2022, 2, 28)),
+        (datetime.date(2022, 6, 1), datetime.date(2022, 12, 31))
+    ]
+
+    # the missing timeframes fill the gap between the mapped timeframe and the requested one
+    mapped_timeframe = (datetime.date(2020, 1, 1), datetime.date(2020, 12, 31))
+    assert get_missing_timeframes(timeframe, mapped_timeframe) == [
+        (datetime.date(2021, 1, 1), datetime.date(2022, 12, 31))
+    ]
+
+
+def test_get_parse_timeframe():
+    timeframe = (datetime.date(2022, 1, 1), datetime.date(2022, 12, 31))
+    assert get_parse_timeframe(timeframe, estimation_window=None, population_windows=1) == timeframe
+    assert get_parse_timeframe(timeframe, estimation_window=30, population_windows='all') == timeframe
+    assert get_parse_timeframe(timeframe, estimation_window=30, population_windows=0) == timeframe
+    assert get_parse_timeframe(timeframe, estimation_window=30, population_windows=2) == (
+        datetime.date(2021, 11, 2), datetime.date(2023, 3, 1))
+    assert get_parse_timeframe((datetime.date.min, datetime.date.max), 30, 2) == (datetime.date.min, datetime.date.max)
+
+
+def test_get_appended_offsets():
+    raw_data_sizes = {'a_raw_data.json': 100, 'b_raw_data.json': 50}
+    assert get_appended_offsets({}, raw_data_sizes) == {}
+    assert get_appended_offsets({'raw_data_offsets': raw_data_sizes}, raw_data_sizes) == {}
+    assert get_appended_offsets({'raw_data_offsets': {'a_raw_data.json': 80}}, raw_data_sizes) == {
+        'a_raw_data.json': (80, 100),
+        'b_raw_data.json': (0, 50)
+    }
+    # raw data that were rewritten or removed cannot be extended
+    assert get_appended_offsets({'raw_data_offsets': {'a_raw_data.json': 120}}, raw_data_sizes) is None
+    assert get_appended_offsets({'raw_data_offsets': {'c_raw_data.json': 10}}, raw_data_sizes) is None
+
+
+def test_get_mapping_info_fingerprint():
+    fingerprint = get_mapping_info_fingerprint('bitcoin')
+    assert fingerprint == get_mapping_info_fingerprint('bitcoin')
+    assert fingerprint != get_mapping_info_fingerprint('ethereum')
+    assert get_mapping_info_fingerprint('non_existent_project') != fingerprint
+
+
+def test_get_legal_links_on_day():
+    timeline = get_legal_links_timeline()
+    assert timeline['change_points'] == sorted(timeline['change_points'])
+    assert timeline['change_points'][0] == '0001-01-01'
+
+    # the links of every day are the same as the ones retrieved by the (uncompiled) get_pool_legal_links function
+    day = datetime.date(2008, 1, 1)
+    while day <= datetime.date(2025, 12, 31):
+        legal_links = get_legal_links_on_day(str(day))
+        expected_legal_links = get_pool_legal_links(timeframe=str(day))
+        assert legal_links == expected_legal_links
+        assert list(legal_links.items()) == list(expected_legal_links.items())
+        day += datetime.timedelta(days=1)
+
+    assert get_legal_links_on_day('2021-03-12')['BTC.COM'] == 'Bitdeer'
+    assert get_legal_links_on_day('2021-05-01')['BTC.COM'] == 'BIT Mining'
+
+
+def test_write_read_mapped_project_data(tmp_path, monkeypatch):
+    monkeypatch.setitem(config['analyze_flags'], 'clustering', True)
+    mapped_data = [
+        {'number': '1', 'timestamp': '2021-01-01 00:00:00 UTC', 'reward_addresses': 'addr1', 'creator': 'Pool A',
+         'mapping_method': 'known_identifiers'},
+        {'number': '2', 'timestamp': '2021-01-02 00:00:00 UTC', 'reward_addresses': None, 'creator': '----- UNDEFINED',
+         'mapping_method': 'fallback_mapping'}
+    ]
+    assert write_mapped_project_data(tmp_path, True, iter(mapped_data)) == 2
+    mapped_data_file = tmp_path / get_mapped_data_filename(True)
+    assert len(mapped_data_file.read_text().splitlines()) == 2
+    assert read_mapped_project_data(tmp_path) == mapped_data
+
+    # the existing mapped data can be read while they are being rewritten
+    assert write_mapped_project_data(tmp_path, True, iter_mapped_project_data(tmp_path)) == 2
+    assert read_mapped_project_data(tmp_path) == mapped_data
+
+    # no file is written when there are no blocks
+    assert write_mapped_project_data(tmp_path, False, []) == 0
+    assert not (tmp_path / get_mapped_data_filename(False)).exists()
+
+    # mapped data in the legacy format (a single JSON array) are also supported
+    with open(mapped_data_file, 'w') as f:
+        json.dump(mapped_data, f, indent=4)
+    assert read_mapped_project_data(tmp_path) == mapped_data
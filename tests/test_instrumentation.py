@@ -0,0 +1,101 @@
+import json
+import shutil
+import time
+import tracemalloc
+import pytest
+from consensus_decentralization.helper import INTERIM_DIR
+from consensus_decentralization.instrumentation import StageRecorder
+
+
+@pytest.fixture
+def output_dir():
+    output_dir = INTERIM_DIR / 'test_output'
+    output_dir.mkdir(parents=True, exist_ok=True)
+    yield output_dir
+    shutil.rmtree(output_dir)
+
+
+def produce_items(num_items, delay):
+    for i in range(num_items):
+        time.sleep(delay)
+        yield i
+
+
+@pytest.mark.parametrize('trace_memory', [False, True])
+def test_stage_recorder(trace_memory):
+    recorder = StageRecorder(trace_memory=trace_memory)
+    with recorder.measure('map', 'sample_ledger') as record:
+        items = [item for item in recorder.measure_iterable(produce_items(5, 0.01), 'parse', 'sample_ledger')]
+        data = [0] * 100000
+        time.sleep(0.05)
+        record['records'] = len(items)
+
+    assert [(record['stage'], record['ledger'], record['records']) for record in recorder.records] == [
+        ('parse', 'sample_ledger', 5), ('map', 'sample_ledger', 5)]
+    parse_record, map_record = recorder.records
+    assert parse_record['wall_time'] >= 0.05
+    # the time of the (nested) parsing is not counted in the time of the mapping
+    assert 0.05 <= map_record['wall_time'] < 0.05 + parse_record['wall_time']
+    assert map_record['throughput'] == pytest.approx(5 / map_record['wall_time'])
+    if trace_memory:
+        assert map_record['peak_traced_mb'] >= len(data) * 8 / 1024 ** 2
+    else:
+        assert map_record['peak_traced_mb'] is None
+
+
+@pytest.mark.parametrize('has_reset_peak', [True, False])
+def test_stage_recorder_nested_peak_memory(monkeypatch, has_reset_peak):
+    if not has_reset_peak:  # as in Python versions before 3.9
+        monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    list_size = 1000000 * 8 / 1024 ** 2
+    recorder = StageRecorder(trace_memory=True)
+    with recorder.measure('map', 'sample_ledger'):
+        data = [0] * 1000000
+        del data
+        with recorder.measure('aggregate', 'sample_ledger'):
+            pass
+    aggregate_record, map_record = recorder.records
+    # the peak of the outer stage includes the allocations that were made before the nested stage started
+    assert map_record['peak_traced_mb'] >= list_size
+    assert aggregate_record['peak_traced_mb'] < list_size
+
+    with recorder.measure('map', 'sample_ledger'):
+        data = [0] * 1000000
+        with recorder.measure('aggregate', 'sample_ledger'):
+            nested_data = [0] * 1000000
+            del nested_data
+        more_data = [0] * 1000000
+        del data, more_data
+    aggregate_record, map_record = recorder.records[2:]
+    # the memory that the outer stage holds during and after the nested stage is counted in its peak
+    assert aggregate_record['peak_traced_mb'] >= list_size
+    assert map_record['peak_traced_mb'] >= 2 * list_size
+    assert not tracemalloc.is_tracing()
+
+
+def test_stage_recorder_exception():
+    recorder = StageRecorder(trace_memory=True)
+    with pytest.raises(ValueError):
+        with recorder.measure('map', 'sample_ledger'):
+            raise ValueError
+    assert not tracemalloc.is_tracing()
+    assert recorder.records == []
+
+
+def test_report_and_summary(output_dir):
+    recorder = StageRecorder()
+    with recorder.measure('analyze'):
+        pass
+
+    recorder.write_report(output_dir / 'report.json', {'ledgers': ['sample_ledger']})
+    with open(output_dir / 'report.json') as f:
+        report = json.load(f)
+    assert report['run'] == {'ledgers': ['sample_ledger']}
+    assert report['stages'] == recorder.records
+
+    lines = recorder.get_summary_table().split('\n')
+    assert len(lines) == 3
+    assert lines[0].split() == ['stage', 'ledger', 'wall', '(s)', 'cpu', '(s)', 'peak', 'rss', '(MB)', 'peak', 'traced',
+                                '(MB)', 'records', 'records/s']
+    assert set(lines[1]) == {'-', ' '}
+    assert lines[2].split()[:2] == ['analyze', '-']
@@ -8,11 +8,14 @@ from consensus_decentralization.parsers.default_parser import DefaultParser
 from consensus_decentralization.parsers.dummy_parser import DummyParser
 from consensus_decentralization.parsers.ethereum_parser import EthereumParser
 from consensus_decentralization.map import apply_mapping, ledger_mapping
+import consensus_decentralization.mappings.default_mapping as default_mapping_module
 from consensus_decentralization.mappings.default_mapping import DefaultMapping
 from consensus_decentralization.mappings.ethereum_mapping import EthereumMapping
 from consensus_decentralization.mappings.cardano_mapping import CardanoMapping
 from consensus_decentralization.mappings.tezos_mapping import TezosMapping
-from consensus_decentralization.helper import INTERIM_DIR, get_clustering_flag, get_input_directories
+from consensus_decentralization.mappings.identifier_matcher import IdentifierMatcher
+from consensus_decentralization.helper import INTERIM_DIR, config, get_clustering_flag, get_input_directories, \
+    read_mapped_project_data
 
 
 @pytest.fixture
@@ -127,8 +130,7 @@ def test_bitcoin_mapping(setup_and_cleanup, prep_sample_bitcoin_mapping_info):
         '510888': 'known_identifiers',
         '649064': 'known_addresses'
     }
-    with open(test_output_dir / 'sample_bitcoin/mapped_data_clustered.json') as f:
-        mapped_data = json.load(f)
+    mapped_data = read_mapped_project_data(test_output_dir / 'sample_bitcoin')
     for block in mapped_data:
         if block['number'] in expected_block_creators:
             assert block['creator'] == expected_block_creators[block['number']]
@@ -160,8 +162,7 @@ def test_ethereum_mapping(setup_and_cleanup, prep_sample_ethereum_mapping_info):
         '11183793': 'known_identifiers'
     }
 
-    with open(test_output_dir / 'sample_ethereum/mapped_data_clustered.json') as f:
-        mapped_data = json.load(f)
+    mapped_data = read_mapped_project_data(test_output_dir / 'sample_ethereum')
     for block in mapped_data:
         if block['number'] in expected_block_creators:
             assert block['creator'] == expected_block_creators[block['number']]
@@ -184,8 +185,7 @@ def test_cardano_mapping(setup_and_cleanup, prep_sample_cardano_mapping_info):
         '66666666666': 'known_clusters',
         '00000000001': 'known_addresses'
     }
-    with open(test_output_dir / 'sample_cardano/mapped_data_clustered.json') as f:
-        mapped_data = json.load(f)
+    mapped_data = read_mapped_project_data(test_output_dir / 'sample_cardano')
     for block in mapped_data:
         if block['number'] in expected_block_creators:
             assert block['creator'] == expected_block_creators[block['number']]
@@ -210,8 +210,7 @@ def test_tezos_mapping(setup_and_cleanup, prep_sample_tezos_mapping_info):
         '1651794': 'fallback_mapping',
         '0000000': 'fallback_mapping'
     }
-    with open(test_output_dir / 'sample_tezos/mapped_data_clustered.json') as f:
-        mapped_data = json.load(f)
+    mapped_data = read_mapped_project_data(test_output_dir / 'sample_tezos')
     for block in mapped_data:
         if block['number'] in expected_block_creators:
             assert block['creator'] == expected_block_creators[block['number']]
@@ -295,3 +294,73 @@ def test_cardano_map_from_known_addresses():
     }
     entity = cardano_mapping.map_from_known_addresses(block)
     assert entity == "----- SPECIAL ADDRESS -----"
+
+
+def test_identifier_matcher():
+    identifiers = ['abc', 'bcd', 'cd', 'd', 'xabcd', 'b']
+    matcher = IdentifierMatcher(identifiers)
+    # the matched identifier is the first one (in the given order) that is contained in the text, not the first one
+    # that appears in the text
+    assert matcher.find_first('xabcdx') == 'abc'
+    assert matcher.find_first('xbcdx') == 'bcd'
+    assert matcher.find_first('xxcd') == 'cd'
+    assert matcher.find_first('xabxd') == 'd'
+    assert matcher.find_first('xxbx') == 'b'
+    assert matcher.find_first('xxxx') is None
+    assert matcher.find_first('') is None
+
+    assert IdentifierMatcher(['abc', '', 'b']).find_first('xbx') == ''
+    assert IdentifierMatcher([]).find_first('abc') is None
+
+
+def test_map_from_known_identifiers():
+    default_mapping = DefaultMapping("sample_bitcoin", output_dir=pathlib.Path(), data_to_map=None)
+    default_mapping.known_identifiers = {'/Pool/': {'name': 'Pool'}, 'Pool': {'name': 'Other Pool'}}
+    default_mapping.known_addresses = dict()
+
+    block = {"number": -1, "timestamp": "2023-08-07 10:34:38+00:00", "identifiers": "b'Pool mined by /Pool/'",
+             "reward_addresses": "addr1"}
+    assert default_mapping.map_from_known_identifiers(block) == 'Pool'
+    assert default_mapping.known_addresses == {'addr1': 'Pool'}
+
+    block = {"number": -2, "timestamp": "2023-08-07 10:35:38+00:00", "identifiers": "b'Pool'",
+             "reward_addresses": "addr1"}
+    assert default_mapping.map_from_known_identifiers(block) == 'Other Pool'
+    assert default_mapping.multi_pool_addresses == ['-2,2023-08-07 10:35:38+00:00,addr1,Other Pool']
+
+    block = {"number": -3, "timestamp": "2023-08-07 10:36:38+00:00", "identifiers": "b'mined by Lady X'",
+             "reward_addresses": "addr2"}
+    assert default_mapping.map_from_known_identifiers(block) is None
+
+
+def test_attribution_cache(tmp_path, monkeypatch):
+    monkeypatch.setitem(config['analyze_flags'], 'clustering', True)
+    payouts = [
+        ("b'/Pool A/'", 'addr1'),
+        ("b'/Pool B/'", 'addr2'),
+        ("b'nothing'", 'addr1'),
+        ("b'nothing'", 'addr1,addr2'),  # multi-pool block, logged every time that it occurs
+        ("b'/Pool B/'", 'addr1'),  # addr1 is learned to belong to Pool B (multi-pool address)
+        ("b'nothing'", 'addr1'),
+        ("b'nothing'", 'addr3'),
+        ("b'nothing'", None)
+    ]
+    blocks = [
+        {'number': i, 'timestamp': f'2021-{1 + i // 30:02d}-{1 + i % 28:02d} 00:00:00 UTC', 'identifiers': identifiers,
+         'reward_addresses': reward_addresses}
+        for i, (identifiers, reward_addresses) in enumerate(payouts * 3 + payouts[::-1] * 3)
+    ]
+
+    mapping_results = []
+    for cache_size in [0, 2, 100]:
+        monkeypatch.setattr(default_mapping_module, 'ATTRIBUTION_CACHE_SIZE', cache_size)
+        mapping = DefaultMapping('sample_bitcoin', output_dir=tmp_path, data_to_map=[dict(block) for block in blocks])
+        mapping.known_identifiers = {'/Pool A/': {'name': 'Pool A'}, '/Pool B/': {'name': 'Pool B'}}
+        mapping.known_addresses = dict()
+        assert mapping.perform_mapping() == len(blocks)
+        assert len(mapping.attribution_cache) <= cache_size
+        mapped_data = read_mapped_project_data(tmp_path)
+        mapping_results.append((mapped_data, mapping.multi_pool_blocks, mapping.multi_pool_addresses))
+
+    assert mapping_results[0] == mapping_results[1] == mapping_results[2]
+    assert mapping_results[0][1] and mapping_results[0][2]  # both kinds of multi-pool logs occurred
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from consensus_decentralization.blocks_per_entity import BlocksPerEntity
+from consensus_decentralization import metric_engine
+from consensus_decentralization.metric_registry import compute_metrics
+from consensus_decentralization.metrics import (entropy, gini, nakamoto_coefficient, herfindahl_hirschman_index,
+                                                theil_index, concentration_ratio, tau_index, total_entities)
+
+METRIC_PARAMS = [
+    ('entropy=1', 'entropy', 1), ('entropy=0', 'entropy', 0), ('entropy=2', 'entropy', 2),
+    ('entropy=-1', 'entropy', -1), ('entropy_percentage=1', 'entropy_percentage', 1),
+    ('entropy_percentage=0', 'entropy_percentage', 0), ('gini', 'gini', None), ('hhi', 'hhi', None),
+    ('nakamoto_coefficient', 'nakamoto_coefficient', None), ('theil_index', 'theil_index', None),
+    ('concentration_ratio=1', 'concentration_ratio', 1), ('concentration_ratio=3', 'concentration_ratio', 3),
+    ('tau_index=0.33', 'tau_index', 0.33), ('tau_index=0.66', 'tau_index', 0.66), ('total_entities', 'total_entities', None)
+]
+METRIC_FUNCTIONS = {
+    'entropy': entropy.compute_entropy, 'entropy_percentage': entropy.compute_entropy_percentage,
+    'gini': gini.compute_gini, 'hhi': herfindahl_hirschman_index.compute_hhi,
+    'nakamoto_coefficient': nakamoto_coefficient.compute_nakamoto_coefficient,
+    'theil_index': theil_index.compute_theil_index, 'concentration_ratio': concentration_ratio.compute_concentration_ratio,
+    'tau_index': tau_index.compute_tau_index, 'total_entities': total_entities.compute_total_entities
+}
+
+
+def compute_metrics_per_date(blocks_per_entity, metric_params):
+    """
+    Computes the given metrics for the distribution of each date separately, with the compute_<metric> functions
+    """
+    results = {metric_name: [] for metric_name, _, _ in metric_params}
+    for date_index in range(len(blocks_per_entity.dates)):
+        date_blocks, num_zero_entities = blocks_per_entity.get_date_distribution(date_index)
+        if not date_blocks:  # dates without any blocks are treated as having no entities at all
+            num_zero_entities = 0
+        for metric_name, metric, param in metric_params:
+            args = (date_blocks, param) if param is not None else (date_blocks,)
+            results[metric_name].append(METRIC_FUNCTIONS[metric](*args, num_zero_entities=num_zero_entities))
+    return results
+
+
+@pytest.mark.parametrize('population_windows', [0, 1, 'all'])
+@pytest.mark.parametrize('cells_per_batch', [metric_engine.CELLS_PER_BATCH, 10])
+@pytest.mark.parametrize('initial_top_entities', [metric_engine.INITIAL_TOP_ENTITIES, 1])
+def test_compute_metrics(monkeypatch, population_windows, cells_per_batch, initial_top_entities):
+    """
+    Ensure that the batched metric engine produces the same results as the compute_<metric> functions
+    """
+    monkeypatch.setattr(metric_engine, 'CELLS_PER_BATCH', cells_per_batch)
+    monkeypatch.setattr(metric_engine, 'INITIAL_TOP_ENTITIES', initial_top_entities)
+    rng = np.random.default_rng(42)
+    num_entities, num_dates = 12, 20
+    blocks = rng.integers(1, 50, size=(num_entities, num_dates)) * (rng.random((num_entities, num_dates)) < 0.3)
+    blocks[:, 5] = 0  # a date without blocks
+    blocks[:, 6] = 0
+    blocks[3, 6] = 7  # a date with a single entity
+    entity_indices, date_indices = np.nonzero(blocks)
+    blocks_per_entity = BlocksPerEntity.from_cells(
+        dates=[f'date_{i}' for i in range(num_dates)], entities=[f'entity_{i}' for i in range(num_entities)],
+        entity_indices=entity_indices, date_indices=date_indices, counts=blocks[entity_indices, date_indices],
+        population_windows=population_windows)
+
+    batched_results = compute_metrics(blocks_per_entity, METRIC_PARAMS)
+    expected_results = compute_metrics_per_date(blocks_per_entity, METRIC_PARAMS)
+    for metric_name, _, _ in METRIC_PARAMS:
+        assert len(batched_results[metric_name]) == num_dates
+        for result, expected in zip(batched_results[metric_name], expected_results[metric_name]):
+            assert (result is None) == (expected is None)
+            assert isinstance(result, int) == isinstance(expected, int)
+            if expected is not None:
+                assert result == pytest.approx(expected)
+
+    with pytest.raises(ValueError):
+        compute_metrics(blocks_per_entity, [('unknown', 'unknown', None)])
@@ -1,5 +1,6 @@
 from consensus_decentralization.metrics import (entropy, gini, nakamoto_coefficient, herfindahl_hirschman_index,
                                                 theil_index, concentration_ratio, tau_index, total_entities)
+from consensus_decentralization.metrics.distribution_statistics import DistributionStatistics
 import numpy as np
 
 
@@ -206,3 +207,43 @@ def test_total_entities():
 
     entity_count = total_entities.compute_total_entities(block_distribution=[5, 0, 0])
     assert entity_count == 1
+
+
+def test_unsorted_distribution():
+    """
+    Ensure that the metrics produce the same results for the statistics of an unsorted distribution as for the ones of
+    the sorted distribution
+    """
+    metric_functions = [
+        lambda statistics: tau_index.compute_tau_index_from_statistics(statistics, 0.33),
+        lambda statistics: tau_index.compute_tau_index_from_statistics(statistics, 0.9),
+        nakamoto_coefficient.compute_nakamoto_coefficient_from_statistics,
+        lambda statistics: concentration_ratio.compute_concentration_ratio_from_statistics(statistics, 1),
+        lambda statistics: concentration_ratio.compute_concentration_ratio_from_statistics(statistics, 3),
+        gini.compute_gini_from_statistics
+    ]
+    block_distribution = [1, 7, 2, 2, 9, 1, 1, 4, 3, 1, 1, 5]
+    sorted_statistics = DistributionStatistics(sorted(block_distribution, reverse=True))
+    unsorted_statistics = DistributionStatistics(block_distribution, is_sorted=False)
+    results = [function(unsorted_statistics) for function in metric_functions]
+    assert results == [function(sorted_statistics) for function in metric_functions]
+    assert results[1] == 9
+
+
+def test_num_zero_entities():
+    """
+    Ensure that giving the entities without blocks as a count produces the same results as listing them explicitly
+    """
+    metric_functions = [
+        (gini.compute_gini, []), (theil_index.compute_theil_index, []), (total_entities.compute_total_entities, []),
+        (herfindahl_hirschman_index.compute_hhi, []), (nakamoto_coefficient.compute_nakamoto_coefficient, []),
+        (concentration_ratio.compute_concentration_ratio, [2]), (tau_index.compute_tau_index, [0.66]),
+        (entropy.compute_entropy, [1]), (entropy.compute_entropy, [0]), (entropy.compute_entropy, [2]),
+        (entropy.compute_entropy, [-1]), (entropy.compute_entropy_percentage, [0])
+    ]
+    for nonzero_blocks in [[5, 3, 1, 1], [7]]:
+        for num_zero_entities in [0, 1, 4]:
+            for func, params in metric_functions:
+                expected = func(nonzero_blocks + [0] * num_zero_entities, *params)
+                result = func(nonzero_blocks, *params, num_zero_entities=num_zero_entities)
+                assert result == expected or np.isclose(result, expected)
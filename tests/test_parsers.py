@@ -1,9 +1,13 @@
+import datetime
+import json
 import pytest
+import consensus_decentralization.parsers.default_parser as default_parser
 from consensus_decentralization.parse import parse, ledger_parser
 from consensus_decentralization.parsers.default_parser import DefaultParser
 from consensus_decentralization.parsers.dummy_parser import DummyParser
 from consensus_decentralization.parsers.ethereum_parser import EthereumParser
 from consensus_decentralization.helper import get_input_directories
+from consensus_decentralization.compression import get_compression, open_file
 
 
 @pytest.fixture
@@ -93,6 +97,174 @@ def test_parse(setup):
         f.write(sample_data)
 
 
+def test_read_and_sort_data(setup, monkeypatch):
+    test_raw_data_dirs = setup
+    parser = DefaultParser(ledger='sample_bitcoin', input_dirs=test_raw_data_dirs)
+    input_file, = parser.get_input_files()
+    assert not parser.is_sorted(input_file)
+
+    with open(input_file, 'rb') as f:
+        expected_data = sorted([parser.decode_block(line) for line in f], key=lambda x: x['timestamp'])
+
+    # force the external merge sort to spill multiple runs to disk
+    monkeypatch.setattr(default_parser, 'SORT_RUN_SIZE', 3)
+    assert list(parser.read_and_sort_data()) == expected_data
+
+    parser = EthereumParser(ledger='sample_ethereum', input_dirs=test_raw_data_dirs)
+    timestamps = [block['timestamp'] for block in parser.read_and_sort_data()]
+    assert timestamps == sorted(timestamps)
+
+
+def test_decode_block(setup):
+    test_raw_data_dirs = setup
+    input_file = test_raw_data_dirs[0] / 'sample_bitcoin_raw_data.json'
+    with open(input_file, 'rb') as f:
+        line = f.readline()
+
+    raw_block = json.loads(line)
+    block = DefaultParser.decode_block(line)
+    assert set(block.keys()) == {'number', 'timestamp', 'identifiers', 'outputs'}
+    assert all(set(tx.keys()) == {'addresses', 'value'} for tx in block['outputs'])
+    assert [tx['addresses'][:1] for tx in raw_block['outputs']] == [tx['addresses'] for tx in block['outputs']]
+    # projecting an already projected block leaves it unchanged
+    assert DefaultParser.decode_block(DefaultParser(ledger='sample_bitcoin', input_dirs=[]).project_line(line)) == block
+
+
+def test_parse_timeframes(setup):
+    test_raw_data_dirs = setup
+    timeframes = [(datetime.date(2018, 2, 1), datetime.date(2018, 2, 10)),
+                  (datetime.date(2021, 1, 1), datetime.date(2021, 12, 31))]
+    for workers in [1, 2]:
+        parser = DefaultParser(ledger='sample_bitcoin', input_dirs=test_raw_data_dirs, workers=workers,
+                               timeframes=timeframes)
+        parsed_numbers = [block['number'] for block in parser.parse()]
+        assert parsed_numbers == ['507516', '507715', '508434', '682736']
+
+    parser = DefaultParser(ledger='sample_bitcoin', input_dirs=test_raw_data_dirs,
+                           timeframes=[(datetime.date(2010, 1, 1), datetime.date(2010, 12, 31))])
+    assert list(parser.parse()) == []
+
+
+def test_parallel_parse(setup):
+    test_raw_data_dirs = setup
+    for ledger, parser_class in [('sample_bitcoin', DefaultParser), ('sample_tezos', DummyParser)]:
+        sequential_data = list(parser_class(ledger=ledger, input_dirs=test_raw_data_dirs).parse())
+        parallel_data = list(parser_class(ledger=ledger, input_dirs=test_raw_data_dirs, workers=3).parse())
+        assert parallel_data == sequential_data
+
+
+def test_get_byte_ranges(setup):
+    test_raw_data_dirs = setup
+    input_file = test_raw_data_dirs[0] / 'sample_bitcoin_raw_data.json'
+    with open(input_file, 'rb') as f:
+        contents = f.read()
+
+    for num_ranges in [1, 2, 5, 100]:
+        byte_ranges = DefaultParser.get_byte_ranges(input_file, num_ranges)
+        assert len(byte_ranges) <= num_ranges
+        assert byte_ranges[0][0] == 0 and byte_ranges[-1][1] == len(contents)
+        for (_, end), (next_start, _) in zip(byte_ranges, byte_ranges[1:]):
+            assert end == next_start
+            assert contents[end - 1:end] == b'\n'
+
+
+def test_parse_offsets(setup):
+    test_raw_data_dirs = setup
+    input_file = test_raw_data_dirs[0] / 'sample_bitcoin_raw_data.json'
+    with open(input_file, 'rb') as f:
+        lines = f.readlines()
+    offset = sum(len(line) for line in lines[:8])
+
+    parser = DefaultParser(ledger='sample_bitcoin', input_dirs=test_raw_data_dirs)
+    checkpoint = parser.get_checkpoint()
+    assert checkpoint == {'raw_data_offsets': {str(input_file): offset + sum(len(line) for line in lines[8:])},
+                          'last_block_number': 649064}
+
+    expected_blocks = sorted([parser.decode_block(line) for line in lines[8:]], key=lambda block: block['timestamp'])
+    for workers in [1, 2]:
+        tail_parser = DefaultParser(ledger='sample_bitcoin', input_dirs=test_raw_data_dirs, workers=workers,
+                                    offsets={str(input_file): (offset, checkpoint['raw_data_offsets'][str(input_file)])})
+        assert [block['number'] for block in tail_parser.parse()] == [block['number'] for block in expected_blocks]
+
+    assert DefaultParser.read_last_line(input_file, offset) == lines[7].rstrip()
+    assert DefaultParser.read_last_line(input_file, 0) is None
+
+
+def test_sharded_input(setup, tmp_path):
+    test_raw_data_dirs = setup
+    with open(test_raw_data_dirs[0] / 'sample_bitcoin_raw_data.json') as f:
+        lines = f.readlines()
+    expected_blocks = list(parse('sample_bitcoin', test_raw_data_dirs))
+
+    # the shards are spread across two directories and the first and second shards overlap
+    shard_dirs = [tmp_path / 'disk_1', tmp_path / 'disk_2']
+    for shard_dir in shard_dirs:
+        shard_dir.mkdir()
+    shards = {
+        shard_dirs[0] / 'sample_bitcoin_raw_data_1.json': lines[:6],
+        shard_dirs[1] / 'sample_bitcoin_raw_data_2.json': lines[4:10],
+        shard_dirs[0] / 'sample_bitcoin_raw_data_3.json': lines[10:]
+    }
+    for filepath, shard_lines in shards.items():
+        with open(filepath, 'w') as f:
+            f.writelines(shard_lines)
+    (shard_dirs[1] / 'sample_bitcoin_cash_raw_data.json').write_text(lines[0])  # belongs to a different ledger
+
+    parser = DefaultParser(ledger='sample_bitcoin', input_dirs=shard_dirs)
+    assert parser.get_input_files() == sorted(shards.keys())
+    assert parser.get_checkpoint()['last_block_number'] == 649064
+    for workers in [1, 2]:
+        assert list(parse('sample_bitcoin', shard_dirs, workers=workers)) == expected_blocks
+
+    with pytest.raises(FileNotFoundError):
+        DefaultParser(ledger='sample_bitcoin', input_dirs=[tmp_path]).get_input_files()
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'bz2', 'xz', 'zstd'])
+def test_compressed_input(setup, tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    test_raw_data_dirs = setup
+    with open(test_raw_data_dirs[0] / 'sample_bitcoin_raw_data.json', 'rb') as f:
+        lines = f.readlines()
+    expected_blocks = list(parse('sample_bitcoin', test_raw_data_dirs))
+
+    extension = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zstd': '.zst'}[compression]
+    input_file = tmp_path / f'sample_bitcoin_raw_data.json{extension}'
+    with open_file(input_file, 'wb') as f:
+        f.writelines(lines[:8])
+    offset = input_file.stat().st_size
+    with open_file(input_file, 'ab') as f:  # appended data are written as a separate compressed stream
+        f.writelines(lines[8:])
+    assert get_compression(input_file) == compression
+
+    parser = DefaultParser(ledger='sample_bitcoin', input_dirs=[tmp_path])
+    assert parser.get_checkpoint()['last_block_number'] == 649064
+    for workers in [1, 2]:
+        assert list(parse('sample_bitcoin', [tmp_path], workers=workers)) == expected_blocks
+
+    tail_parser = DefaultParser(ledger='sample_bitcoin', input_dirs=[tmp_path],
+                                offsets={str(input_file): (offset, input_file.stat().st_size)})
+    assert sorted(block['number'] for block in tail_parser.parse()) == sorted(
+        parser.decode_block(line)['number'] for line in lines[8:])
+
+    # the compression is also detected from the contents of the file, regardless of its extension
+    renamed_file = input_file.rename(tmp_path / 'sample_bitcoin_raw_data.json')
+    assert get_compression(renamed_file) == compression
+    assert list(parse('sample_bitcoin', [tmp_path])) == expected_blocks
+
+
+def test_prefetch():
+    assert list(DefaultParser.prefetch(range(1000))) == list(range(1000))
+
+    def failing_blocks():
+        yield 1
+        raise ValueError('corrupted raw data')
+
+    with pytest.raises(ValueError):
+        list(DefaultParser.prefetch(failing_blocks()))
+
+
 def test_default_parse_identifiers():
     parsed_identifiers = DefaultParser.parse_identifiers('0343bf07132f6d696e65642062792067626d696e6572732f2cfabe6d6d94976ecebbc73b3d4214b3d7ab330dca2129ebfcc863fa75623c6f95891e7346010000000000000010af8b66002da910ef408c776852840100')
     assert parsed_identifiers == "b'\\x03C\\xbf\\x07\\x13/mined by gbminers/,\\xfa\\xbemm\\x94\\x97n\\xce\\xbb\\xc7;=B\\x14\\xb3\\xd7\\xab3\\r\\xca!)\\xeb\\xfc\\xc8c\\xfaub<o\\x95\\x89\\x1esF\\x01\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x10\\xaf\\x8bf\\x00-\\xa9\\x10\\xef@\\x8cwhR\\x84\\x01\\x00'"
@@ -0,0 +1,69 @@
+import shutil
+import pytest
+from consensus_decentralization.helper import INTERIM_DIR
+import consensus_decentralization.stage_cache as cache
+
+
+@pytest.fixture
+def ledger_dir():
+    ledger_dir = INTERIM_DIR / 'test_output' / 'sample_ledger'
+    ledger_dir.mkdir(parents=True, exist_ok=True)
+    yield ledger_dir
+    shutil.rmtree(ledger_dir.parent)
+
+
+def test_get_code_fingerprint():
+    assert cache.get_code_fingerprint('map') == cache.get_code_fingerprint.__wrapped__('map')
+    assert cache.get_code_fingerprint('map') != cache.get_code_fingerprint('aggregate')
+    with pytest.raises(KeyError):
+        cache.get_code_fingerprint('unknown_stage')
+
+
+@pytest.mark.parametrize('stage, function_name', [
+    ('map', 'resolve_legal_links'), ('aggregate', 'write_sparse_blocks_per_entity_to_file')])
+def test_get_code_fingerprint_covers_helper(ledger_dir, monkeypatch, stage, function_name):
+    """
+    Ensure that changing a helper function that a stage uses changes the fingerprint of the code of the stage
+    """
+    package_dir = ledger_dir / 'consensus_decentralization'
+    shutil.copytree(cache.PACKAGE_DIR, package_dir, ignore=shutil.ignore_patterns('__pycache__'))
+    monkeypatch.setattr(cache, 'PACKAGE_DIR', package_dir)
+    fingerprint = cache.get_code_fingerprint.__wrapped__(stage)
+
+    helper_file = package_dir / 'helper.py'
+    helper_code = helper_file.read_text()
+    assert f'def {function_name}(' in helper_code
+    helper_file.write_text(helper_code.replace(f'def {function_name}(', f'def {function_name}_changed('))
+    assert cache.get_code_fingerprint.__wrapped__(stage) != fingerprint
+
+
+def test_get_stage_key():
+    key = cache.get_stage_key({'mapped_data': 'abc', 'frequency': 30})
+    assert key == cache.get_stage_key({'frequency': 30, 'mapped_data': 'abc'})
+    assert key != cache.get_stage_key({'mapped_data': 'abc', 'frequency': 31})
+
+
+def test_get_run_reason(ledger_dir):
+    inputs = {'mapped_data': 'abc', 'timeframe': ['2018-02-01', '2018-03-31'], 'frequency': 30}
+    stage_id = 'aggregate:output.csv'
+    assert cache.get_run_reason(ledger_dir, stage_id, inputs, output_exists=False) == 'no existing output'
+    assert cache.get_run_reason(ledger_dir, stage_id, inputs, output_exists=True) == \
+        'no record of the inputs of the existing output'
+
+    cache.record_stage(ledger_dir, stage_id, inputs, reason='no existing output')
+    manifest = cache.read_manifest(ledger_dir)
+    assert manifest[stage_id]['ran'] is True
+    assert manifest[stage_id]['reason'] == 'no existing output'
+    assert manifest[stage_id]['inputs'] == inputs
+    assert cache.get_run_reason(ledger_dir, stage_id, inputs, output_exists=True) is None
+    assert cache.get_run_reason(ledger_dir, stage_id, inputs, output_exists=True, force_reason='forced') == 'forced'
+    assert cache.get_run_reason(ledger_dir, 'aggregate:other_output.csv', inputs, output_exists=True) == \
+        'no record of the inputs of the existing output'
+
+    changed_inputs = {**inputs, 'mapped_data': 'def', 'frequency': 31}
+    assert cache.get_run_reason(ledger_dir, stage_id, changed_inputs, output_exists=True) == \
+        'inputs changed: frequency, mapped_data'
+
+    cache.record_stage(ledger_dir, stage_id, inputs, reason=None)
+    assert cache.read_manifest(ledger_dir)[stage_id]['ran'] is False
+    assert cache.read_manifest(ledger_dir)[stage_id]['reason'] == 'inputs unchanged'